@@ -0,0 +1,266 @@
+"""
+Live achievement tracking for Cube Combat.
+
+Each locked achievement in Save_file/achievements.txt gets a small state
+machine that is fed combat events from Combat_log as they happen. A
+dispatch table maps event kind to the rules that care about it, so each
+event costs one dict lookup plus one step per interested rule, and
+nothing polls per frame. When a rule completes, the achievement is marked
+unlocked in memory right away. Saving it happens on a background thread
+so gameplay never waits on the disk.
+
+    python Achievements.py --selftest
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import queue
+import threading
+
+import Combat_log
+
+
+class SequenceRule:
+    """Unlocks when the listed (kind, actor, flag) events happen in order, optionally within a time limit."""
+
+    def __init__(self, achievement_id, steps, within_ms=None, reset_kinds=(Combat_log.EVENT_MATCH_START,)):
+        self.achievement_id = achievement_id
+        self.steps = steps
+        self.within_ms = within_ms
+        self.reset_kinds = reset_kinds
+        self.kinds = {step[0] for step in steps} | set(reset_kinds)
+        self.index = 0
+        self.started_at = 0.0
+
+    def feed(self, kind, time, actor, flag, value, extra):
+        if kind in self.reset_kinds:
+            self.index = 0
+            return False
+
+        if self.index and self.within_ms is not None and time - self.started_at > self.within_ms:
+            self.index = 0
+
+        event = (kind, actor, bool(flag))
+        if event == self.steps[self.index]:
+            if self.index == 0:
+                self.started_at = time
+            self.index += 1
+            return self.index == len(self.steps)
+        if event == self.steps[0]:
+            # a fresh first step restarts a half-finished sequence
+            self.index = 1
+            self.started_at = time
+        return False
+
+
+class ThresholdRule:
+    """
+    Tracks one number through the match (for example the blue cube's health)
+    and unlocks when the trigger event arrives while it is below the limit.
+    """
+
+    def __init__(self, achievement_id, start_value, updates, trigger, below, opponent_cube=None):
+        self.achievement_id = achievement_id
+        self.start_value = start_value
+        self.updates = updates          # {(kind, actor)} whose event extra becomes the new value
+        self.trigger = trigger          # (kind, actor)
+        self.below = below
+        self.opponent_cube = opponent_cube
+        self.kinds = {kind for kind, _ in updates} | {trigger[0], Combat_log.EVENT_MATCH_START}
+        self.value = start_value
+        self.opponent_matches = opponent_cube is None
+
+    def feed(self, kind, time, actor, flag, value, extra):
+        if kind == Combat_log.EVENT_MATCH_START:
+            self.value = self.start_value
+            if self.opponent_cube is not None:
+                self.opponent_matches = int(extra) % 1000 == self.opponent_cube
+            return False
+
+        if (kind, actor) in self.updates:
+            self.value = extra
+            return False
+
+        if (kind, actor) == self.trigger:
+            return self.opponent_matches and 0 < self.value < self.below
+        return False
+
+
+def default_rules(parry_stun_ms, max_health, dev_cube_id):
+    """The rules behind the achievements that can be earned in a fight."""
+    return {
+        # "im not gonna sugar coat it": parry, then land your own hit while red is still stunned
+        3: SequenceRule(3, (
+            (Combat_log.EVENT_PARRY, Combat_log.ACTOR_BLUE, True),
+            (Combat_log.EVENT_SLASH, Combat_log.ACTOR_BLUE, True),
+        ), within_ms=parry_stun_ms),
+        # "filled with determination": beat the AI's cube with less than 25% health left
+        4: ThresholdRule(4, max_health, {
+            (Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED),
+            (Combat_log.EVENT_CHARGE_HIT, Combat_log.ACTOR_RED),
+        }, trigger=(Combat_log.EVENT_MATCH_END, Combat_log.ACTOR_BLUE),
+            below=max_health * 0.25, opponent_cube=dev_cube_id),
+    }
+
+
+_dispatch = {}          # event kind -> list of rules
+_achievements = {}      # id -> the achievement dict Greg shows on screen
+_save_queue = queue.Queue()
+_save_thread = None
+_save_achievement = None
+
+
+def _on_event(kind, time, actor, flag, value, extra):
+    rules = _dispatch.get(kind)
+    if not rules:
+        return
+    for rule in tuple(rules):
+        if rule.feed(kind, time, actor, flag, value, extra):
+            unlock(rule.achievement_id)
+
+
+def compile_rules(rules):
+    """Builds the kind -> rules table for every rule whose achievement is still locked."""
+    _dispatch.clear()
+    for achievement_id, rule in rules.items():
+        achievement = _achievements.get(achievement_id)
+        if achievement is None or achievement['unlocked']:
+            continue
+        for kind in rule.kinds:
+            _dispatch.setdefault(kind, []).append(rule)
+
+
+def unlock(achievement_id):
+    """Marks an achievement unlocked now and queues the file update."""
+    achievement = _achievements.get(achievement_id)
+    if achievement is None or achievement['unlocked']:
+        return
+    achievement['unlocked'] = True
+
+    for kind in list(_dispatch):
+        _dispatch[kind] = [rule for rule in _dispatch[kind] if rule.achievement_id != achievement_id]
+        if not _dispatch[kind]:
+            del _dispatch[kind]
+
+    _save_queue.put(achievement_id)
+
+
+def _save_worker():
+    while True:
+        achievement_id = _save_queue.get()
+        if achievement_id is None:
+            return
+        achievement = _achievements[achievement_id]
+        print(f"Achievement unlocked: {achievement['name']} (unlocks {achievement['unlocks']})")
+        if _save_achievement is not None:
+            _save_achievement(achievement)
+
+
+def start(achievements, rules, save_achievement=None):
+    """
+    Hooks the rules up to the combat log. `achievements` is Greg's list of
+    achievement dicts, updated in place on unlock; save_achievement(achievement)
+    is called on the saver thread for each unlock.
+    """
+    global _save_thread, _save_achievement
+    _achievements.clear()
+    _achievements.update({achievement['id']: achievement for achievement in achievements})
+    _save_achievement = save_achievement
+
+    compile_rules(rules)
+    Combat_log.unsubscribe(_on_event)
+    if _dispatch:
+        Combat_log.subscribe(_on_event, kinds=tuple(_dispatch), sync=True)
+
+    if _save_thread is None:
+        _save_thread = threading.Thread(target=_save_worker, name="achievement-saver", daemon=True)
+        _save_thread.start()
+
+
+def stop():
+    """Stops listening and waits for pending unlocks to be saved."""
+    global _save_thread
+    Combat_log.unsubscribe(_on_event)
+    if _save_thread is not None:
+        _save_queue.put(None)
+        _save_thread.join()
+        _save_thread = None
+
+
+def selftest():
+    """
+    Earns every default rule once, from the MATCH_START events Greg really
+    emits (so the rule's cube ids have to match what the game plays) and
+    scripted fight events after them. Also checks that near misses stay locked.
+    """
+    import Replay
+
+    game = Replay._game()
+    rules = default_rules(game.ENDLAG_DURATION_MS * 2, game.INITIAL_BLUE_HEALTH, game.DEV_CUBE_ID)
+    achievements = [{'id': achievement_id, 'name': f"rule {achievement_id}", 'unlocks': "nothing", 'unlocked': False}
+                    for achievement_id in rules]
+    emit = Combat_log.emit
+    blue, red = Combat_log.ACTOR_BLUE, Combat_log.ACTOR_RED
+    low_health = game.INITIAL_BLUE_HEALTH * 0.2
+
+    def play(mode, events, p2_cube=None):
+        game.selected_mode = mode
+        game.character_select_state['p2_selection_id'] = p2_cube
+        game.start_match(1)
+        for at_ms, kind, actor, flag, value, extra in events:
+            Combat_log.match_time = at_ms
+            emit(kind, actor, flag, value, extra)
+
+    cases = (
+        # (what, achievement id, unlocked afterwards, mode, p2 cube, events)
+        ("slash long after the parry stun", 3, False, 'ai', None, (
+            (1000.0, Combat_log.EVENT_PARRY, blue, True, 0, 0.0),
+            (1000.0 + rules[3].within_ms + 100, Combat_log.EVENT_SLASH, blue, True, 10, 90.0))),
+        ("parry then slash", 3, True, 'ai', None, (
+            (1000.0, Combat_log.EVENT_PARRY, blue, True, 0, 0.0),
+            (1200.0, Combat_log.EVENT_SLASH, blue, True, 10, 90.0))),
+        ("low-health win over another PvP cube", 4, False, 'pvp', 3, (
+            (500.0, Combat_log.EVENT_BEAM, red, True, 80, low_health),
+            (900.0, Combat_log.EVENT_MATCH_END, blue, False, 0, 0.0))),
+        ("low-health win over the AI", 4, True, 'ai', None, (
+            (500.0, Combat_log.EVENT_BEAM, red, True, 80, low_health),
+            (900.0, Combat_log.EVENT_MATCH_END, blue, False, 0, 0.0))),
+    )
+
+    start(achievements, rules)
+    by_id = {achievement['id']: achievement for achievement in achievements}
+    failures = 0
+    try:
+        for what, achievement_id, expected, mode, p2_cube, events in cases:
+            play(mode, events, p2_cube)
+            unlocked = by_id[achievement_id]['unlocked']
+            print(f"{'ok  ' if unlocked == expected else 'FAIL'} achievement {achievement_id}: {what} -> "
+                  f"{'unlocked' if unlocked else 'locked'}")
+            failures += unlocked != expected
+    finally:
+        stop()
+    never = [achievement_id for achievement_id in rules if not by_id[achievement_id]['unlocked']]
+    if never:
+        print("never unlocked:", ", ".join(map(str, never)))
+    print("SELFTEST", "FAIL" if failures or never else "PASS")
+    return 1 if failures or never else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat live achievements")
+    parser.add_argument('--selftest', action='store_true', help="earn every default rule once in scripted matches")
+    args = parser.parse_args()
+    if args.selftest:
+        return selftest()
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,526 @@
+"""
+Per-frame allocation instrumentation for Cube Combat (debug mode).
+
+Once installed, the probe
+    swaps pygame.Rect, pygame.Surface and pygame.font.Font for counting
+        subclasses, so every construction spelled pygame.Rect(...) and so
+        on in Python is tallied; objects built in C (rect.move(),
+        surface.copy(), transform.rotate(), font.render()) skip the classes
+    diffs tracemalloc snapshots filtered to the game's own source files
+        (optional, every snapshot_every frames): when those files keep more
+        blocks alive than they ever have, the growth is charged as
+        'retained' to the lines that went past their own high, however the
+        objects were built (a value that is replaced every frame, or moves
+        from one line to another, stays under the highs and costs nothing)
+    wraps the scene functions and the hot code paths in Greg
+        (check_hitbox_collision, get_ai_beam_rect, draw_text, ...) so each
+        construction is charged to the innermost path that was running;
+        Rects built directly by a menu scene are its button Rects
+    runs tracemalloc and records the Python-heap high-water mark of every
+        frame and every wrapped path (the garbage a frame makes, even if it
+        is freed before the frame ends)
+    times every gc pass through gc.callbacks, charged to the running scene
+
+Greg calls begin_frame(scene) once per loop iteration, which closes the
+previous frame. A summary is printed every report_every frames.
+
+Per-scene budgets cap the constructed objects per frame (and optionally
+the per-frame heap high-water in bytes). Set them with CUBE_ALLOC_BUDGETS:
+
+    CUBE_ALLOC_BUDGETS="game=0,menu=40:65536" CUBE_ALLOC_BUDGET_ACTION=fail python Greg.py
+
+With the 'log' action (the default) a frame over budget prints its
+breakdown, at most once per report per scene. 'fail' raises
+AllocationBudgetError instead.
+
+Greg installs the probe when debug mode is on at startup or when
+CUBE_ALLOC_PROBE=1. It can also be run headless against the fight loop:
+
+    python Alloc_probe.py --frames 3000 --budget game=0
+
+--check is the zero-allocation gate for the fight loop: after a warm-up
+(caches filled, first beams rotated), AI and PvP fights must not construct
+a single Rect, Surface or Font per frame and must stay under
+CHECK_HEAP_BYTES of heap high-water per frame. Across the whole run the
+game's files may retain at most CHECK_RETAINED_BLOCKS new blocks: a HUD
+label for a health value not seen yet is fine, a per-frame leak or cache
+miss (thousands) is not. Every steady-state run has to slash, fire beams
+and charge, and throw hit sparks (a ParticleSystem runs as in the game),
+or the check fails for not having exercised those paths.
+
+    python Alloc_probe.py --check
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+import pygame
+
+import Combat_log
+import Particles
+
+SCENE_FUNCTIONS = ('main_menu', 'mode_select_menu', 'character_select_scene',
+                   'collected_cubes_scene', 'achievements_scene', 'game_scene')
+CODE_PATHS = ('update_game', 'draw_game', 'draw_game_over', 'draw_health_bars', 'draw_text',
+              'check_hitbox_collision', 'get_ai_beam_rect', 'draw_ai_beam',
+              'execute_ai_special_attack', 'execute_ai_special_attack_red', 'do_special_attack_blue',
+              'draw_cube_preview', 'draw_cube_detail_panel')
+OUTSIDE = '<outside>'
+
+DEFAULT_REPORT_EVERY = 600
+CHECK_WARMUP_FRAMES = 3000
+CHECK_HEAP_BYTES = 2560     # per-frame high-water; a steady fight frame's short-lived floats and tuples are ~500 B,
+                            # and spawning or drawing sparks adds up to ~1.6 KB of NumPy call overhead, however many are alive
+CHECK_RETAINED_BLOCKS = 16
+CHECK_SNAPSHOT_EVERY = 10
+CHECK_EVENTS = (Combat_log.EVENT_SLASH, Combat_log.EVENT_BEAM, Combat_log.EVENT_CHARGE_START)
+BUDGET_ACTIONS = ('log', 'fail')
+
+
+class AllocationBudgetError(RuntimeError):
+    pass
+
+
+def parse_budgets(text):
+    """'scene=count[:bytes],...' -> {scene: (count, bytes or None)}."""
+    budgets = {}
+    for part in filter(None, (part.strip() for part in (text or '').split(','))):
+        scene, _, spec = part.partition('=')
+        count, _, max_bytes = spec.partition(':')
+        if not scene or not count:
+            raise ValueError(f"expected scene=count[:bytes], got {part!r}")
+        budgets[scene.strip()] = (int(count), int(max_bytes) if max_bytes else None)
+    return budgets
+
+
+class Probe:
+    def __init__(self, game, budgets=None, action='log', report_every=DEFAULT_REPORT_EVERY, out=None,
+                 snapshot_every=0):
+        if action not in BUDGET_ACTIONS:
+            raise ValueError(f"Unknown budget action: {action}")
+        self.game = game
+        self.budgets = budgets or {}
+        self.action = action
+        self.report_every = report_every
+        self.out = out or sys.stderr
+
+        self.scene = None
+        self.frame_counts = Counter()       # (path, kind) -> constructions this frame
+        # [path, traced bytes at entry, highest peak seen inside] per wrapped call in progress; the lists
+        # are reused from frame to frame so the probe's own bookkeeping doesn't show up as the game's heap
+        self.path_stack = []
+        self.depth = 0
+        self.frame_start_bytes = 0
+        self.frame_peak = 0                 # high-water from paths that already reset tracemalloc's peak
+
+        self.frames = Counter()                     # scene -> frames
+        self.objects = Counter()                    # scene -> constructions
+        self.max_objects = Counter()                # scene -> most constructions in one frame
+        self.heap_bytes = Counter()                 # scene -> summed per-frame heap high-water
+        self.max_heap_bytes = Counter()
+        self.paths = defaultdict(Counter)           # scene -> (path, kind) -> constructions
+        self.path_bytes = defaultdict(Counter)      # scene -> path -> summed heap high-water
+        self.gc_passes = defaultdict(Counter)       # scene -> generation -> passes
+        self.gc_ms = Counter()
+        self.max_gc_ms = Counter()
+        self.over_budget = Counter()
+        self.retained = defaultdict(Counter)        # scene -> 'file:line' -> blocks kept alive past the line's high
+        self.logged_budget = set()
+        self.frames_since_report = 0
+
+        self.snapshot_every = snapshot_every
+        self.snapshot_filters = ()
+        self.live_blocks_high = {}          # (filename, lineno) -> most blocks that line has kept alive
+        self.total_blocks_high = 0          # most blocks the game's files have kept alive at once
+        self.frames_since_snapshot = 0
+
+        self._gc_started = 0.0
+        self._originals = {}
+        self._wrapped = {}
+
+    # construction counting
+
+    def _count(self, kind):
+        path = self.path_stack[self.depth - 1][0] if self.depth else OUTSIDE
+        self.frame_counts[path, kind] += 1
+
+    def _counting_classes(self):
+        count = self._count
+
+        class Rect(pygame.Rect):
+            __slots__ = ()
+
+            def __init__(self, *args):
+                count('Rect')
+                super().__init__(*args)
+
+        class Surface(pygame.Surface):
+            def __init__(self, *args, **kwargs):
+                count('Surface')
+                super().__init__(*args, **kwargs)
+
+        class Font(pygame.font.Font):
+            def __init__(self, *args, **kwargs):
+                count('Font')
+                super().__init__(*args, **kwargs)
+
+        return Rect, Surface, Font
+
+    # blocks left alive, from snapshots
+
+    def _live_blocks(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.snapshot_filters)
+        return {(stat.traceback[0].filename, stat.traceback[0].lineno): stat.count
+                for stat in snapshot.statistics('lineno')}
+
+    def _count_retained(self):
+        live = self._live_blocks()
+        total = sum(live.values())
+        excess = total - self.total_blocks_high
+        high = self.live_blocks_high
+        for line, count in live.items():
+            grown = count - high.get(line, 0)
+            if grown > 0:
+                high[line] = count
+                if excess > 0:
+                    grown = min(grown, excess)
+                    excess -= grown
+                    self.retained[self.scene][f"{os.path.basename(line[0])}:{line[1]}"] += grown
+        self.total_blocks_high = max(self.total_blocks_high, total)
+
+    # code paths
+
+    def _enter(self, path):
+        current, peak = tracemalloc.get_traced_memory()
+        stack = self.path_stack
+        depth = self.depth
+        if depth:
+            outer = stack[depth - 1]
+            outer[2] = max(outer[2], peak)
+        self.frame_peak = max(self.frame_peak, peak)
+        if depth == len(stack):
+            stack.append([None, 0, 0])      # only the first time calls nest this deep
+        entry = stack[depth]
+        entry[0] = path
+        entry[1] = current
+        entry[2] = 0
+        self.depth = depth + 1
+        tracemalloc.reset_peak()
+
+    def _leave(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.depth -= 1
+        path, start, inner_peak = self.path_stack[self.depth]
+        peak = max(peak, inner_peak)
+        self.path_bytes[self.scene][path] += peak - start
+        if self.depth:
+            outer = self.path_stack[self.depth - 1]
+            outer[2] = max(outer[2], peak)
+        self.frame_peak = max(self.frame_peak, peak)
+        tracemalloc.reset_peak()
+
+    def _wrap(self, name):
+        function = getattr(self.game, name)
+        enter = self._enter
+        leave = self._leave
+
+        def wrapper(*args, **kwargs):
+            enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                leave()
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    # gc pauses
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+            return
+        ms = (time.perf_counter() - self._gc_started) * 1000
+        scene = self.scene
+        self.gc_passes[scene][info['generation']] += 1
+        self.gc_ms[scene] += ms
+        if ms > self.max_gc_ms[scene]:
+            self.max_gc_ms[scene] = ms
+
+    # lifecycle
+
+    def install(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        rect, surface, font = self._counting_classes()
+        self._originals = {'Rect': pygame.Rect, 'Surface': pygame.Surface, 'Font': pygame.font.Font}
+        pygame.Rect, pygame.Surface, pygame.font.Font = rect, surface, font
+        for name in SCENE_FUNCTIONS + CODE_PATHS:
+            if hasattr(self.game, name):
+                self._wrapped[name] = getattr(self.game, name)
+                setattr(self.game, name, self._wrap(name))
+        gc.callbacks.append(self._on_gc)
+        if self.snapshot_every:
+            game_files = os.path.join(os.path.dirname(os.path.abspath(self.game.__file__)), '*.py')
+            self.snapshot_filters = (tracemalloc.Filter(True, game_files),
+                                     tracemalloc.Filter(False, os.path.abspath(__file__)))
+            self.live_blocks_high = self._live_blocks()
+            self.total_blocks_high = sum(self.live_blocks_high.values())
+            self.frames_since_snapshot = 0
+        self.frame_start_bytes = tracemalloc.get_traced_memory()[0]
+        self.frame_peak = 0
+        tracemalloc.reset_peak()
+        return self
+
+    def uninstall(self):
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        for name, function in self._wrapped.items():
+            setattr(self.game, name, function)
+        self._wrapped.clear()
+        if self._originals:
+            pygame.Rect = self._originals['Rect']
+            pygame.Surface = self._originals['Surface']
+            pygame.font.Font = self._originals['Font']
+            self._originals = {}
+        tracemalloc.stop()
+
+    def begin_frame(self, scene):
+        """Closes the frame that just ran (if any) and starts charging `scene`."""
+        if self.scene is not None:
+            self.end_frame()
+        self.scene = scene
+
+    def end_frame(self):
+        scene = self.scene
+        current, peak = tracemalloc.get_traced_memory()
+        heap = max(0, max(peak, self.frame_peak) - self.frame_start_bytes)
+        if self.snapshot_every:
+            self.frames_since_snapshot += 1
+            if self.frames_since_snapshot >= self.snapshot_every:
+                self.frames_since_snapshot = 0
+                self._count_retained()
+                # the snapshot itself lives on the traced heap; start the next frame after it
+                current = tracemalloc.get_traced_memory()[0]
+        self.frame_start_bytes = current
+        self.frame_peak = 0
+        tracemalloc.reset_peak()
+
+        counts = self.frame_counts
+        total = sum(counts.values())
+        self.frames[scene] += 1
+        self.objects[scene] += total
+        self.heap_bytes[scene] += heap
+        if total > self.max_objects[scene]:
+            self.max_objects[scene] = total
+        if heap > self.max_heap_bytes[scene]:
+            self.max_heap_bytes[scene] = heap
+        if counts:
+            self.paths[scene].update(counts)
+
+        budget = self.budgets.get(scene)
+        if budget is not None:
+            max_count, max_bytes = budget
+            if total > max_count or (max_bytes is not None and heap > max_bytes):
+                self._over_budget(scene, total, heap, budget)
+
+        counts.clear()
+        self.frames_since_report += 1
+        if self.report_every and self.frames_since_report >= self.report_every:
+            self.print_report()
+            self.frames_since_report = 0
+            self.logged_budget.clear()
+
+    def _over_budget(self, scene, total, heap, budget):
+        self.over_budget[scene] += 1
+        breakdown = ", ".join(f"{path} {kind} x{n}" for (path, kind), n in self.frame_counts.most_common(5))
+        message = (f"Allocation budget exceeded in '{scene}': {total} objects, {heap} heap bytes "
+                   f"(budget {budget[0]} objects" + (f", {budget[1]} bytes" if budget[1] is not None else "") + ")"
+                   + (f" - {breakdown}" if breakdown else ""))
+        if self.action == 'fail':
+            raise AllocationBudgetError(message)
+        if scene not in self.logged_budget:
+            self.logged_budget.add(scene)
+            print(message, file=self.out)
+
+    # reporting
+
+    def report(self):
+        scenes = {}
+        for scene, frames in self.frames.items():
+            scenes[scene] = {
+                'frames': frames,
+                'objects_per_frame': round(self.objects[scene] / frames, 2),
+                'max_objects': self.max_objects[scene],
+                'heap_bytes_per_frame': round(self.heap_bytes[scene] / frames),
+                'max_heap_bytes': self.max_heap_bytes[scene],
+                'paths': {f"{path}:{kind}": round(n / frames, 2) for (path, kind), n in self.paths[scene].most_common()},
+                'path_heap_bytes_per_frame': {path: round(n / frames) for path, n in self.path_bytes[scene].most_common()},
+                'retained_blocks': dict(self.retained[scene].most_common()),
+                'gc_passes': dict(self.gc_passes[scene]),
+                'gc_ms': round(self.gc_ms[scene], 2),
+                'max_gc_ms': round(self.max_gc_ms[scene], 3),
+                'over_budget_frames': self.over_budget[scene],
+            }
+        return scenes
+
+    def print_report(self, top=6):
+        out = self.out
+        for scene, stats in self.report().items():
+            gc_passes = " ".join(f"gen{gen}:{n}" for gen, n in sorted(stats['gc_passes'].items())) or "none"
+            print(f"[alloc] {scene}: {stats['frames']} frames, {stats['objects_per_frame']} objects/frame "
+                  f"(max {stats['max_objects']}), heap {stats['heap_bytes_per_frame']} B/frame "
+                  f"(max {stats['max_heap_bytes']}), gc {gc_passes} {stats['gc_ms']} ms "
+                  f"(max pause {stats['max_gc_ms']} ms)"
+                  + (f", {stats['over_budget_frames']} frames over budget" if stats['over_budget_frames'] else ""),
+                  file=out)
+            for path, per_frame in list(stats['paths'].items())[:top]:
+                print(f"[alloc]     {path:<40} {per_frame:>8} /frame", file=out)
+            for path, per_frame in list(stats['path_heap_bytes_per_frame'].items())[:top]:
+                print(f"[alloc]     {path + ' heap':<40} {per_frame:>8} B/frame", file=out)
+            for line, blocks in list(stats['retained_blocks'].items())[:top]:
+                print(f"[alloc]     {line + ' retained':<40} {blocks:>8} blocks", file=out)
+
+
+def install(game, budgets=None, action=None, report_every=None):
+    """Installs a probe on the Greg module `game`, reading unset options from the environment."""
+    if budgets is None:
+        budgets = parse_budgets(os.environ.get("CUBE_ALLOC_BUDGETS"))
+    if action is None:
+        action = os.environ.get("CUBE_ALLOC_BUDGET_ACTION", "log")
+    if report_every is None:
+        report_every = int(os.environ.get("CUBE_ALLOC_REPORT_EVERY", DEFAULT_REPORT_EVERY))
+    return Probe(game, budgets, action, report_every).install()
+
+
+def run_fight(probe, frames, seed=0, mode='ai', draw=True, scene='game'):
+    """Plays `frames` headless fight frames with scripted inputs under `probe`, charged to `scene`."""
+    import Inputs
+
+    game = probe.game
+    rng = random.Random(seed)
+    keys = Inputs.new_key_state()
+    script = ({}, {})
+    game.selected_mode = mode
+    game.start_match(seed)
+    for _ in range(frames):
+        if game.game_state['game_over']:
+            # a new round resets the whole game state; it isn't a steady-state frame
+            probe.begin_frame('restart')
+            game.start_match(rng.getrandbits(63))
+        probe.begin_frame(scene)
+        Inputs.apply_input(game, keys, 'blue', Inputs.scripted_input(rng, script[0]))
+        if mode == 'pvp':
+            Inputs.apply_input(game, keys, 'red', Inputs.scripted_input(rng, script[1]))
+        game.update_game(1000 / 60, keys)
+        if game.particles is not None:
+            game.particles.update(1000 / 60)
+        if draw:
+            game.draw_game()
+    probe.end_frame()
+    probe.scene = None
+
+
+def check(game, frames, seed=0, warmup=CHECK_WARMUP_FRAMES):
+    """
+    Runs the zero-allocation gate. Returns the probe (its over_budget counts
+    say whether it passed) and {mode: Counter of CHECK_EVENTS kinds} seen in
+    the steady-state runs, plus 'sparks' spawned when particles are on.
+    """
+    probe = Probe(game, {'game': (0, CHECK_HEAP_BYTES)}, 'log', report_every=0, out=sys.stdout,
+                  snapshot_every=CHECK_SNAPSHOT_EVERY).install()
+    fired = {mode: Counter() for mode in ('ai', 'pvp')}
+    counts = Counter()
+
+    def count(kind, *event):
+        counts[kind] += 1
+
+    Combat_log.subscribe(count, CHECK_EVENTS, sync=True)
+    # hit sparks are drawn inside draw_game, so the gate covers them too
+    particles = game.particles = Particles.create(seed=seed)
+    if particles is not None:
+        particles.start(game.effect_origin)
+    try:
+        for mode in fired:
+            run_fight(probe, warmup, seed, mode, scene='warmup')
+            counts.clear()
+            spawned = particles.spawned if particles is not None else 0
+            run_fight(probe, frames, seed + 1, mode)
+            fired[mode].update(counts)
+            if particles is not None:
+                fired[mode]['sparks'] = particles.spawned - spawned
+    finally:
+        Combat_log.unsubscribe(count)
+        if particles is not None:
+            particles.stop()
+            game.particles = None
+        probe.uninstall()
+    return probe, fired
+
+
+def main():
+    import Replay
+
+    parser = argparse.ArgumentParser(description="Count per-frame allocations in headless Cube Combat fights")
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--mode', choices=('ai', 'pvp'), default='ai')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-draw', action='store_true', help="simulate only")
+    parser.add_argument('--budget', default=None, help="scene=count[:bytes],... (the fight scene is 'game')")
+    parser.add_argument('--action', choices=BUDGET_ACTIONS, default='log')
+    parser.add_argument('--check', action='store_true',
+                        help="fail unless steady-state AI and PvP fights, beams and charges included, "
+                             "allocate nothing per frame")
+    args = parser.parse_args()
+
+    game = Replay._game()
+
+    if args.check:
+        probe, fired = check(game, args.frames, args.seed)
+        probe.print_report()
+        failed = probe.over_budget['game']
+        retained = sum(probe.retained['game'].values())
+        missing = [f"{mode} {Combat_log.EVENT_NAMES[kind]}"
+                   for mode, counts in fired.items() for kind in CHECK_EVENTS if not counts[kind]]
+        missing += [f"{mode} sparks" for mode, counts in fired.items() if 'sparks' in counts and not counts['sparks']]
+        for mode, counts in fired.items():
+            sparks = f", {counts['sparks']} sparks" if 'sparks' in counts else ""
+            print(f"[alloc] {mode}: " + ", ".join(f"{counts[kind]} {Combat_log.EVENT_NAMES[kind]}" for kind in CHECK_EVENTS)
+                  + sparks)
+        if failed:
+            print(f"ALLOCATION CHECK FAIL ({failed} frames over budget)")
+        elif retained > CHECK_RETAINED_BLOCKS:
+            print(f"ALLOCATION CHECK FAIL ({retained} blocks retained, limit {CHECK_RETAINED_BLOCKS})")
+        elif missing:
+            print(f"ALLOCATION CHECK FAIL (never fired: {', '.join(missing)})")
+        else:
+            print("ALLOCATION CHECK PASS")
+        return 1 if failed or missing or retained > CHECK_RETAINED_BLOCKS else 0
+
+    probe = Probe(game, parse_budgets(args.budget), args.action, report_every=0, out=sys.stdout).install()
+    try:
+        run_fight(probe, args.frames, args.seed, args.mode, not args.no_draw)
+    except AllocationBudgetError as e:
+        print(e)
+        return 1
+    finally:
+        probe.uninstall()
+    probe.print_report(top=12)
+    return 1 if sum(probe.over_budget.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""
+Arenas for Cube Combat: static obstacles on a grid, and the flow fields the
+AI finds its way around them with.
+
+Arenas are defined in Save_file/arenas.txt, next to cubes.txt. Each one is
+a grid of cells (CUBE_SIZE px, by default) where '#' is a wall and '.' is
+floor:
+
+    arena 2:
+        name: pillars
+        layout:
+            ................
+            ...##......##...
+            ...
+
+Greg picks one with CUBE_ARENA (a name or number; 'open' by default). The
+open arena has no walls, and Greg then moves everything exactly as it
+always has.
+
+With walls, the AI doesn't steer straight at the player. The arena keeps
+one flow field toward the player's cell: a Dijkstra pass over the grid
+that gives every cell its next cell on a shortest path there. The field is
+rebuilt only when the target moves into another cell, and every AI cube
+shares it, so steering a cube each frame is a table lookup:
+
+    ux, uy = arena.steer(x, y, CUBE_SIZE, target_x, target_y)
+
+Cubes slide along walls (resolve()), and charges stop where they first
+touch one (sweep(), through Collision.SweepGrid).
+
+    python Arena.py show pillars
+"""
+
+import argparse
+import heapq
+import math
+import os
+import re
+import sys
+import zlib
+
+import Collision
+
+ARENAS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Save_file", "arenas.txt")
+DEFAULT_ARENA = 'open'
+DEFAULT_CELL_SIZE = 50
+
+WALL = '#'
+FLOOR = '.'
+NO_CELL = -1
+DIAGONAL_COST = math.sqrt(2)
+
+# (column step, row step, cost), orthogonal first
+NEIGHBOURS = (
+    (1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+    (1, 1, DIAGONAL_COST), (1, -1, DIAGONAL_COST), (-1, 1, DIAGONAL_COST), (-1, -1, DIAGONAL_COST),
+)
+
+
+class Arena:
+    def __init__(self, arena_id, name, rows, cell_size=DEFAULT_CELL_SIZE):
+        self.id = arena_id
+        self.name = name
+        self.cell_size = cell_size
+        self.rows = len(rows)
+        self.cols = len(rows[0]) if rows else 0
+        self.width = self.cols * cell_size
+        self.height = self.rows * cell_size
+        self.layout = rows
+        self.layout_hash = layout_hash(rows, cell_size)
+        # one byte per cell, row by row; 1 is a wall
+        self.blocked = bytearray(1 if ch == WALL else 0 for row in rows for ch in row)
+        self.obstacles = self._wall_rects()
+        self.open = not self.obstacles
+        self.sweep_grid = Collision.SweepGrid(cell_size * 2)
+        self.sweep_grid.build(self.obstacles)
+
+        # the shared flow field: next cell and distance toward flow_target, per cell
+        self.flow_target = NO_CELL
+        self.next_cell = [NO_CELL] * (self.rows * self.cols)
+        self.distance = [math.inf] * (self.rows * self.cols)
+        self.rebuilds = 0
+
+    def _wall_rects(self):
+        """Each row's runs of wall cells as (x, y, w, h), so a long wall is one box."""
+        size = self.cell_size
+        rects = []
+        for r, row in enumerate(self.layout):
+            for match in re.finditer(re.escape(WALL) + '+', row):
+                rects.append((match.start() * size, r * size, (match.end() - match.start()) * size, size))
+        return rects
+
+    # cells
+
+    def cell_at(self, x, y):
+        """Index of the cell holding the point (x, y), clamped into the grid."""
+        size = self.cell_size
+        col = min(max(int(x // size), 0), self.cols - 1)
+        row = min(max(int(y // size), 0), self.rows - 1)
+        return row * self.cols + col
+
+    def cell_center(self, cell):
+        row, col = divmod(cell, self.cols)
+        half = self.cell_size / 2
+        return col * self.cell_size + half, row * self.cell_size + half
+
+    def box_blocked(self, x, y, w, h):
+        """True if the box overlaps a wall cell (touching one doesn't count)."""
+        size = self.cell_size
+        blocked = self.blocked
+        cols = self.cols
+        first_col = max(int(x // size), 0)
+        last_col = min(math.ceil((x + w) / size) - 1, cols - 1)
+        first_row = max(int(y // size), 0)
+        last_row = min(math.ceil((y + h) / size) - 1, self.rows - 1)
+        for row in range(first_row, last_row + 1):
+            base = row * cols
+            for col in range(first_col, last_col + 1):
+                if blocked[base + col]:
+                    return True
+        return False
+
+    # movement
+
+    def resolve(self, x, y, w, h, dx, dy):
+        """
+        Moves the box by (dx, dy) one axis at a time, keeping it inside the
+        arena and out of the walls, so a cube pushed into a wall slides
+        along it. Moves must be shorter than a cell.
+        """
+        size = self.cell_size
+        x = max(0, min(x + dx, self.width - w))
+        if dx and self.box_blocked(x, y, w, h):
+            x = (math.ceil((x + w) / size) - 1) * size - w if dx > 0 else (int(x // size) + 1) * size
+        y = max(0, min(y + dy, self.height - h))
+        if dy and self.box_blocked(x, y, w, h):
+            y = (math.ceil((y + h) / size) - 1) * size - h if dy > 0 else (int(y // size) + 1) * size
+        return x, y
+
+    def sweep(self, x, y, w, h, dx, dy):
+        """The fraction of the move, 0..1, at which the box first touches a wall, or None."""
+        if self.open:
+            return None
+        contact = self.sweep_grid.first_contact(x, y, w, h, dx, dy)
+        return None if contact is None else contact[0]
+
+    # pathfinding
+
+    def flow_to(self, target_cell):
+        """Makes the shared flow field lead to target_cell, rebuilding it only if the target changed."""
+        if target_cell == self.flow_target:
+            return
+        self.flow_target = target_cell
+        self.rebuilds += 1
+
+        cols, rows = self.cols, self.rows
+        blocked = self.blocked
+        distance = self.distance
+        next_cell = self.next_cell
+        for i in range(len(distance)):
+            distance[i] = math.inf
+            next_cell[i] = NO_CELL
+        if blocked[target_cell]:
+            return
+
+        # Dijkstra outward from the target; each cell's next step is the neighbour it was reached from
+        distance[target_cell] = 0.0
+        heap = [(0.0, target_cell)]
+        while heap:
+            d, cell = heapq.heappop(heap)
+            if d > distance[cell]:
+                continue
+            row, col = divmod(cell, cols)
+            for dc, dr, cost in NEIGHBOURS:
+                c, r = col + dc, row + dr
+                if not (0 <= c < cols and 0 <= r < rows):
+                    continue
+                neighbour = r * cols + c
+                if blocked[neighbour]:
+                    continue
+                # a cube is a cell wide, so no cutting corners past a wall
+                if dc and dr and (blocked[row * cols + c] or blocked[r * cols + col]):
+                    continue
+                nd = d + cost
+                if nd < distance[neighbour]:
+                    distance[neighbour] = nd
+                    next_cell[neighbour] = cell
+                    heapq.heappush(heap, (nd, neighbour))
+
+    def steer(self, x, y, size, target_x, target_y, away=False):
+        """
+        Unit (ux, uy) for a size x size cube at (x, y) to move toward the one
+        at (target_x, target_y) along the flow field, or, with away=True, to
+        the neighbouring cell that is furthest from it. Returns None when the
+        two share a cell or there is no path, and the caller steers directly.
+        """
+        half = size / 2
+        cx, cy = x + half, y + half
+        self.flow_to(self.cell_at(target_x + half, target_y + half))
+        cell = self.cell_at(cx, cy)
+
+        if away:
+            step = self._furthest_neighbour(cell)
+        else:
+            step = self.next_cell[cell]
+            if step == self.flow_target:
+                return None
+        if step == NO_CELL:
+            return None
+
+        nx, ny = self.cell_center(step)
+        dx, dy = nx - cx, ny - cy
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return None
+        return dx / length, dy / length
+
+    def _furthest_neighbour(self, cell):
+        distance = self.distance
+        best, best_distance = NO_CELL, distance[cell]
+        row, col = divmod(cell, self.cols)
+        for dc, dr, _ in NEIGHBOURS:
+            c, r = col + dc, row + dr
+            if not (0 <= c < self.cols and 0 <= r < self.rows):
+                continue
+            neighbour = r * self.cols + c
+            if dc and dr and (self.blocked[row * self.cols + c] or self.blocked[r * self.cols + col]):
+                continue
+            if distance[neighbour] != math.inf and distance[neighbour] > best_distance:
+                best, best_distance = neighbour, distance[neighbour]
+        return best
+
+
+def layout_hash(rows, cell_size=DEFAULT_CELL_SIZE):
+    """CRC32 of the walls and cell size; replays keep it to notice an arena edited since they were recorded."""
+    return zlib.crc32(('%d\n' % cell_size + '\n'.join(rows)).encode('ascii'))
+
+
+def parse_arenas_file(file_content, cell_size=DEFAULT_CELL_SIZE):
+    """Parses the content of arenas.txt into a list of Arenas, skipping (and reporting) malformed ones."""
+    arenas = []
+    blocks = re.split(r'^\s*arena (\d+):', file_content, flags=re.IGNORECASE | re.MULTILINE)
+    for i in range(1, len(blocks), 2):
+        arena_id = int(blocks[i])
+        name = f"arena {arena_id}"
+        rows = []
+        in_layout = False
+        for line in blocks[i + 1].split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('name:'):
+                name = line.split(':', 1)[1].strip().lower()
+                in_layout = False
+            elif line.startswith('layout:'):
+                in_layout = True
+            elif in_layout:
+                rows.append(line)
+
+        if not rows or any(len(row) != len(rows[0]) for row in rows):
+            print(f"Warning: Skipping arena {arena_id} ({name}): its layout rows are missing or uneven.")
+            continue
+        if any(ch not in (WALL, FLOOR) for row in rows for ch in row):
+            print(f"Warning: Skipping arena {arena_id} ({name}): layouts may only use '{WALL}' and '{FLOOR}'.")
+            continue
+        arenas.append(Arena(arena_id, name, rows, cell_size))
+    return arenas
+
+
+def open_arena(width, height, cell_size=DEFAULT_CELL_SIZE):
+    """The empty arena, for when arenas.txt is missing or has no usable entry."""
+    return Arena(1, DEFAULT_ARENA, [FLOOR * (width // cell_size)] * (height // cell_size), cell_size)
+
+
+def load_arenas(path=ARENAS_FILE, cell_size=DEFAULT_CELL_SIZE):
+    if not os.path.exists(path):
+        print(f"Error: Arena file not found at {path}")
+        return []
+    try:
+        with open(path, 'r') as f:
+            return parse_arenas_file(f.read(), cell_size)
+    except IOError as e:
+        print(f"Error reading arena file: {e}")
+        return []
+
+
+def find(arenas, key):
+    """The arena named `key`, or numbered `key`; None if there is none."""
+    key = str(key).strip().lower()
+    for arena in arenas:
+        if arena.name == key or str(arena.id) == key:
+            return arena
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat arenas")
+    parser.add_argument('--file', default=ARENAS_FILE)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="arenas in the file")
+    show = sub.add_parser('show', help="print an arena's flow field toward a cell")
+    show.add_argument('arena')
+    show.add_argument('--target', default=None, help="COL,ROW (default: the middle)")
+    args = parser.parse_args()
+
+    arenas = load_arenas(args.file)
+    if args.command == 'list':
+        for arena in arenas:
+            print(f"{arena.id}: {arena.name} ({arena.cols}x{arena.rows} cells, {len(arena.obstacles)} wall boxes, layout {arena.layout_hash:08x})")
+        return 0
+
+    arena = find(arenas, args.arena)
+    if arena is None:
+        print(f"No arena {args.arena!r} in {args.file}")
+        return 1
+    col, row = (int(v) for v in args.target.split(',')) if args.target else (arena.cols // 2, arena.rows // 2)
+    arena.flow_to(row * arena.cols + col)
+    arrows = {(1, 0): '>', (-1, 0): '<', (0, 1): 'v', (0, -1): '^',
+              (1, 1): '\\', (-1, -1): '\\', (1, -1): '/', (-1, 1): '/'}
+    for r in range(arena.rows):
+        line = []
+        for c in range(arena.cols):
+            cell = r * arena.cols + c
+            step = arena.next_cell[cell]
+            if arena.blocked[cell]:
+                line.append(WALL)
+            elif cell == arena.flow_target:
+                line.append('X')
+            elif step == NO_CELL:
+                line.append(' ')
+            else:
+                sr, sc = divmod(step, arena.cols)
+                line.append(arrows[(sc - c, sr - r)])
+        print(''.join(line))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""
+Asset manager for Cube Combat.
+
+Assets are looked up by logical name: the path under assets/ without its
+extension, with forward slashes ('Placeholder', 'i-need-iron-blocks',
+'sfx/slash'). Images come back as Surfaces, .wav/.ogg effects as Sounds,
+and music as something pygame.mixer.music.load() accepts. Anything else
+comes back as bytes.
+
+    assets = AssetManager()
+    assets.prefetch(['Placeholder'])   # decoded on the worker thread
+    ...
+    assets.collect()                   # main thread: convert() what's finished
+    image = assets.get('Placeholder')  # cached, already in the display format
+
+Decoding (pygame.image.load, mixer.Sound) runs on one worker thread.
+convert()/convert_alpha() need the display and run on the main thread,
+either in collect() (one asset per call, so a burst of prefetches doesn't
+land on a single frame) or in get() if the asset is needed before then.
+Converted assets stay in an LRU cache bounded by their size in bytes
+(CUBE_ASSET_CACHE_MB, 64 by default).
+
+Assets are read either from the loose files under assets/ or from a single
+packed archive, assets/assets.pack, built with:
+
+    python Assets.py pack
+
+The pack's index is a sorted table of fixed-size records at the front of the
+file, and the whole file is memory-mapped, so opening it costs an open and
+an mmap and a lookup is a binary search over the mapping with no parsing.
+Asset bytes are read straight from the mapping, so a pack never costs a
+syscall per asset. The loose-file manifest is one scandir per directory,
+built on first use. Set CUBE_ASSET_PACK=0 to ignore the pack.
+
+Save_file/ is not handled here: it is player data that the game writes to.
+"""
+
+import argparse
+import io
+import mmap
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+ASSETS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets'))
+PACK_NAME = 'assets.pack'
+PACK_PATH = os.path.join(ASSETS_DIR, PACK_NAME)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tga', '.webp')
+SOUND_EXTENSIONS = ('.wav', '.ogg')
+
+DEFAULT_CACHE_MB = 64
+
+PACK_MAGIC = b"CCPACK1\n"
+PACK_HEADER = struct.Struct('<8sI')         # magic, entry count
+PACK_ENTRY = struct.Struct('<56s8sQQ')      # logical name, extension, offset, size
+PACK_NAME_BYTES = 56
+
+
+def logical_name(relative_path):
+    """'sfx/slash.wav' -> ('sfx/slash', '.wav')"""
+    stem, extension = os.path.splitext(relative_path.replace(os.sep, '/'))
+    return stem, extension.lower()
+
+
+def scan(root=ASSETS_DIR):
+    """Logical name -> (extension, path) for every loose file under root (one scandir per directory)."""
+    manifest = {}
+    directories = ['']
+    while directories:
+        relative = directories.pop()
+        try:
+            entries = os.scandir(os.path.join(root, relative))
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                path = os.path.join(relative, entry.name) if relative else entry.name
+                if entry.is_dir():
+                    directories.append(path)
+                elif entry.name != PACK_NAME and not entry.name.startswith('.'):
+                    name, extension = logical_name(path)
+                    manifest[name] = (extension, entry.path)
+    return manifest
+
+
+class Pack:
+    """A read-only, memory-mapped asset archive (see write_pack for the layout)."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = PACK_HEADER.unpack_from(self.map, 0)
+        if magic != PACK_MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not an asset pack")
+
+    def _entry(self, i):
+        return PACK_ENTRY.unpack_from(self.map, PACK_HEADER.size + i * PACK_ENTRY.size)
+
+    def find(self, name):
+        """(extension, memoryview of the bytes) for the logical name, or None. Binary search over the mapped index."""
+        key = name.encode('utf-8').ljust(PACK_NAME_BYTES, b'\0')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_name, extension, offset, size = self._entry(mid)
+            if entry_name < key:
+                lo = mid + 1
+            elif entry_name > key:
+                hi = mid
+            else:
+                return extension.rstrip(b'\0').decode('ascii'), memoryview(self.map)[offset:offset + size]
+        return None
+
+    def names(self):
+        return [self._entry(i)[0].rstrip(b'\0').decode('utf-8') for i in range(self.count)]
+
+    def close(self):
+        self.map.close()
+
+
+def write_pack(manifest, path):
+    """
+    Writes the manifest's files into one archive:
+        header: magic, entry count
+        index: one fixed-size record per asset, sorted by logical name
+        data: the files' bytes, each starting on an 8-byte boundary
+    """
+    entries = []
+    for name in sorted(manifest, key=lambda name: name.encode('utf-8')):
+        encoded = name.encode('utf-8')
+        if len(encoded) > PACK_NAME_BYTES:
+            raise ValueError(f"asset name too long for the pack index: {name}")
+        entries.append((encoded, *manifest[name]))
+
+    offset = PACK_HEADER.size + len(entries) * PACK_ENTRY.size
+    index = []
+    for encoded, extension, file_path in entries:
+        offset = (offset + 7) & ~7
+        size = os.path.getsize(file_path)
+        index.append(PACK_ENTRY.pack(encoded, extension.encode('ascii'), offset, size))
+        offset += size
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as out:
+        out.write(PACK_HEADER.pack(PACK_MAGIC, len(entries)))
+        out.write(b''.join(index))
+        for (encoded, extension, file_path), record in zip(entries, index):
+            out.write(b'\0' * (PACK_ENTRY.unpack(record)[2] - out.tell()))
+            with open(file_path, 'rb') as f:
+                out.write(f.read())
+    os.replace(temp_path, path)
+    return len(entries)
+
+
+def asset_bytes(asset):
+    """Rough memory held by a cached asset, for the LRU budget."""
+    if isinstance(asset, pygame.Surface):
+        return asset.get_pitch() * asset.get_height()
+    if isinstance(asset, pygame.mixer.Sound):
+        frequency, size, channels = pygame.mixer.get_init() or (44100, -16, 2)
+        return int(asset.get_length() * frequency * channels * abs(size) // 8)
+    if isinstance(asset, (bytes, bytearray, memoryview)):
+        return len(asset)
+    return 0
+
+
+class AssetManager:
+    def __init__(self, root=ASSETS_DIR, pack_path=None, cache_bytes=None):
+        self.root = root
+        if pack_path is None and os.environ.get("CUBE_ASSET_PACK", "1") != "0":
+            pack_path = os.path.join(root, PACK_NAME)
+        self.pack = Pack(pack_path) if pack_path and os.path.exists(pack_path) else None
+        self.manifest = None    # loose files, scanned on first use when there is no pack
+        if cache_bytes is None:
+            cache_bytes = int(float(os.environ.get("CUBE_ASSET_CACHE_MB", DEFAULT_CACHE_MB)) * 1024 * 1024)
+        self.cache_bytes = cache_bytes
+
+        self.cache = {}         # name -> converted asset, least recently used first
+        self.sizes = {}
+        self.used_bytes = 0
+        self.pending = {}       # name -> Future of the decoded asset
+        self.executor = None
+        self._manifest_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.blocking_loads = 0     # get() had to decode (or wait for a decode) on the main thread
+        self.evictions = 0
+
+    # lookup
+
+    def _locate(self, name):
+        """(extension, source): source is a file path or, from the pack, a memoryview."""
+        if self.pack is not None:
+            found = self.pack.find(name)
+            if found is None:
+                raise KeyError(f"no asset named {name!r} in {self.pack.path}")
+            return found
+        found = self._loose().get(name)
+        if found is None:
+            raise KeyError(f"no asset named {name!r} under {self.root}")
+        return found
+
+    def exists(self, name):
+        try:
+            self._locate(name)
+        except KeyError:
+            return False
+        return True
+
+    def names(self):
+        if self.pack is not None:
+            return self.pack.names()
+        return sorted(self._loose())
+
+    def _loose(self):
+        if self.manifest is None:
+            with self._manifest_lock:
+                if self.manifest is None:
+                    self.manifest = scan(self.root)
+        return self.manifest
+
+    # decoding (any thread)
+
+    def load(self, name):
+        """Decodes the asset now, on the calling thread, without converting or caching it."""
+        extension, source = self._locate(name)
+        if isinstance(source, str):
+            if extension in IMAGE_EXTENSIONS:
+                return pygame.image.load(source)
+            if extension in SOUND_EXTENSIONS:
+                return pygame.mixer.Sound(source)
+            with open(source, 'rb') as f:
+                return f.read()
+        if extension in IMAGE_EXTENSIONS:
+            return pygame.image.load(io.BytesIO(source), name + extension)
+        if extension in SOUND_EXTENSIONS:
+            return pygame.mixer.Sound(io.BytesIO(source))
+        return bytes(source)
+
+    def music(self, name):
+        """A source for pygame.mixer.music.load(): the file path, or the packed bytes as a file object."""
+        extension, source = self._locate(name)
+        if isinstance(source, str):
+            return source
+        return io.BytesIO(source)
+
+    # main thread
+
+    def prefetch(self, names):
+        """Queues decodes for assets that aren't cached or already queued."""
+        for name in names:
+            if name in self.cache or name in self.pending:
+                continue
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='asset-decode')
+            self.pending[name] = self.executor.submit(self.load, name)
+
+    def collect(self, limit=1):
+        """Converts and caches up to `limit` finished prefetches. Cheap when nothing is pending."""
+        for name, future in list(self.pending.items()):
+            if not limit:
+                return
+            if future.done():
+                del self.pending[name]
+                try:
+                    self._store(name, future.result())
+                except (pygame.error, OSError, KeyError) as e:
+                    print(f"Could not load asset {name}: {e}")
+                limit -= 1
+
+    def get(self, name):
+        """The asset, converted for the display. Decodes it now if it wasn't prefetched."""
+        asset = self.cache.pop(name, None)
+        if asset is not None:
+            self.cache[name] = asset
+            self.hits += 1
+            return asset
+        self.misses += 1
+        self.blocking_loads += 1
+        future = self.pending.pop(name, None)
+        return self._store(name, future.result() if future is not None else self.load(name))
+
+    def _store(self, name, asset):
+        if isinstance(asset, pygame.Surface) and pygame.display.get_surface() is not None:
+            asset = asset.convert_alpha() if asset.get_flags() & pygame.SRCALPHA else asset.convert()
+        size = asset_bytes(asset)
+        self.cache[name] = asset
+        self.sizes[name] = size
+        self.used_bytes += size
+        # evict least recently used, but never the asset being handed out
+        for old in list(self.cache):
+            if self.used_bytes <= self.cache_bytes or old == name:
+                break
+            del self.cache[old]
+            self.used_bytes -= self.sizes.pop(old)
+            self.evictions += 1
+        return asset
+
+    def drop(self, name):
+        if name in self.cache:
+            del self.cache[name]
+            self.used_bytes -= self.sizes.pop(name)
+
+    def stats(self):
+        return {'cached': len(self.cache), 'bytes': self.used_bytes, 'budget': self.cache_bytes,
+                'hits': self.hits, 'misses': self.misses, 'blocking_loads': self.blocking_loads,
+                'evictions': self.evictions, 'pending': len(self.pending),
+                'source': self.pack.path if self.pack is not None else self.root}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.pending.clear()
+        self.cache.clear()
+        self.sizes.clear()
+        self.used_bytes = 0
+        if self.pack is not None:
+            self.pack.close()
+            self.pack = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat assets")
+    sub = parser.add_subparsers(dest='command', required=True)
+    pack = sub.add_parser('pack', help="pack the loose files under assets/ into one archive")
+    pack.add_argument('--out', default=PACK_PATH)
+    sub.add_parser('list', help="logical asset names, from the pack if there is one")
+    parser.add_argument('--root', default=ASSETS_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        count = write_pack(scan(args.root), args.out)
+        print(f"Packed {count} assets into {args.out} ({os.path.getsize(args.out):,} bytes)")
+    else:
+        assets = AssetManager(args.root)
+        for name in assets.names():
+            print(name)
+        assets.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
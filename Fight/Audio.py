@@ -0,0 +1,402 @@
+"""
+Sound for Cube Combat.
+
+Music is streamed from assets/i-need-iron-blocks.mp3 by pygame.mixer.music,
+so it is decoded a little at a time by SDL's mixer thread, never all at once.
+Sound effects are short, so each one is decoded (or, when there is no file
+for it, synthesized) once into a cached pygame.mixer.Sound. That work runs on
+a background thread at start(), and the game loop never waits for it. An
+effect that isn't ready yet is just skipped.
+
+Nothing here runs per frame. start() subscribes to Combat_log as a sync
+subscriber, so a sound starts on the same frame as the slash, parry or KO
+that caused it, and frames without events cost nothing.
+
+Effects play on a fixed pool of mixer channels. When every channel is busy,
+a new effect takes the channel of the oldest effect with a lower (or equal)
+priority. If every playing effect matters more, the new one is dropped, so a
+KO is never cut off by a slash.
+
+The mixer is opened with a small buffer (CUBE_AUDIO_BUFFER samples, 256 by
+default) so effects start within a few milliseconds of the event. Drop
+assets/sfx/<name>.wav (or .ogg) next to the music to replace a built-in
+effect. Files are found through Assets, so they can also come from the
+asset pack. Set CUBE_AUDIO=0 to turn sound off.
+
+--selftest checks the channel pool and the event-to-sound table on SDL's
+dummy audio driver, so it runs without a sound card:
+
+    python Audio.py --selftest
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import math
+import random
+import threading
+import time
+from array import array
+
+import pygame
+
+import Assets
+import Combat_log
+
+MUSIC_NAME = 'i-need-iron-blocks'
+SFX_PREFIX = 'sfx/'
+
+FREQUENCY = 44100
+SAMPLE_SIZE = -16
+CHANNELS = 2
+DEFAULT_BUFFER = 256    # samples; ~6 ms at 44.1 kHz
+POOL_SIZE = 8
+MUSIC_VOLUME = 0.5
+SFX_VOLUME = 0.8
+
+# name -> priority; a busy channel is only taken by an effect of the same or higher priority
+PRIORITIES = {
+    'windup': 1,
+    'slash': 2,
+    'beam': 2,
+    'charge': 2,
+    'parry': 3,
+    'ko': 4,
+}
+
+_sounds = {}            # name -> Sound, filled by the loader thread
+_channels = []          # the pool, as pygame.mixer.Channel objects
+_channel_priority = []  # priority of what each channel is playing
+_channel_started = []   # when it started, for picking the oldest one to take over
+_loader = None
+_assets = None
+_started = False
+dropped = 0             # effects skipped because nothing could play them
+
+
+def enabled():
+    return os.environ.get("CUBE_AUDIO", "1") != "0"
+
+
+def start(assets=None, music=True):
+    """
+    Opens the mixer with the low-latency buffer, starts the music and the
+    effect loader, and hooks the effects up to the combat log. Music and
+    effect files are found through `assets` (an Assets.AssetManager).
+    Returns False (and leaves the game silent) if there is no audio device.
+    """
+    global _loader, _started, _assets
+    if _started or not enabled():
+        return False
+
+    buffer = int(os.environ.get("CUBE_AUDIO_BUFFER", DEFAULT_BUFFER))
+    # pygame.init() already opened the mixer with its default buffer; reopen it with ours
+    pygame.mixer.quit()
+    try:
+        pygame.mixer.init(FREQUENCY, SAMPLE_SIZE, CHANNELS, buffer)
+    except pygame.error as e:
+        print(f"Audio disabled: {e}")
+        return False
+
+    _assets = assets if assets is not None else Assets.AssetManager()
+    pygame.mixer.set_num_channels(POOL_SIZE)
+    _channels[:] = [pygame.mixer.Channel(i) for i in range(POOL_SIZE)]
+    _channel_priority[:] = [0] * POOL_SIZE
+    _channel_started[:] = [0.0] * POOL_SIZE
+
+    if music:
+        play_music()
+
+    _loader = threading.Thread(target=_load_sounds, name="sfx-loader", daemon=True)
+    _loader.start()
+    Combat_log.subscribe(_on_event, kinds=tuple(_EVENT_SOUNDS), sync=True)
+    _started = True
+    return True
+
+
+def stop():
+    """Unhooks from the combat log, waits for the loader and stops everything playing."""
+    global _loader, _started
+    Combat_log.unsubscribe(_on_event)
+    if _loader is not None:
+        _loader.join()
+        _loader = None
+    if _started:
+        pygame.mixer.music.stop()
+        pygame.mixer.stop()
+    _sounds.clear()
+    _channels.clear()
+    _started = False
+
+
+def play_music(name=MUSIC_NAME, loops=-1):
+    """Streams a music track; a missing or unreadable file only costs the music."""
+    try:
+        pygame.mixer.music.load(_assets.music(name))
+    except (pygame.error, OSError, KeyError) as e:
+        print(f"Could not load music {name}: {e}")
+        return False
+    pygame.mixer.music.set_volume(MUSIC_VOLUME)
+    pygame.mixer.music.play(loops)
+    return True
+
+
+def play(name):
+    """Plays a cached effect on the pool. Never loads anything; returns the Channel or None."""
+    global dropped
+    sound = _sounds.get(name)
+    if sound is None or not _channels:
+        return None
+    priority = PRIORITIES[name]
+
+    # a free channel, else the oldest one playing something no more important than this
+    index = -1
+    for i, channel in enumerate(_channels):
+        if not channel.get_busy():
+            index = i
+            break
+        if _channel_priority[i] <= priority and (index < 0 or _channel_started[i] < _channel_started[index]):
+            index = i
+    if index < 0:
+        dropped += 1
+        return None
+
+    channel = _channels[index]
+    channel.play(sound)
+    _channel_priority[index] = priority
+    _channel_started[index] = time.perf_counter()
+    return channel
+
+
+# events
+
+def _on_event(kind, time, actor, flag, value, extra):
+    name = _EVENT_SOUNDS[kind]
+    if kind == Combat_log.EVENT_PARRY and not flag:
+        return
+    if kind == Combat_log.EVENT_WINDUP_FLASH:
+        # one blip per dark flash of a beam windup; charge windups have their own sound
+        if not flag or value % 2 == 0:
+            return
+    play(name)
+
+
+_EVENT_SOUNDS = {
+    Combat_log.EVENT_SLASH: 'slash',
+    Combat_log.EVENT_BEAM: 'beam',
+    Combat_log.EVENT_WINDUP_FLASH: 'windup',
+    Combat_log.EVENT_CHARGE_START: 'charge',
+    Combat_log.EVENT_PARRY: 'parry',
+    Combat_log.EVENT_DEATH: 'ko',
+}
+
+
+# loading
+
+def _load_sounds():
+    """Loader thread: one Sound per effect, from the sfx/ assets if there is one, else synthesized."""
+    frequency, _, channels = pygame.mixer.get_init() or (FREQUENCY, SAMPLE_SIZE, CHANNELS)
+    for name in PRIORITIES:
+        sound = None
+        if _assets.exists(SFX_PREFIX + name):
+            try:
+                sound = _assets.load(SFX_PREFIX + name)
+            except (pygame.error, OSError) as e:
+                print(f"Could not load {SFX_PREFIX + name}: {e}")
+        if sound is None:
+            samples = SYNTHS[name](frequency)
+            sound = pygame.mixer.Sound(buffer=to_pcm(samples, channels))
+        sound.set_volume(SFX_VOLUME)
+        _sounds[name] = sound
+
+
+def to_pcm(samples, channels):
+    """Float samples in [-1, 1] to signed 16-bit PCM, the same sample on every channel."""
+    pcm = array('h', bytes(2 * len(samples) * channels))
+    i = 0
+    for sample in samples:
+        value = int(max(-1.0, min(1.0, sample)) * 32767)
+        for _ in range(channels):
+            pcm[i] = value
+            i += 1
+    return pcm.tobytes()
+
+
+def _envelope(i, n, attack, rate):
+    """Linear attack over `attack` samples, then decays by e ** -rate over the n samples."""
+    if i < attack:
+        return i / attack
+    return math.exp(-rate * (i - attack) / n)
+
+
+def synth_slash(frequency):
+    # filtered noise swept from bright to dull: a quick swish
+    rng = random.Random(3)
+    n = int(frequency * 0.12)
+    out = []
+    low = 0.0
+    for i in range(n):
+        cutoff = 0.6 - 0.5 * i / n
+        low += cutoff * (rng.uniform(-1.0, 1.0) - low)
+        out.append(low * 1.6 * _envelope(i, n, frequency // 500, 4.0))
+    return out
+
+
+def synth_beam(frequency):
+    # descending square zap
+    n = int(frequency * 0.25)
+    out = []
+    phase = 0.0
+    for i in range(n):
+        pitch = 1400 - 1000 * i / n
+        phase += pitch / frequency
+        out.append((0.5 if phase % 1.0 < 0.5 else -0.5) * _envelope(i, n, frequency // 1000, 5.0))
+    return out
+
+
+def synth_windup(frequency):
+    # short high blip, one per windup flash
+    n = int(frequency * 0.05)
+    return [0.45 * math.sin(2 * math.pi * 1760 * i / frequency) * _envelope(i, n, frequency // 2000, 6.0)
+            for i in range(n)]
+
+
+def synth_charge(frequency):
+    # rising sawtooth that swells over the charge windup
+    n = int(frequency * 0.35)
+    out = []
+    phase = 0.0
+    for i in range(n):
+        pitch = 110 + 440 * (i / n) ** 2
+        phase += pitch / frequency
+        swell = min(1.0, 3 * i / n) * (1.0 - (i / n) ** 6)
+        out.append(0.4 * (2 * (phase % 1.0) - 1) * swell)
+    return out
+
+
+def synth_parry(frequency):
+    # inharmonic partials ringing out: a metallic clang
+    n = int(frequency * 0.4)
+    partials = ((1250, 0.5), (1810, 0.3), (2730, 0.2))
+    return [sum(weight * math.sin(2 * math.pi * pitch * i / frequency) for pitch, weight in partials)
+            * _envelope(i, n, frequency // 4000, 7.0)
+            for i in range(n)]
+
+
+def synth_ko(frequency):
+    # falling tone over a noise rumble
+    rng = random.Random(9)
+    n = int(frequency * 0.8)
+    out = []
+    phase = 0.0
+    low = 0.0
+    for i in range(n):
+        pitch = 60 + 340 * (1 - i / n) ** 2
+        phase += pitch / frequency
+        low += 0.05 * (rng.uniform(-1.0, 1.0) - low)
+        out.append((0.6 * math.sin(2 * math.pi * phase) + 1.5 * low) * _envelope(i, n, frequency // 200, 3.5))
+    return out
+
+
+SYNTHS = {
+    'windup': synth_windup,
+    'slash': synth_slash,
+    'beam': synth_beam,
+    'charge': synth_charge,
+    'parry': synth_parry,
+    'ko': synth_ko,
+}
+
+
+# self-test
+
+def _check(results, what, ok):
+    print(f"{'ok  ' if ok else 'FAIL'} {what}")
+    results.append(ok)
+
+
+def selftest():
+    """Channel takeover and drops on a full pool, and which events make which sound."""
+    global play
+    if not start(music=False):
+        print("SELFTEST FAIL (no mixer)")
+        return 1
+    _loader.join()
+    results = []
+    _check(results, "every effect loaded", sorted(_sounds) == sorted(PRIORITIES))
+
+    # every effect as 10 s of silence, so nothing finishes while the pool is being filled
+    frequency, _, channels = pygame.mixer.get_init()
+    silence = pygame.mixer.Sound(buffer=bytes(2 * channels * frequency * 10))
+    for name in PRIORITIES:
+        _sounds[name] = silence
+
+    def fill(name):
+        pygame.mixer.stop()
+        return [play(name) for _ in _channels]
+
+    try:
+        started = fill('ko')
+        _check(results, "a free channel is used while there is one", started == _channels)
+        before = dropped
+        _check(results, "a slash is dropped when every channel plays a KO", play('slash') is None and dropped == before + 1)
+        _check(results, "a KO takes over the oldest KO", play('ko') is _channels[0])
+
+        fill('slash')
+        _check(results, "a parry takes over the oldest slash", play('parry') is _channels[0])
+        _check(results, "a beam takes over the oldest remaining slash", play('beam') is _channels[1])
+        before = dropped
+        _check(results, "a windup blip is dropped when every channel matters more", play('windup') is None and dropped == before + 1)
+        _check(results, "a slash takes the oldest slash, not the newer parry", play('slash') is _channels[2])
+
+        pygame.mixer.stop()
+        played = []
+        real_play = play
+        play = played.append
+        try:
+            red, blue = Combat_log.ACTOR_RED, Combat_log.ACTOR_BLUE
+            cases = (
+                ((Combat_log.EVENT_SLASH, blue, True, 10, 90.0), 'slash'),
+                ((Combat_log.EVENT_SLASH, blue, False, 0, 100.0), 'slash'),
+                ((Combat_log.EVENT_BEAM, red, True, 20, 80.0), 'beam'),
+                ((Combat_log.EVENT_CHARGE_START, red, False, 0, 0.0), 'charge'),
+                ((Combat_log.EVENT_PARRY, blue, True, 0, 0.0), 'parry'),
+                ((Combat_log.EVENT_PARRY, blue, False, 0, 0.0), None),
+                ((Combat_log.EVENT_WINDUP_FLASH, red, True, 1, 0.0), 'windup'),
+                ((Combat_log.EVENT_WINDUP_FLASH, red, True, 2, 0.0), None),
+                ((Combat_log.EVENT_WINDUP_FLASH, red, False, 1, 0.0), None),
+                ((Combat_log.EVENT_DEATH, red, False, 0, 0.0), 'ko'),
+                ((Combat_log.EVENT_MATCH_END, blue, False, 0, 0.0), None),
+            )
+            for event, expected in cases:
+                played.clear()
+                Combat_log.emit(*event)
+                kind, actor, flag, value, _ = event
+                _check(results, f"{Combat_log.EVENT_NAMES[kind]} by {Combat_log.ACTOR_NAMES[actor]} "
+                                f"(flag {flag}, value {value}) -> {expected or 'silence'}",
+                       played == ([expected] if expected else []))
+        finally:
+            play = real_play
+    finally:
+        stop()
+
+    print("SELFTEST", "PASS" if all(results) else "FAIL")
+    return 0 if all(results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat sound")
+    parser.add_argument('--selftest', action='store_true', help="check the channel pool and the event sounds")
+    args = parser.parse_args()
+    if args.selftest:
+        return selftest()
+    parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
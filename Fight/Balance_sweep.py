@@ -0,0 +1,314 @@
+"""
+Parameter sweeps over Greg's balance constants.
+
+Each point of the sweep is a set of overrides for module constants such as
+ATTACK_DAMAGE or AI_SPECIAL_ATTACK_COOLDOWN_MS. For every point, a batch of
+headless AI rounds is played against Inputs.scripted_input, and win rates,
+round length, remaining health and the health differential (blue minus
+red, so it still separates points where one side wins every round) are
+recorded. A point whose rounds all time out says nothing about balance;
+it is reported as failed and left out of the table. Points are spread over all
+cores with a spawn pool. Each finished point is appended to the results
+CSV right away, so an interrupted sweep picks up where it stopped and
+points already in the table are never run twice.
+
+    python Balance_sweep.py --param ATTACK_DAMAGE=10:30:5 --param AI_SPECIAL_ATTACK_DAMAGE=20,30,40
+    python Balance_sweep.py --random 200 --param CHARGE_SPEED=8:20 --param AI_MOVE_SPEED=2:5 --out sweep.csv
+
+A range a:b:step is a grid axis. With --random N, N points are drawn
+uniformly from a:b instead (ints stay ints). The draw is seeded, so a
+resumed random sweep regenerates the same points.
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import random
+import time
+
+import Replay
+
+DEFAULT_MATCHES = 20
+DEFAULT_MAX_FRAMES = 60 * 60 * 3
+
+# constants that are copied into game_state once and not touched by reset_game_state
+STATE_MIRRORS = {'MOVE_SPEED': 'move_speed', 'ATTACK_DAMAGE': 'attack_damage'}
+
+RESULT_COLUMNS = ('point_id', 'params', 'matches', 'max_frames', 'seed',
+                  'blue_win_rate', 'red_win_rate', 'timeout_rate',
+                  'avg_round_s', 'avg_blue_health_left', 'avg_red_health_left', 'avg_health_diff', 'seconds')
+
+
+def parse_axis(text):
+    """'NAME=a:b[:step]' or 'NAME=v1,v2,...' -> (name, values or (low, high, step))."""
+    name, _, spec = text.partition('=')
+    if not name or not spec:
+        raise argparse.ArgumentTypeError(f"expected NAME=values, got {text!r}")
+
+    def number(value):
+        return float(value) if any(c in value for c in '.eE') else int(value)
+
+    if ':' in spec:
+        parts = [number(part) for part in spec.split(':')]
+        if len(parts) not in (2, 3):
+            raise argparse.ArgumentTypeError(f"range for {name} must be low:high[:step]")
+        low, high = parts[0], parts[1]
+        step = parts[2] if len(parts) == 3 else None
+        return name, (low, high, step)
+    return name, [number(value) for value in spec.split(',')]
+
+
+def grid_values(axis):
+    if isinstance(axis, list):
+        return axis
+    low, high, step = axis
+    if step is None:
+        raise ValueError("grid ranges need a step (low:high:step); use --random for plain low:high")
+    values = []
+    i = 0
+    while low + i * step <= high + 1e-9:
+        value = low + i * step
+        values.append(round(value, 6) if isinstance(value, float) else value)
+        i += 1
+    return values
+
+
+def grid_points(axes):
+    names = list(axes)
+    for combo in itertools.product(*(grid_values(axes[name]) for name in names)):
+        yield dict(zip(names, combo))
+
+
+def random_points(axes, count, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        point = {}
+        for name, axis in axes.items():
+            if isinstance(axis, list):
+                point[name] = rng.choice(axis)
+            else:
+                low, high, _ = axis
+                if isinstance(low, int) and isinstance(high, int):
+                    point[name] = rng.randint(low, high)
+                else:
+                    point[name] = round(rng.uniform(low, high), 6)
+        yield point
+
+
+def point_id(point, matches, max_frames, seed):
+    """Stable id for a point and the run settings, used as the cache key in the results table."""
+    key = json.dumps([point, matches, max_frames, seed], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+# worker side
+
+_game = None
+_defaults = {}
+
+
+def _init_worker():
+    global _game
+    _game = Replay._game()
+
+
+def _apply(point):
+    for name, value in point.items():
+        current = getattr(_game, name, None)
+        if not isinstance(current, (int, float)) or isinstance(current, bool):
+            raise ValueError(f"{name} is not a numeric constant in Greg")
+        _defaults.setdefault(name, current)
+        setattr(_game, name, value)
+        if name in STATE_MIRRORS:
+            _game.game_state[STATE_MIRRORS[name]] = value
+
+
+def _restore():
+    for name, value in _defaults.items():
+        setattr(_game, name, value)
+        if name in STATE_MIRRORS:
+            _game.game_state[STATE_MIRRORS[name]] = value
+    _defaults.clear()
+
+
+def run_point(job):
+    """Plays one point's rounds inside a worker. Returns a result row, or raises."""
+    point, matches, max_frames, seed = job
+    started = time.perf_counter()
+    blue_wins = red_wins = timeouts = 0
+    total_ms = blue_left = red_left = 0.0
+
+    _apply(point)
+    try:
+        for i in range(matches):
+            Replay.simulate(seed * 100003 + i, 'ai', max_frames, _game)
+            state = _game.game_state
+            if not state['game_over']:
+                timeouts += 1
+            elif state['blue_health'] > 0:
+                blue_wins += 1
+            else:
+                red_wins += 1
+            total_ms += state['match_time']
+            blue_left += max(0, state['blue_health'])
+            red_left += max(0, state['red_health'])
+    finally:
+        _restore()
+
+    if timeouts == matches:
+        raise RuntimeError(f"all {matches} rounds timed out after {max_frames} frames; the AI never finished a fight")
+
+    return {
+        'point_id': point_id(point, matches, max_frames, seed),
+        'params': json.dumps(point, sort_keys=True),
+        'matches': matches,
+        'max_frames': max_frames,
+        'seed': seed,
+        'blue_win_rate': round(blue_wins / matches, 4),
+        'red_win_rate': round(red_wins / matches, 4),
+        'timeout_rate': round(timeouts / matches, 4),
+        'avg_round_s': round(total_ms / matches / 1000, 2),
+        'avg_blue_health_left': round(blue_left / matches, 2),
+        'avg_red_health_left': round(red_left / matches, 2),
+        'avg_health_diff': round((blue_left - red_left) / matches, 2),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+def _run_job(job):
+    try:
+        return job, run_point(job), None
+    except Exception as e:
+        return job, None, f"{type(e).__name__}: {e}"
+
+
+# driver side
+
+def load_results(path):
+    """Rows already in the results table, by point_id."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['point_id']: row for row in csv.DictReader(f)}
+
+
+def results_compatible(path):
+    """False if path is a results table with other columns (an older sweep), which can't be appended to."""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return True
+    with open(path, newline='') as f:
+        return tuple(next(csv.reader(f), ())) == RESULT_COLUMNS
+
+
+def sweep(points, out_path, matches=DEFAULT_MATCHES, max_frames=DEFAULT_MAX_FRAMES, seed=0, workers=None):
+    """
+    Runs every point not already in out_path and appends its row as soon as
+    it finishes. Yields (point, row, error) for the points that ran.
+    """
+    done = load_results(out_path)
+    jobs = []
+    seen = set(done)
+    for point in points:
+        pid = point_id(point, matches, max_frames, seed)
+        if pid not in seen:
+            seen.add(pid)
+            jobs.append((point, matches, max_frames, seed))
+    if not jobs:
+        return
+
+    new_file = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+    with open(out_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        if new_file:
+            writer.writeheader()
+
+        def record(job, row, error):
+            if row is not None:
+                writer.writerow(row)
+                f.flush()
+            return job[0], row, error
+
+        if workers == 1 or len(jobs) == 1:
+            _init_worker_in_process()
+            for job in jobs:
+                yield record(*_run_job(job))
+            return
+
+        # spawn, so every worker starts its own SDL instead of inheriting a forked one
+        pool = multiprocessing.get_context('spawn').Pool(workers, initializer=_init_worker)
+        try:
+            for result in pool.imap_unordered(_run_job, jobs):
+                yield record(*result)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            # SDL turns SIGTERM into a quit event, so workers are asked to exit rather than terminated
+            pool.join()
+
+
+def _init_worker_in_process():
+    global _game
+    if _game is None:
+        _game = Replay._game()
+
+
+def print_table(rows, limit):
+    """The most even points first: blue win rate closest to 50%, then fewest timeouts."""
+    rows = sorted(rows, key=lambda row: (abs(float(row['blue_win_rate']) - 0.5), float(row['timeout_rate'])))
+    print(f"{'blue win':>8} {'red win':>8} {'timeout':>8} {'hp diff':>8} {'round s':>8}  params")
+    for row in rows[:limit]:
+        print(f"{float(row['blue_win_rate']):>8.2f} {float(row['red_win_rate']):>8.2f} "
+              f"{float(row['timeout_rate']):>8.2f} {float(row['avg_health_diff']):>8.1f} "
+              f"{float(row['avg_round_s']):>8.1f}  {row['params']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Cube Combat balance constants")
+    parser.add_argument('--param', type=parse_axis, action='append', required=True,
+                        help="NAME=low:high[:step] or NAME=v1,v2,... (repeatable)")
+    parser.add_argument('--random', type=int, default=None, metavar='N', help="random search with N points instead of a grid")
+    parser.add_argument('--matches', type=int, default=DEFAULT_MATCHES, help="rounds per point")
+    parser.add_argument('--max-frames', type=int, default=DEFAULT_MAX_FRAMES, help="rounds still going after this are timeouts")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--out', default='balance_sweep.csv', help="results table; existing rows are reused")
+    parser.add_argument('--top', type=int, default=15, help="rows to print at the end")
+    args = parser.parse_args()
+
+    if not results_compatible(args.out):
+        print(f"Error: {args.out} was written with other columns by an older sweep; pass a new --out")
+        return 1
+
+    axes = dict(args.param)
+    points = random_points(axes, args.random, args.seed) if args.random else grid_points(axes)
+
+    started = time.perf_counter()
+    ran = failed = 0
+    for point, row, error in sweep(points, args.out, args.matches, args.max_frames, args.seed, args.workers):
+        if error:
+            failed += 1
+            print(f"{json.dumps(point, sort_keys=True)}: {error}")
+            continue
+        ran += 1
+        print(f"[{ran}] {row['params']}: blue {row['blue_win_rate']:.2f} red {row['red_win_rate']:.2f} "
+              f"timeouts {row['timeout_rate']:.2f} hp diff {row['avg_health_diff']:+.1f} ({row['seconds']}s)", flush=True)
+
+    print(f"{ran} points run, {failed} failed in {time.perf_counter() - started:.1f}s -> {args.out}")
+    print_table(list(load_results(args.out).values()), args.top)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
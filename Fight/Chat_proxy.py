@@ -0,0 +1,424 @@
+"""
+Streaming proxy between the chat page (Html_scripts/Chat.html) and the
+local LLM backend (Ollama's /api/generate on localhost:11434).
+
+Site_server mounts it at POST /api/chat. The page sends {"prompt", "model"}
+and gets a text/event-stream back. Response headers go out at once, and
+each token is forwarded as its own event the moment the backend produces
+it, so the first word shows up as soon as the model has one instead of
+after the whole completion:
+
+    event: queued     data: {"position": 2}         only when every backend slot is busy
+    (message)         data: {"token": "Hello"}      one per streamed chunk
+    event: done       data: {"cached": false, "ttft_ms": 180.4}
+    event: error      data: {"error": "..."}
+
+Backend connections are HTTP/1.1 keep-alive and live in a small pool, so a
+message doesn't pay a TCP handshake. At most MAX_CONCURRENT generations run
+at once. Later requests wait in line (up to MAX_QUEUED, then 503) and are told
+their position. Finished completions are kept in an LRU cache keyed by
+(model, prompt) for CACHE_TTL_S, so a repeated prompt is answered straight
+from memory.
+
+For trying it without a model, `stub` runs a fake backend that streams a
+canned reply in the same NDJSON format:
+
+    python Chat_proxy.py stub --port 11434
+    python Site_server.py
+    python Chat_proxy.py ask "hello"      # prints tokens and time to first token
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from urllib.parse import urlsplit
+
+DEFAULT_BACKEND = 'http://localhost:11434'
+DEFAULT_MODEL = 'mistral'
+GENERATE_PATH = '/api/generate'
+
+POOL_SIZE = 4
+MAX_CONCURRENT = 2
+MAX_QUEUED = 32
+CACHE_ENTRIES = 256
+CACHE_TTL_S = 600
+MAX_PROMPT_CHARS = 8000
+CONNECT_TIMEOUT_S = 5
+TOKEN_TIMEOUT_S = 120   # longest wait for the next chunk (the first one includes model load)
+
+SSE_HEADERS = (b'HTTP/1.1 200 OK\r\n'
+               b'Content-Type: text/event-stream; charset=utf-8\r\n'
+               b'Cache-Control: no-cache\r\n'
+               b'Access-Control-Allow-Origin: *\r\n'
+               b'Transfer-Encoding: chunked\r\n')
+
+
+class BackendError(Exception):
+    pass
+
+
+def parse_request(body):
+    """(prompt, model) from the page's JSON body; ValueError if it isn't usable."""
+    try:
+        data = json.loads(body or b'{}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError("body is not JSON")
+    prompt = data.get('prompt') if isinstance(data, dict) else None
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("missing prompt")
+    if len(prompt) > MAX_PROMPT_CHARS:
+        raise ValueError("prompt too long")
+    model = data.get('model') or DEFAULT_MODEL
+    if not isinstance(model, str):
+        raise ValueError("bad model")
+    return prompt.strip(), model
+
+
+def sse(data, event=None):
+    """One server-sent event, wrapped as an HTTP chunk."""
+    payload = json.dumps(data, ensure_ascii=False)
+    text = (f'event: {event}\ndata: {payload}\n\n' if event else f'data: {payload}\n\n').encode('utf-8')
+    return b'%x\r\n%s\r\n' % (len(text), text)
+
+
+class ResponseCache:
+    """(model, prompt) -> completion text, least recently used first, each entry expiring after `ttl` seconds."""
+
+    def __init__(self, entries=CACHE_ENTRIES, ttl=CACHE_TTL_S):
+        self.entries = entries
+        self.ttl = ttl
+        self.items = OrderedDict()
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires, text = item
+        if expires < time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return text
+
+    def put(self, key, text):
+        self.items[key] = (time.monotonic() + self.ttl, text)
+        self.items.move_to_end(key)
+        while len(self.items) > self.entries:
+            self.items.popitem(last=False)
+
+
+class BackendPool:
+    """Idle keep-alive connections to the backend, reused LIFO."""
+
+    def __init__(self, url=DEFAULT_BACKEND, size=POOL_SIZE):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 80
+        self.host_header = parts.netloc or self.host
+        self.size = size
+        self.idle = []
+        self.opened = 0
+
+    async def acquire(self):
+        """(reader, writer, reused)."""
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT_S)
+        self.opened += 1
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        if reusable and len(self.idle) < self.size and not reader.at_eof():
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def prewarm(self):
+        """Opens one connection ahead of the first message; a backend that isn't up yet is fine."""
+        try:
+            reader, writer, _ = await self.acquire()
+        except (OSError, asyncio.TimeoutError):
+            return False
+        self.release(reader, writer, True)
+        return True
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle.clear()
+
+
+async def read_response_head(reader):
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), TOKEN_TIMEOUT_S)
+    lines = head.decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ', 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise BackendError(f"bad status line from backend: {lines[0]!r}")
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return int(parts[1]), headers
+
+
+async def iter_body(reader, headers):
+    """Yields the response body as it arrives (chunked or Content-Length)."""
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        while True:
+            size_line = await asyncio.wait_for(reader.readuntil(b'\r\n'), TOKEN_TIMEOUT_S)
+            size = int(size_line.split(b';', 1)[0], 16)
+            if size == 0:
+                await reader.readuntil(b'\r\n')     # no trailers from Ollama; just the final CRLF
+                return
+            data = await asyncio.wait_for(reader.readexactly(size + 2), TOKEN_TIMEOUT_S)
+            yield data[:-2]
+    else:
+        remaining = int(headers.get('content-length', 0))
+        while remaining:
+            data = await asyncio.wait_for(reader.read(min(remaining, 65536)), TOKEN_TIMEOUT_S)
+            if not data:
+                raise BackendError("backend closed the connection mid-response")
+            remaining -= len(data)
+            yield data
+
+
+class ChatProxy:
+    def __init__(self, backend=DEFAULT_BACKEND, max_concurrent=MAX_CONCURRENT, max_queued=MAX_QUEUED,
+                 cache_entries=CACHE_ENTRIES, cache_ttl=CACHE_TTL_S):
+        self.pool = BackendPool(backend, max(POOL_SIZE, max_concurrent))
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.max_queued = max_queued
+        self.waiting = 0
+        self.cache = ResponseCache(cache_entries, cache_ttl)
+
+        self.requests = 0
+        self.cache_hits = 0
+        self.backend_errors = 0
+        self.ttft_ms_total = 0.0
+        self.ttft_count = 0
+
+    def stats(self):
+        return {'requests': self.requests, 'cache_hits': self.cache_hits, 'backend_errors': self.backend_errors,
+                'waiting': self.waiting, 'cached_prompts': len(self.cache.items),
+                'backend_connections_opened': self.pool.opened,
+                'mean_ttft_ms': round(self.ttft_ms_total / self.ttft_count, 1) if self.ttft_count else None}
+
+    def full(self):
+        return self.waiting >= self.max_queued
+
+    async def generate(self, prompt, model):
+        """Yields tokens from the backend, retrying once on a pooled connection the backend already dropped."""
+        body = json.dumps({'model': model, 'prompt': prompt, 'stream': True}).encode('utf-8')
+        request = (f'POST {GENERATE_PATH} HTTP/1.1\r\nHost: {self.pool.host_header}\r\n'
+                   f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                   f'Connection: keep-alive\r\n\r\n').encode('latin-1') + body
+
+        for attempt in (0, 1):
+            reader, writer, reused = await self.pool.acquire()
+            headers = {}
+            done = False
+            try:
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers = await read_response_head(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                chunks = iter_body(reader, headers)
+                if status != 200:
+                    detail = b''.join([chunk async for chunk in chunks])
+                    done = True
+                    try:
+                        message = json.loads(detail).get('error', '')
+                    except (ValueError, AttributeError):
+                        message = detail[:200].decode('utf-8', 'replace')
+                    raise BackendError(f"backend returned {status}: {message}")
+
+                buffer = b''
+                async for chunk in chunks:
+                    buffer += chunk
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        message = json.loads(line)
+                        if message.get('error'):
+                            raise BackendError(message['error'])
+                        if message.get('response'):
+                            yield message['response']
+                done = True
+                return
+            finally:
+                keep = done and headers.get('connection', '').lower() != 'close'
+                self.pool.release(reader, writer, keep)
+
+    async def stream(self, writer, prompt, model, keep_alive=True):
+        """Answers one chat request on `writer` as a chunked event stream. Returns the HTTP status."""
+        self.requests += 1
+        writer.write(SSE_HEADERS + (b'Connection: keep-alive\r\n\r\n' if keep_alive else b'Connection: close\r\n\r\n'))
+        started = time.perf_counter()
+
+        key = (model, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            writer.write(sse({'token': cached}))
+            writer.write(sse({'cached': True, 'ttft_ms': round((time.perf_counter() - started) * 1000, 1)}, 'done'))
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            return 200
+
+        if self.slots.locked():
+            writer.write(sse({'position': self.waiting + 1}, 'queued'))
+        await writer.drain()
+
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            tokens = []
+            ttft_ms = None
+            try:
+                # aclosing: if the browser goes away mid-stream, the backend connection is dropped right here
+                async with aclosing(self.generate(prompt, model)) as generation:
+                    async for token in generation:
+                        if ttft_ms is None:
+                            ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+                            self.ttft_ms_total += ttft_ms
+                            self.ttft_count += 1
+                        tokens.append(token)
+                        writer.write(sse({'token': token}))
+                        await writer.drain()
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    BackendError, ValueError) as e:
+                if isinstance(e, ConnectionError) and writer.is_closing():
+                    raise
+                self.backend_errors += 1
+                writer.write(sse({'error': f"chat backend unavailable: {e}" if isinstance(e, OSError) else str(e)}, 'error'))
+            else:
+                self.cache.put(key, ''.join(tokens))
+                writer.write(sse({'cached': False, 'ttft_ms': ttft_ms}, 'done'))
+        finally:
+            self.slots.release()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return 200
+
+    async def start(self):
+        await self.pool.prewarm()
+
+    def close(self):
+        self.pool.close()
+
+
+# local testing
+
+STUB_REPLY = "I need iron blocks, I'm out of bricks, I don't want to be surrounded by lava."
+
+
+async def start_stub(host, port, delay_s):
+    """A fake /api/generate that streams STUB_REPLY word by word as chunked NDJSON, like Ollama. Returns the server."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                request = json.loads(await reader.readexactly(length)) if length else {}
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n')
+                for word in stub_words(request.get('prompt', '')):
+                    await asyncio.sleep(delay_s)
+                    line = json.dumps({'model': request.get('model'), 'response': word, 'done': False}).encode() + b'\n'
+                    writer.write(b'%x\r\n%s\r\n' % (len(line), line))
+                    await writer.drain()
+                line = json.dumps({'model': request.get('model'), 'response': '', 'done': True}).encode() + b'\n'
+                writer.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(line), line))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def stub_words(prompt):
+    """The tokens the stub streams for `prompt`, in order."""
+    return [f"({prompt[:40]}) "] + [word + ' ' for word in STUB_REPLY.split()]
+
+
+async def stub_backend(host, port, delay_s):
+    server = await start_stub(host, port, delay_s)
+    print(f"Stub chat backend on http://{host}:{port}{GENERATE_PATH}")
+    async with server:
+        await server.serve_forever()
+
+
+async def ask(url, prompt, model):
+    """Sends one prompt through the proxy and prints the stream as it arrives."""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    body = json.dumps({'prompt': prompt, 'model': model}).encode('utf-8')
+    started = time.perf_counter()
+    writer.write((f'POST {parts.path or "/api/chat"} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+                  f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n').encode() + body)
+    await writer.drain()
+    status, headers = await read_response_head(reader)
+    first = None
+    text = b''
+    async for chunk in iter_body(reader, headers):
+        text += chunk
+        while b'\n\n' in text:
+            event, text = text.split(b'\n\n', 1)
+            fields = dict(line.split(': ', 1) for line in event.decode('utf-8').split('\n') if ': ' in line)
+            data = json.loads(fields.get('data', '{}'))
+            if 'token' in data:
+                if first is None:
+                    first = time.perf_counter() - started
+                print(data['token'], end='', flush=True)
+            elif fields.get('event'):
+                print(f"\n[{fields['event']}] {data}")
+    writer.close()
+    print(f"status {status}, first token after {first * 1000:.1f} ms" if first is not None else f"status {status}, no tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat proxy tools (the proxy itself runs inside Site_server.py)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    stub = sub.add_parser('stub', help="run a fake streaming backend")
+    stub.add_argument('--host', default='127.0.0.1')
+    stub.add_argument('--port', type=int, default=11434)
+    stub.add_argument('--delay', type=float, default=0.05, help="seconds between streamed words")
+    question = sub.add_parser('ask', help="send one prompt through the proxy")
+    question.add_argument('prompt')
+    question.add_argument('--url', default='http://127.0.0.1:8000/api/chat')
+    question.add_argument('--model', default=DEFAULT_MODEL)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'stub':
+            asyncio.run(stub_backend(args.host, args.port, args.delay))
+        else:
+            asyncio.run(ask(args.url, args.prompt, args.model))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""
+Buffered combat event log for Cube Combat.
+
+Greg.py reports hits, parries, boundary damage and deaths with emit().
+emit() never does I/O. It writes a few numbers into a preallocated ring
+buffer, and a background writer thread drains the ring into a JSONL or
+binary log file and passes each event to the async subscribers (the
+console printer is one of them). Sync subscribers run inline inside emit()
+for code that has to react on the same frame, such as achievements.
+
+Every event record has the same shape:
+    kind, time (match ms), actor, flag (hit/success), value (damage), extra (target health)
+"""
+
+import atexit
+import json
+import struct
+import threading
+from array import array
+
+LEVEL_DEBUG = 10
+LEVEL_INFO = 20
+LEVEL_WARNING = 30
+
+ACTOR_NONE = 0
+ACTOR_BLUE = 1
+ACTOR_RED = 2
+ACTOR_NAMES = ('none', 'blue', 'red')
+
+EVENT_MATCH_START = 1   # actor: none, value: mode code, extra: blue cube id * 1000 + red cube id
+EVENT_MATCH_END = 2     # actor: winner
+EVENT_SLASH = 3         # flag: hit
+EVENT_BEAM = 4          # flag: hit
+EVENT_CHARGE_START = 5
+EVENT_CHARGE_HIT = 6    # flag: hit actually dealt damage (False when debug invincible)
+EVENT_BOUNDARY_HIT = 7 # actor: who hit the wall, flag: damage was taken (False when debug invincible), value: damage taken
+EVENT_PARRY = 8         # flag: success
+EVENT_DEATH = 9         # actor: who died
+EVENT_AI_MODE = 10      # actor: red, value: index into AI_MODES, logged whenever red_cube_mode changes
+EVENT_WINDUP_FLASH = 11 # actor: red, flag: beam (else charge) windup, value: flash_count after the step
+EVENT_RESPAWN = 12      # actor: red, brought back at full health after dying (debug mode against the AI)
+
+EVENT_NAMES = {
+    EVENT_MATCH_START: 'match_start',
+    EVENT_MATCH_END: 'match_end',
+    EVENT_SLASH: 'slash',
+    EVENT_BEAM: 'beam',
+    EVENT_CHARGE_START: 'charge_start',
+    EVENT_CHARGE_HIT: 'charge_hit',
+    EVENT_BOUNDARY_HIT: 'boundary_hit',
+    EVENT_PARRY: 'parry',
+    EVENT_DEATH: 'death',
+    EVENT_AI_MODE: 'ai_mode',
+    EVENT_WINDUP_FLASH: 'windup_flash',
+    EVENT_RESPAWN: 'respawn',
+}
+EVENT_KINDS = {name: kind for kind, name in EVENT_NAMES.items()}
+
+EVENT_LEVELS = {
+    EVENT_MATCH_START: LEVEL_INFO,
+    EVENT_MATCH_END: LEVEL_INFO,
+    EVENT_SLASH: LEVEL_DEBUG,
+    EVENT_BEAM: LEVEL_DEBUG,
+    EVENT_CHARGE_START: LEVEL_DEBUG,
+    EVENT_CHARGE_HIT: LEVEL_INFO,
+    EVENT_BOUNDARY_HIT: LEVEL_INFO,
+    EVENT_PARRY: LEVEL_DEBUG,
+    EVENT_DEATH: LEVEL_INFO,
+    EVENT_AI_MODE: LEVEL_DEBUG,
+    EVENT_WINDUP_FLASH: LEVEL_DEBUG,
+    EVENT_RESPAWN: LEVEL_INFO,
+}
+
+MATCH_MODES = (None, 'ai', 'pvp')
+
+# every red_cube_mode, in code order; lives here so log readers don't need pygame
+AI_MODES = ("Maintain", "Attack", "Close Gap", "Back Off", "Defensive Retreat",
+            "Charge (Windup)", "Charge", "Charge (Endlag)", "Beam (Windup)", "Parried (Stun)")
+AI_MODE_CODES = {name: i for i, name in enumerate(AI_MODES)}
+
+RING_CAPACITY = 8192
+FLUSH_INTERVAL_S = 0.25
+
+BINARY_MAGIC = b"CCLOG1\n"
+BINARY_RECORD = struct.Struct('<BdBBid')  # kind, time, actor, flag, value, extra
+
+# preallocated ring, one array per field; only emit() writes, only the writer thread reads
+_kinds = array('B', bytes(RING_CAPACITY))
+_times = array('d', bytes(8 * RING_CAPACITY))
+_actors = array('B', bytes(RING_CAPACITY))
+_flags = array('B', bytes(RING_CAPACITY))
+_values = array('i', bytes(4 * RING_CAPACITY))
+_extras = array('d', bytes(8 * RING_CAPACITY))
+_head = 0   # next slot emit() writes
+_tail = 0   # next slot the writer reads
+
+match_time = 0.0    # Greg keeps this in step with game_state['match_time']
+capture = None      # a list while Netplay simulates a frame it may still roll back; emit() appends to it
+min_level = LEVEL_DEBUG
+dropped = 0
+
+_sync_subscribers = {}      # kind -> list of callables, run inside emit()
+_async_subscribers = []     # run on the writer thread for every buffered event
+_sample_every = {}          # kind -> keep one event in N in the ring
+_sample_counters = {}
+_buffering = False          # nothing drains the ring until a writer is started
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def emit(kind, actor=ACTOR_NONE, flag=False, value=0, extra=0.0):
+    """Records one combat event. Costs a few array writes; never blocks on I/O."""
+    if capture is not None:
+        capture.append((kind, match_time, actor, flag, value, extra))
+        return
+    publish(kind, match_time, actor, flag, value, extra)
+
+
+def publish(kind, time, actor, flag, value, extra):
+    """
+    Reports an event to the subscribers and the ring. emit() calls this
+    directly. Netplay calls it for captured events once their frame can
+    no longer be rolled back.
+    """
+    global _head, dropped
+    subscribers = _sync_subscribers.get(kind)
+    if subscribers:
+        for fn in subscribers:
+            fn(kind, time, actor, flag, value, extra)
+
+    if not _buffering or EVENT_LEVELS[kind] < min_level:
+        return
+
+    every = _sample_every.get(kind)
+    if every:
+        count = _sample_counters[kind] = _sample_counters.get(kind, 0) + 1
+        if count % every:
+            return
+
+    if _head - _tail >= RING_CAPACITY:
+        dropped += 1
+        return
+
+    i = _head % RING_CAPACITY
+    _kinds[i] = kind
+    _times[i] = time
+    _actors[i] = actor
+    _flags[i] = flag
+    _values[i] = value
+    _extras[i] = extra
+    _head += 1
+
+
+def subscribe(fn, kinds=None, sync=False):
+    """
+    Registers fn(kind, time, actor, flag, value, extra).
+    Sync subscribers run inside emit() for the given kinds (all kinds if None);
+    async ones run on the writer thread and see every event that passed level and sampling.
+    """
+    if sync:
+        for kind in (kinds or EVENT_NAMES):
+            _sync_subscribers.setdefault(kind, []).append(fn)
+    else:
+        _async_subscribers.append(fn)
+
+
+def unsubscribe(fn):
+    for subscribers in _sync_subscribers.values():
+        if fn in subscribers:
+            subscribers.remove(fn)
+    if fn in _async_subscribers:
+        _async_subscribers.remove(fn)
+
+
+def set_sampling(kind, every):
+    """Keep only one in `every` events of this kind in the log (1 or None keeps all)."""
+    if not every or every <= 1:
+        _sample_every.pop(kind, None)
+    else:
+        _sample_every[kind] = every
+
+
+def event_to_dict(kind, time, actor, flag, value, extra):
+    event = {
+        't': round(time, 3),
+        'event': EVENT_NAMES.get(kind, kind),
+        'actor': ACTOR_NAMES[actor],
+        'flag': bool(flag),
+        'value': value,
+        'extra': extra,
+    }
+    if kind == EVENT_MATCH_START:
+        event['mode'] = MATCH_MODES[value]
+        event['blue_cube'], event['red_cube'] = divmod(int(extra), 1000)
+    elif kind == EVENT_AI_MODE:
+        event['ai_mode'] = AI_MODES[value]
+    return event
+
+
+def format_event(kind, time, actor, flag, value, extra):
+    """The same console lines Greg.py used to print directly."""
+    who = "Blue Cube" if actor == ACTOR_BLUE else "Red Cube"
+    if kind == EVENT_SLASH:
+        return f"{who} Slash hit! Damage: {value}. Red Health: {max(0, int(extra))}" if flag else None
+    if kind == EVENT_BEAM:
+        if not flag:
+            return None
+        if not value:
+            return f"{who} Beam hit! (Debug Invincible)"
+        return f"{who} Beam hit! Damage: {value}. Blue Health: {max(0, int(extra))}"
+    if kind == EVENT_PARRY:
+        return "Successful Parry! Red Cube stunned." if flag else "Parry Attempt: Missed timing or no active windup."
+    if kind == EVENT_CHARGE_START:
+        return "Player 2 initiated Charge Windup." if flag else None
+    if kind == EVENT_CHARGE_HIT:
+        if not flag:
+            return f"{who} Charge hit! (Debug Invincible)"
+        return f"{who} Charge hit! INSTA-KILL! Blue Health: {max(0, int(extra))}"
+    if kind == EVENT_BOUNDARY_HIT:
+        if not flag:
+            return f"{who} hit boundary! (Debug Invincible)"
+        return f"{who} hit boundary! Damage: {value}. Red Health: {max(0, int(extra))}"
+    if kind == EVENT_DEATH:
+        return f"{who} Defeated!"
+    if kind == EVENT_RESPAWN:
+        return f"Debug Mode: {who} Respawning..."
+    if kind == EVENT_MATCH_END:
+        return f"{who} Wins!"
+    if kind == EVENT_MATCH_START:
+        return f"Match started ({MATCH_MODES[value]})."
+    return None
+
+
+def print_event(kind, time, actor, flag, value, extra):
+    line = format_event(kind, time, actor, flag, value, extra)
+    if line:
+        print(line)
+
+
+def enable_console():
+    """Prints events like the old inline print() calls, but from the writer thread."""
+    if print_event not in _async_subscribers:
+        subscribe(print_event)
+
+
+def _drain(out, fmt):
+    global _tail
+    head = _head
+    tail = _tail
+    if head == tail:
+        return 0
+
+    lines = []
+    for n in range(tail, head):
+        i = n % RING_CAPACITY
+        record = (_kinds[i], _times[i], _actors[i], _flags[i], _values[i], _extras[i])
+        for fn in _async_subscribers:
+            try:
+                fn(*record)
+            except Exception as e:
+                print(f"Error in combat log subscriber: {e}")
+        if out is not None:
+            if fmt == 'binary':
+                lines.append(BINARY_RECORD.pack(*record))
+            else:
+                lines.append(json.dumps(event_to_dict(*record)) + "\n")
+    _tail = head
+
+    if out is not None and lines:
+        out.write((b"" if fmt == 'binary' else "").join(lines))
+        out.flush()
+    return head - tail
+
+
+class _Writer(threading.Thread):
+    def __init__(self, path, fmt, flush_interval):
+        super().__init__(name="combat-log-writer", daemon=True)
+        self.path = path
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.stop_event = threading.Event()
+        self.out = None
+
+    def run(self):
+        if self.path:
+            try:
+                if self.fmt == 'binary':
+                    self.out = open(self.path, 'ab')
+                    if self.out.tell() == 0:
+                        self.out.write(BINARY_MAGIC)
+                else:
+                    self.out = open(self.path, 'a')
+            except IOError as e:
+                print(f"Error opening combat log {self.path}: {e}")
+                self.out = None
+
+        while not self.stop_event.wait(self.flush_interval):
+            _drain(self.out, self.fmt)
+        _drain(self.out, self.fmt)
+
+        if self.out is not None:
+            self.out.close()
+
+
+def start_writer(path=None, fmt='jsonl', flush_interval=FLUSH_INTERVAL_S):
+    """
+    Starts draining the ring on a background thread. With a path, events are
+    appended to it as JSONL or as fixed-size binary records (fmt='binary').
+    """
+    global _writer, _buffering
+    if fmt not in ('jsonl', 'binary'):
+        raise ValueError(f"Unknown combat log format: {fmt}")
+    with _writer_lock:
+        if _writer is not None:
+            stop_writer()
+        _writer = _Writer(path, fmt, flush_interval)
+        _buffering = True
+        _writer.start()
+
+
+def stop_writer():
+    """Flushes everything still in the ring and stops the writer thread."""
+    global _writer, _buffering
+    writer = _writer
+    if writer is None:
+        return
+    writer.stop_event.set()
+    writer.join()
+    _writer = None
+    _buffering = False
+
+atexit.register(stop_writer)
+
+
+def read_log(path):
+    """Yields event dicts from a JSONL or binary combat log, one at a time."""
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+            while True:
+                chunk = f.read(BINARY_RECORD.size * 4096)
+                if not chunk:
+                    return
+                for record in BINARY_RECORD.iter_unpack(chunk[:len(chunk) - len(chunk) % BINARY_RECORD.size]):
+                    yield event_to_dict(*record)
+        else:
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
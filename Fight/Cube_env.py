@@ -0,0 +1,378 @@
+"""
+Gym-style training environment around the Cube Combat rules in Greg.py.
+
+Runs the real update_game() with no window, so bots train against the exact
+rules the game ships with. Observations, rewards and done flags live in
+preallocated NumPy arrays that are overwritten in place every step.
+
+    env = CubeEnv(mode='ai')
+    obs = env.reset(seed=1)
+    obs, reward, done = env.step(action)
+
+VecCubeEnv steps many matches per call and SubprocVecCubeEnv spreads them
+over worker processes that share their arrays through shared memory.
+"""
+
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import random
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import pygame
+
+import Greg
+
+FRAME_MS = 1000 / 60
+MAX_EPISODE_FRAMES = 60 * 120
+WIN_REWARD = 1.0
+
+OBS_FIELDS = (
+    'blue_x', 'blue_y', 'red_x', 'red_y',
+    'blue_health', 'red_health',
+    'special_attack_cooldown_timer', 'ai_special_attack_cooldown_timer',
+    'flash_timer', 'endlag_timer', 'hitbox_timer', 'ai_hitbox_timer', 'parry_timer',
+    'flash_count', 'ai_beam_angle',
+    'charge_state', 'ai_attack_state', 'red_cube_mode',
+    'ai_cyan_beam_active', 'purple_hitbox_active', 'parry_active',
+)
+OBS_SIZE = len(OBS_FIELDS)
+
+CHARGE_STATE_CODES = {name: i for i, name in enumerate(Greg.CHARGE_STATES)}
+AI_ATTACK_STATE_CODES = {name: i for i, name in enumerate(Greg.AI_ATTACK_STATES)}
+RED_CUBE_MODE_CODES = {name: i for i, name in enumerate(Greg.RED_CUBE_MODES)}
+
+# action = move + 9 * button, so a single int covers every key combination a player can hold
+MOVES = ((0, 0), (0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1))
+BUTTON_NONE = 0
+BUTTON_ATTACK = 1   # SPACE for P1, L for P2
+BUTTON_SPECIAL = 2  # F (parry) for P1, K (charge) for P2
+N_ACTIONS = len(MOVES) * 3
+
+BLUE_KEYS = (pygame.K_w, pygame.K_s, pygame.K_a, pygame.K_d, pygame.K_SPACE, pygame.K_f)
+RED_KEYS = (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_l, pygame.K_k)
+
+
+def _build_action_table(bound_keys):
+    """Precomputes (up, down, left, right, pressed_key) for every action id."""
+    up_key, down_key, left_key, right_key, attack_key, special_key = bound_keys
+    table = []
+    for button in (BUTTON_NONE, BUTTON_ATTACK, BUTTON_SPECIAL):
+        pressed = {BUTTON_NONE: None, BUTTON_ATTACK: attack_key, BUTTON_SPECIAL: special_key}[button]
+        for mx, my in MOVES:
+            table.append((my < 0, my > 0, mx < 0, mx > 0, pressed))
+    return tuple(table)
+
+BLUE_ACTIONS = _build_action_table(BLUE_KEYS)
+RED_ACTIONS = _build_action_table(RED_KEYS)
+
+
+class CubeEnv:
+    """One headless Cube Combat match. In 'ai' mode you play blue, in 'pvp' mode you play both."""
+
+    def __init__(self, mode='ai', frame_ms=FRAME_MS, max_frames=MAX_EPISODE_FRAMES,
+                 obs=None, reward=None, terminal_obs=None):
+        if mode not in ('ai', 'pvp'):
+            raise ValueError(f"Unknown mode: {mode}")
+
+        Greg.autosave_stats = False
+
+        self.mode = mode
+        self.n_agents = 1 if mode == 'ai' else 2
+        self.frame_ms = frame_ms
+        self.max_frames = max_frames
+        self.frame = 0
+
+        self.state = dict(Greg.initial_game_state)
+        self.rng = random.Random()
+        self.keys = {key: False for key in BLUE_KEYS[:4] + RED_KEYS[:4]}
+
+        self.obs = obs if obs is not None else np.zeros(OBS_SIZE, dtype=np.float32)
+        self.reward = reward if reward is not None else np.zeros(self.n_agents, dtype=np.float32)
+        self.terminal_obs = terminal_obs if terminal_obs is not None else np.zeros(OBS_SIZE, dtype=np.float32)
+
+    def _activate(self):
+        """Points Greg's module state at this match. Three attribute writes, no copying."""
+        Greg.game_state = self.state
+        Greg.rng = self.rng
+        Greg.selected_mode = self.mode
+
+    def reset(self, seed=None):
+        """Starts a fresh match and returns the observation array."""
+        if seed is not None:
+            self.rng.seed(seed)
+        self.state.clear()
+        self.state.update(Greg.initial_game_state)
+        self.frame = 0
+        self.reward[:] = 0
+        self._write_obs(self.obs)
+        return self.obs
+
+    def _apply_action(self, action, action_table):
+        up, down, left, right, pressed = action_table[action]
+        keys = self.keys
+        if action_table is BLUE_ACTIONS:
+            keys[pygame.K_w], keys[pygame.K_s], keys[pygame.K_a], keys[pygame.K_d] = up, down, left, right
+        else:
+            keys[pygame.K_UP], keys[pygame.K_DOWN], keys[pygame.K_LEFT], keys[pygame.K_RIGHT] = up, down, left, right
+        if pressed is not None:
+            Greg.handle_gameplay_keydown(pressed)
+
+    def _step(self, action):
+        """Advances one frame and fills self.obs/self.reward. Returns the done flag."""
+        self._activate()
+        state = self.state
+
+        blue_before = max(0, state['blue_health'])
+        red_before = max(0, state['red_health'])
+
+        if self.n_agents == 1:
+            self._apply_action(action, BLUE_ACTIONS)
+        else:
+            self._apply_action(action[0], BLUE_ACTIONS)
+            self._apply_action(action[1], RED_ACTIONS)
+
+        if not state['game_over']:
+            Greg.update_game(self.frame_ms, self.keys)
+        self.frame += 1
+
+        blue_lost = blue_before - max(0, state['blue_health'])
+        red_lost = red_before - max(0, state['red_health'])
+        reward = (red_lost - blue_lost) / Greg.INITIAL_RED_HEALTH
+        if state['game_over']:
+            reward += WIN_REWARD if state['blue_health'] > 0 else -WIN_REWARD
+
+        self.reward[0] = reward
+        if self.n_agents == 2:
+            self.reward[1] = -reward
+
+        self._write_obs(self.obs)
+        return state['game_over'] or self.frame >= self.max_frames
+
+    def step(self, action):
+        """Takes an action id (or a pair of ids in pvp) and returns (obs, reward, done)."""
+        done = self._step(action)
+        return self.obs, self.reward, done
+
+    def _write_obs(self, out):
+        s = self.state
+        out[:] = (
+            s['blue_x'], s['blue_y'], s['red_x'], s['red_y'],
+            s['blue_health'], s['red_health'],
+            s['special_attack_cooldown_timer'], s['ai_special_attack_cooldown_timer'],
+            s['flash_timer'], s['endlag_timer'], s['hitbox_timer'], s['ai_hitbox_timer'], s['parry_timer'],
+            s['flash_count'], s['ai_beam_angle'],
+            CHARGE_STATE_CODES[s['charge_state']],
+            AI_ATTACK_STATE_CODES[s['ai_attack_state']],
+            RED_CUBE_MODE_CODES[s['red_cube_mode']],
+            s['ai_cyan_beam_active'], s['purple_hitbox_active'], s['parry_active'],
+        )
+
+
+class VecCubeEnv:
+    """
+    Steps n_envs matches per call. Finished matches reset themselves and
+    their last observation is left in terminal_obs.
+    """
+
+    def __init__(self, n_envs, mode='ai', frame_ms=FRAME_MS, max_frames=MAX_EPISODE_FRAMES, buffers=None):
+        n_agents = 1 if mode == 'ai' else 2
+        if buffers is None:
+            buffers = _allocate_buffers(n_envs, n_agents)
+        self.obs, self.rewards, self.dones, self.terminal_obs = buffers
+
+        self.n_envs = n_envs
+        self.n_agents = n_agents
+        self.envs = [
+            CubeEnv(mode, frame_ms, max_frames, obs=self.obs[i], reward=self.rewards[i],
+                    terminal_obs=self.terminal_obs[i])
+            for i in range(n_envs)
+        ]
+
+    def reset(self, seed=None):
+        for i, env in enumerate(self.envs):
+            env.reset(None if seed is None else seed + i)
+        self.dones[:] = False
+        return self.obs
+
+    def step(self, actions):
+        """actions has shape (n_envs,) in 'ai' mode or (n_envs, 2) in 'pvp'. Returns (obs, rewards, dones)."""
+        dones = self.dones
+        for i, (env, action) in enumerate(zip(self.envs, actions.tolist())):
+            done = env._step(action)
+            dones[i] = done
+            if done:
+                env.terminal_obs[:] = env.obs
+                env.reset()
+        return self.obs, self.rewards, dones
+
+
+def _allocate_buffers(n_envs, n_agents):
+    return (
+        np.zeros((n_envs, OBS_SIZE), dtype=np.float32),
+        np.zeros((n_envs, n_agents), dtype=np.float32),
+        np.zeros(n_envs, dtype=np.bool_),
+        np.zeros((n_envs, OBS_SIZE), dtype=np.float32),
+    )
+
+
+def _shared_array(shape, dtype, name=None):
+    """Creates (or attaches to, when name is given) a NumPy array backed by shared memory."""
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    if name is None:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _subproc_worker(conn, layout, start, stop, mode, frame_ms, max_frames):
+    """Worker loop: owns envs [start, stop) and writes straight into the shared arrays."""
+    handles = []
+    views = []
+    for name, shape, dtype in layout:
+        shm, array = _shared_array(shape, dtype, name=name)
+        handles.append(shm)
+        views.append(array[start:stop])
+    obs, rewards, dones, terminal_obs, actions = views
+
+    env = VecCubeEnv(stop - start, mode, frame_ms, max_frames, buffers=(obs, rewards, dones, terminal_obs))
+
+    try:
+        while True:
+            command, arg = conn.recv()
+            if command == 'step':
+                env.step(actions)
+                conn.send(None)
+            elif command == 'reset':
+                env.reset(None if arg is None else arg + start)
+                conn.send(None)
+            elif command == 'close':
+                break
+    finally:
+        del obs, rewards, dones, terminal_obs, actions, views, env
+        for shm in handles:
+            shm.close()
+        conn.close()
+
+
+class SubprocVecCubeEnv:
+    """
+    Same interface as VecCubeEnv, but the matches are split across worker
+    processes. Actions and results travel through shared memory, the pipes
+    only carry tiny command messages.
+    """
+
+    def __init__(self, n_envs, n_workers=None, mode='ai', frame_ms=FRAME_MS, max_frames=MAX_EPISODE_FRAMES):
+        n_workers = min(n_envs, n_workers or os.cpu_count() or 1)
+        n_agents = 1 if mode == 'ai' else 2
+        action_shape = (n_envs,) if n_agents == 1 else (n_envs, 2)
+
+        layout = [
+            ((n_envs, OBS_SIZE), np.float32),
+            ((n_envs, n_agents), np.float32),
+            ((n_envs,), np.bool_),
+            ((n_envs, OBS_SIZE), np.float32),
+            (action_shape, np.int64),
+        ]
+        self._shms = []
+        arrays = []
+        for shape, dtype in layout:
+            shm, array = _shared_array(shape, dtype)
+            array[...] = 0
+            self._shms.append(shm)
+            arrays.append(array)
+        self.obs, self.rewards, self.dones, self.terminal_obs, self.actions = arrays
+        worker_layout = [(shm.name, shape, dtype) for shm, (shape, dtype) in zip(self._shms, layout)]
+
+        self.n_envs = n_envs
+        self.n_agents = n_agents
+
+        ctx = mp.get_context("spawn")
+        self._conns = []
+        self._procs = []
+        bounds = np.linspace(0, n_envs, n_workers + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(
+                target=_subproc_worker,
+                args=(child_conn, worker_layout, int(start), int(stop), mode, frame_ms, max_frames),
+                daemon=True,
+            )
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+    def _broadcast(self, command, arg=None):
+        for conn in self._conns:
+            conn.send((command, arg))
+        for conn in self._conns:
+            conn.recv()
+
+    def reset(self, seed=None):
+        self._broadcast('reset', seed)
+        return self.obs
+
+    def step(self, actions):
+        self.actions[...] = actions
+        self._broadcast('step')
+        return self.obs, self.rewards, self.dones
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms = []
+
+
+def benchmark(n_steps=20000, n_envs=64):
+    """Prints the per-step cost of the single, vectorized and subprocess environments."""
+    actions_rng = np.random.default_rng(0)
+
+    env = CubeEnv()
+    env.reset(seed=0)
+    actions = actions_rng.integers(0, N_ACTIONS, n_steps).tolist()
+    start = time.perf_counter()
+    for action in actions:
+        if env._step(action):
+            env.reset()
+    elapsed = time.perf_counter() - start
+    print(f"CubeEnv: {elapsed / n_steps * 1e6:.1f} us/step")
+
+    vec = VecCubeEnv(n_envs)
+    vec.reset(seed=0)
+    batch = actions_rng.integers(0, N_ACTIONS, n_envs)
+    n_calls = max(1, n_steps // n_envs)
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        vec.step(batch)
+    elapsed = time.perf_counter() - start
+    print(f"VecCubeEnv({n_envs}): {elapsed / (n_calls * n_envs) * 1e6:.1f} us/env-step")
+
+    sub = SubprocVecCubeEnv(n_envs)
+    try:
+        sub.reset(seed=0)
+        start = time.perf_counter()
+        for _ in range(n_calls):
+            sub.step(batch)
+        elapsed = time.perf_counter() - start
+        print(f"SubprocVecCubeEnv({n_envs}): {elapsed / (n_calls * n_envs) * 1e6:.1f} us/env-step")
+    finally:
+        sub.close()
+
+
+if __name__ == "__main__":
+    benchmark()
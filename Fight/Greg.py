@@ -7,13 +7,40 @@ import math
 import os
 import re
 
+import Achievements
+import Alloc_probe
+import Arena
+import Assets
+import Audio
+import Collision
+import Combat_log
+import Hud
+import Inputs
+import Match_records
+import Particles
+import Render_backend
+import Replay
+import Save_store
+import Scenes
+import Tile_renderer
+
 pygame.init()
 
+# all randomness in the simulation goes through this so headless runs can seed/swap it
+rng = random.Random()
+
 WIDTH = 800
 HEIGHT = 600
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 pygame.display.set_caption("Cube Combat")
 
+# set by Render_backend.install() when the fight scene is drawn through an SDL renderer
+render_backend = None
+# set by the main loop when CUBE_REPLAY_DIR is set
+recorder = None
+# set by the main loop; stamps events as they arrive so presses are timed within the frame
+input_queue = None
+
 BLUE = (0, 0, 255)
 RED = (255, 0, 0)
 BLACK = (0, 0, 0) 
@@ -95,12 +122,15 @@ def parse_cubes_file(file_content):
 
     return cubes_list
 
-SAVE_DIR = "Save_file"
+SAVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Save_file")
 CUBES_FILE_PATH = os.path.join(SAVE_DIR, "cubes.txt")
 STATS_FILE = os.path.join(SAVE_DIR, "stats.txt")
 DEBUG_FILE = os.path.join(SAVE_DIR, "debug.txt")
 ACHIEVEMENTS_FILE_PATH = os.path.join(SAVE_DIR, "achievements.txt") 
+ARENAS_FILE_PATH = os.path.join(SAVE_DIR, "arenas.txt")
+SAVE_DB_PATH = os.path.join(SAVE_DIR, "profile.db")
 is_debug_mode = False 
+autosave_stats = True # headless runs turn this off so they don't touch the saved kill counts
 
 def load_cubes_file_content(filepath):
     """Attempts to read the content of the cubes stats file."""
@@ -114,14 +144,6 @@ def load_cubes_file_content(filepath):
         print(f"Error reading cube stats file: {e}")
         return ""
 
-CUBES_FILE_CONTENT = load_cubes_file_content(CUBES_FILE_PATH)
-
-if CUBES_FILE_CONTENT:
-    all_cubes_data = parse_cubes_file(CUBES_FILE_CONTENT)
-else:
-    all_cubes_data = []
-    print("WARNING: No cube data loaded. 'Collected Cubes' scene will be empty.")
-
 all_achievements_data = []
 
 def parse_achievements_file(file_content):
@@ -188,13 +210,6 @@ def load_achievements_file_content(filepath):
         print(f"Error reading achievement file: {e}")
         return ""
 
-ACHIEVEMENTS_FILE_CONTENT = load_achievements_file_content(ACHIEVEMENTS_FILE_PATH)
-
-if ACHIEVEMENTS_FILE_CONTENT:
-    all_achievements_data = parse_achievements_file(ACHIEVEMENTS_FILE_CONTENT)
-else:
-    print("WARNING: No achievement data loaded.")
-
 blue_x = 20
 blue_y = HEIGHT // 2 - CUBE_SIZE // 2
 red_x = WIDTH - CUBE_SIZE - 20
@@ -232,13 +247,51 @@ INITIAL_BLUE_HEALTH = 100
 INITIAL_RED_HEALTH = 100
 INITIAL_RED_CUBE_MODE = "Maintain" 
 PARRY_WINDOW_DURATION_MS = 200 
+PARRY_BUFFER_MS = 100 # a parry pressed this early is held until its window opens
 
 P2_CHARGE_FLASH_CYCLES = 3 
 P2_BOUNDARY_DAMAGE = 25
 P2_BOUNDARY_STUN_MS = 3000 
+DEV_CUBE_ID = 2 # "angry sniper" in cubes.txt: the cube the AI always plays, the Dev only killer from achievement 4
+
+# every value the string states in game_state can take, in a fixed order so tools can turn them into small ints
+CHARGE_STATES = ('Idle', 'Windup', 'Charging', 'Endlag')
+AI_ATTACK_STATES = ('Idle', 'SpecialWindup')
+RED_CUBE_MODES = Combat_log.AI_MODES
+DIRECTIONS = ('right', 'left', 'up', 'down')
+# red_cube_mode groups move_ai and handle_player_movement check every frame
+STUCK_RED_CUBE_MODES = ("Parried (Stun)", "Charge (Endlag)", "Charge (Windup)", "Beam (Windup)")
+MOVING_RED_CUBE_MODES = ("Attack", "Close Gap", "Defensive Retreat", "Back Off")
 
 font = pygame.font.Font(None, 36)
 
+# the fight HUD is registered once and only recomposited when a value changes
+HUD_BAR_WIDTH = 200
+hud = Hud.Hud((WIDTH, HEIGHT), font)
+hud.add_bar('blue_bar', (WIDTH - HUD_BAR_WIDTH - 10, 10, HUD_BAR_WIDTH, 20), BLUE, max_value=100)
+hud.add_bar('red_bar', (10, 10, HUD_BAR_WIDTH, 20), RED, max_value=100)
+hud.add_label('blue_health', "P1 (Blue): {}", WHITE, (WIDTH - HUD_BAR_WIDTH - 10, 35))
+hud.add_label('red_health', "AI (Red): {}", WHITE, (10, 35))
+hud.add_label('red_kills', "Red Kills: {}", RED, (10, HEIGHT - 40))
+hud.add_label('blue_kills', "Blue Kills: {}", BLUE, (WIDTH - 150, HEIGHT - 40))
+RED_HEALTH_TEMPLATES = {'pvp': "P2 (Red): {}", 'ai': "AI (Red): {}"}
+
+# scratch Rects the fight loop updates in place instead of building new ones every frame
+target_rect = pygame.Rect(0, 0, CUBE_SIZE, CUBE_SIZE)
+cube_rect = pygame.Rect(0, 0, CUBE_SIZE, CUBE_SIZE)
+beam_rect = pygame.Rect(0, 0, 0, 0)
+beam_corners = [[0.0, 0.0] for _ in range(4)]   # the software-drawn beam quad, rewritten in place
+view_rect = pygame.Rect(0, 0, 0, 0)   # a world rect moved into screen coordinates for drawing
+blue_bar_outline_rect = pygame.Rect(WIDTH - HUD_BAR_WIDTH - 10, 10, HUD_BAR_WIDTH, 20)
+blue_bar_rect = pygame.Rect(WIDTH - HUD_BAR_WIDTH - 10, 10, HUD_BAR_WIDTH, 20)
+red_bar_outline_rect = pygame.Rect(10, 10, HUD_BAR_WIDTH, 20)
+red_bar_rect = pygame.Rect(10, 10, HUD_BAR_WIDTH, 20)
+label_texts = {}    # (template, value) -> formatted label, for the hardware HUD
+beam_surfaces = {}  # (length, width) -> unrotated beam, (length, width, angle) -> rotated beam
+MAX_CACHED_BEAMS = 8
+# the drawn beam stops at the edge of its (max(length, width) + 10)px sprite, as it always has
+AI_BEAM_DRAWN_REACH = (max(AI_BEAM_LENGTH, AI_BEAM_WIDTH) + 10) // 2
+
 initial_game_state = {
     'blue_active': INITIAL_BLUE_ACTIVE,
     'red_active': INITIAL_RED_ACTIVE,
@@ -275,6 +328,10 @@ initial_game_state = {
 
     'parry_active': False,
     'parry_timer': 0.0,
+    'parry_buffered': False,
+    'parry_buffer_until': 0.0,
+
+    'match_time': 0.0,
 }
 
 game_state = initial_game_state.copy()
@@ -282,6 +339,8 @@ game_state = initial_game_state.copy()
 current_scene = "menu" 
 selected_cube_data = None 
 selected_mode = None 
+logged_red_cube_mode = None # last red_cube_mode written to the combat log
+match_seed = None           # seed of the current round's rng, see start_match()
 
 initial_char_select_state = {
     'p1_selection_id': None,
@@ -293,7 +352,7 @@ initial_char_select_state = {
 character_select_state = initial_char_select_state.copy()
 
 def load_stats():
-    """Reads kill counts from stats.txt or initializes them."""
+    """Reads kill counts from the old stats.txt (only used to migrate into the save store)."""
     stats = {'red_kills': 0, 'blue_kills': 0}
     if os.path.exists(STATS_FILE):
         try:
@@ -314,34 +373,184 @@ def load_stats():
     return stats
 
 def save_stats(stats):
-    """Writes kill counts to stats.txt in the required format."""
-    os.makedirs(SAVE_DIR, exist_ok=True)
+    """Queues the kill counts for the save store; the write happens off the game loop."""
+    if save_store is None:
+        return
+    save_store.put(Save_store.SECTION_STATS, 'red_kills', stats['red_kills'])
+    save_store.put(Save_store.SECTION_STATS, 'blue_kills', stats['blue_kills'])
+
+def save_achievement(achievement):
+    """Persists an achievement's unlocked flag (called from the achievement saver thread)."""
+    if save_store is None:
+        return
+    save_store.put(Save_store.SECTION_ACHIEVEMENT, achievement['id'], achievement)
+
+def migrate_text_saves():
+    """One-time import of stats.txt, achievements.txt, cubes.txt and debug.txt into the save store."""
+    cubes_content = load_cubes_file_content(CUBES_FILE_PATH)
+    achievements_content = load_achievements_file_content(ACHIEVEMENTS_FILE_PATH)
+
+    debug = False
     try:
-        with open(STATS_FILE, 'w') as f:
-            f.write(f"red cube killed: {stats['red_kills']}\n")
-            f.write(f"blue cube killed: {stats['blue_kills']}\n")
+        if os.path.exists(DEBUG_FILE):
+            with open(DEBUG_FILE, 'r') as f:
+                debug = f.readline().strip().lower() == "debug = true"
     except IOError as e:
-        print(f"Error saving stats file: {e}")
+        print(f"Error reading debug file: {e}")
+
+    if save_store.migrate(
+        stats=load_stats(),
+        achievements=parse_achievements_file(achievements_content) if achievements_content else [],
+        cubes=parse_cubes_file(cubes_content) if cubes_content else [],
+        settings={'debug': debug},
+    ):
+        print("Imported old save files into the save store.")
+
+# opened by open_save_store() when the game starts, so tools that import Greg never touch profile.db
+save_store = None
+
+# images, music and sound effects by logical name, from assets/ or assets/assets.pack
+assets = Assets.AssetManager()
+
+all_achievements_data = []
+cube_stats = {'red_kills': 0, 'blue_kills': 0}
 
-cube_stats = load_stats()
+def open_save_store(path=SAVE_DB_PATH):
+    """
+    Opens the profile (importing the old text saves the first time) and loads
+    the cubes, achievements, kill counts and debug flag from it. The lists and
+    dicts are filled in place, so references taken before stay valid.
+    """
+    global save_store
+    if save_store is not None:
+        return save_store
+    save_store = Save_store.SaveStore(path)
+    if not save_store.is_migrated():
+        migrate_text_saves()
+
+    saved_profile = save_store.load_profile()
 
-def draw_text(text, font_size, color, x, y, align='center'):
-    """Draws text using a specified font size with alignment."""
-    text_font = pygame.font.Font(None, font_size)
-    text_surface = text_font.render(text, True, color)
-    text_rect = text_surface.get_rect()
+    all_cubes_data[:] = [saved_profile[Save_store.SECTION_CUBE][i] for i in sorted(saved_profile[Save_store.SECTION_CUBE])]
+    if not all_cubes_data:
+        print("WARNING: No cube data loaded. 'Collected Cubes' scene will be empty.")
 
-    if align == 'center':
-        text_rect.center = (x, y)
-    elif align == 'left':
-        text_rect.topleft = (x, y)
-    elif align == 'right':
-        text_rect.topright = (x, y)
+    all_achievements_data[:] = [saved_profile[Save_store.SECTION_ACHIEVEMENT][i] for i in sorted(saved_profile[Save_store.SECTION_ACHIEVEMENT])]
+    if not all_achievements_data:
+        print("WARNING: No achievement data loaded.")
 
-    screen.blit(text_surface, text_rect)
+    cube_stats.update(saved_profile[Save_store.SECTION_STATS])
+    load_debug_setting()
+    return save_store
+
+def load_debug_setting():
+    """
+    Reads the debug flag from the save store, at startup and whenever a fight
+    scene is entered (`python Save_store.py set debug true` changes it).
+    """
+    global is_debug_mode
+    if save_store is None:
+        return is_debug_mode
+    debug = bool(save_store.get(Save_store.SECTION_SETTING, 'debug', False))
+    if debug != is_debug_mode:
+        is_debug_mode = debug
+        print(f"Debug Mode Toggled: {is_debug_mode}")
+    return is_debug_mode
+
+all_arenas = Arena.load_arenas(ARENAS_FILE_PATH, CUBE_SIZE)
+arena = None
+# the arena's floor and walls, baked once; arenas bigger than the window scroll with the fight
+arena_view = Tile_renderer.TileRenderer((WIDTH, HEIGHT))
+particles = None    # Particles.ParticleSystem for hit effects, started with the game loop
+dirty_rects = None  # set by draw_game to the screen rects that changed; present() updates only those
+
+ARENA_TILES = ((Arena.FLOOR, 'tiles/floor', WHITE), (Arena.WALL, 'tiles/wall', DARK_GRAY))
+arena_tiles_pending = False # the arena was baked with flat colours standing in for tile images not decoded yet
+
+def arena_tile_assets():
+    """The tile images there are; the fight scene prefetches these while the player is still in the menus."""
+    return [name for _, name, _ in ARENA_TILES if assets.exists(name)]
+
+def arena_tiles(load=True):
+    """
+    Cell-sized floor and wall tiles: assets/tiles/floor and tiles/wall if
+    there are any, else flat colours. With load=False an image that isn't
+    in the asset cache yet is left for later (see arena_tiles_pending).
+    """
+    global arena_tiles_pending
+    arena_tiles_pending = False
+    tiles = {}
+    for char, name, color in ARENA_TILES:
+        tile = None
+        if assets.exists(name):
+            if load or name in assets.cache:
+                try:
+                    tile = pygame.transform.scale(assets.get(name), (CUBE_SIZE, CUBE_SIZE))
+                except (pygame.error, OSError) as e:
+                    print(f"Could not load {name}: {e}")
+            else:
+                arena_tiles_pending = True
+        if tile is None:
+            tile = pygame.Surface((CUBE_SIZE, CUBE_SIZE))
+            tile.fill(color)
+        tiles[char] = tile
+    return tiles
+
+def select_arena(key, load_tiles=True):
+    """
+    Makes the arena named or numbered `key` in arenas.txt the one fights
+    happen in. Falls back to the open arena (and returns False) if there is
+    no such arena, it is smaller than the window or a spawn point is walled.
+    """
+    global arena
+    chosen = Arena.find(all_arenas, key)
+    if chosen is None:
+        print(f"No arena {key!r} in {ARENAS_FILE_PATH}, using the open arena.")
+    elif chosen.width < WIDTH or chosen.height < HEIGHT or chosen.cell_size != CUBE_SIZE:
+        print(f"Arena {chosen.name} is {chosen.width}x{chosen.height}, smaller than {WIDTH}x{HEIGHT}; using the open arena.")
+        chosen = None
+    elif (chosen.box_blocked(blue_x, blue_y, CUBE_SIZE, CUBE_SIZE) or
+          chosen.box_blocked(red_x, red_y, CUBE_SIZE, CUBE_SIZE)):
+        print(f"Arena {chosen.name} has a wall on a spawn point; using the open arena.")
+        chosen = None
+
+    arena = chosen or Arena.find(all_arenas, Arena.DEFAULT_ARENA) or Arena.open_arena(WIDTH, HEIGHT, CUBE_SIZE)
+    arena_view.set_arena(arena, arena_tiles(load_tiles))
+    return chosen is not None
+
+# CUBE_ARENA picks the arena by name or number; the open one has no walls and plays as it always has.
+# Importing Greg decodes no images: the tiles are prefetched with the fight scene and swapped in when it starts.
+select_arena(os.environ.get("CUBE_ARENA", Arena.DEFAULT_ARENA), load_tiles=False)
+
+def get_events():
+    """This frame's events; through the input queue when the main loop runs one, so KEYDOWNs carry offset_ms."""
+    if input_queue is not None:
+        return input_queue.take()
+    return pygame.event.get()
+
+def draw_text(text, font_size, color, x, y, align='center', surface=None):
+    """Draws text using a specified font size with alignment (onto the screen unless `surface` is given)."""
+    text_surface, text_rect = Scenes.render_text(text, font_size, color, x, y, align)
+    (surface or screen).blit(text_surface, text_rect)
 
 def draw_cube(x, y, color):
-    pygame.draw.rect(screen, color, (x, y, CUBE_SIZE, CUBE_SIZE))
+    if render_backend is not None and render_backend.in_frame:
+        render_backend.draw_cube(x, y, color)
+        return
+    cube_rect.update(x, y, CUBE_SIZE, CUBE_SIZE)
+    pygame.draw.rect(screen, color, cube_rect)
+
+def present():
+    """Shows the finished frame, through the hardware renderer if one is installed."""
+    global dirty_rects
+    if render_backend is not None:
+        render_backend.present(screen)
+    elif dirty_rects is not None:
+        pygame.display.update(dirty_rects)
+    else:
+        pygame.display.flip()
+        # a menu or the game-over screen drew over everything; the next fight frame starts from the baked arena
+        arena_view.invalidate()
+    dirty_rects = None
 
 def get_red_cube_color(state):
     """
@@ -381,40 +590,44 @@ def get_blue_cube_color(state):
         return BLACK
     return BLUE
 
+def label_text(template, value):
+    """template.format(value), built once per distinct value."""
+    key = (template, value)
+    text = label_texts.get(key)
+    if text is None:
+        if len(label_texts) >= Hud.MAX_CACHED_LABELS:
+            label_texts.clear()
+        text = label_texts[key] = template.format(value)
+    return text
+
 def draw_health_bars():
     """Draws P1 and P2/AI health bars and kill counts."""
 
-    blue_health_ratio = max(0, game_state['blue_health'] / 100)
-    red_health_ratio = max(0, game_state['red_health'] / 100)
-
-    MAX_BAR_WIDTH = 200
-
-    blue_bar_width = int(MAX_BAR_WIDTH * blue_health_ratio)
-    red_bar_width = int(MAX_BAR_WIDTH * red_health_ratio)
-
-    blue_bar_rect_outline = pygame.Rect(WIDTH - MAX_BAR_WIDTH - 10, 10, MAX_BAR_WIDTH, 20)
-    blue_health_rect = pygame.Rect(WIDTH - MAX_BAR_WIDTH - 10, 10, blue_bar_width, 20)
-
-    red_bar_rect_outline = pygame.Rect(10, 10, MAX_BAR_WIDTH, 20)
-    red_health_rect = pygame.Rect(10, 10, red_bar_width, 20)
-
-    pygame.draw.rect(screen, (100, 100, 100), blue_bar_rect_outline, 1)
-    pygame.draw.rect(screen, (100, 100, 100), red_bar_rect_outline, 1)
-
-    pygame.draw.rect(screen, BLUE, blue_health_rect)
-    pygame.draw.rect(screen, RED, red_health_rect)
-
-    blue_health_text = font.render(f"P1 (Blue): {max(0, game_state['blue_health'])}", True, WHITE)
-    red_label = "P2 (Red)" if selected_mode == 'pvp' else "AI (Red)"
-    red_health_text = font.render(f"{red_label}: {max(0, game_state['red_health'])}", True, WHITE)
-
-    screen.blit(blue_health_text, (WIDTH - MAX_BAR_WIDTH - 10, 35))
-    screen.blit(red_health_text, (10, 35))
+    red_template = RED_HEALTH_TEMPLATES['pvp' if selected_mode == 'pvp' else 'ai']
+
+    if render_backend is not None and render_backend.in_frame:
+        blue_bar_rect.w = int(HUD_BAR_WIDTH * max(0, game_state['blue_health'] / 100))
+        red_bar_rect.w = int(HUD_BAR_WIDTH * max(0, game_state['red_health'] / 100))
+        render_backend.outline_rect(Hud.BAR_OUTLINE_COLOR, blue_bar_outline_rect)
+        render_backend.outline_rect(Hud.BAR_OUTLINE_COLOR, red_bar_outline_rect)
+        render_backend.fill_rect(BLUE, blue_bar_rect)
+        render_backend.fill_rect(RED, red_bar_rect)
+        render_backend.draw_label(font, label_text("P1 (Blue): {}", max(0, game_state['blue_health'])), WHITE, hud.widgets['blue_health']['pos'])
+        render_backend.draw_label(font, label_text(red_template, max(0, game_state['red_health'])), WHITE, hud.widgets['red_health']['pos'])
+        render_backend.draw_label(font, label_text("Red Kills: {}", cube_stats['red_kills']), RED, hud.widgets['red_kills']['pos'])
+        render_backend.draw_label(font, label_text("Blue Kills: {}", cube_stats['blue_kills']), BLUE, hud.widgets['blue_kills']['pos'])
+        return
 
-    red_kills_text = font.render(f"Red Kills: {cube_stats['red_kills']}", True, RED)
-    blue_kills_text = font.render(f"Blue Kills: {cube_stats['blue_kills']}", True, BLUE)
-    screen.blit(red_kills_text, (10, HEIGHT - 40))
-    screen.blit(blue_kills_text, (WIDTH - 150, HEIGHT - 40))
+    hud.update('blue_bar', game_state['blue_health'])
+    hud.update('red_bar', game_state['red_health'])
+    hud.update('blue_health', max(0, game_state['blue_health']))
+    hud.update('red_health', max(0, game_state['red_health']))
+    hud.set_template('red_health', red_template)
+    hud.update('red_kills', cube_stats['red_kills'])
+    hud.update('blue_kills', cube_stats['blue_kills'])
+    hud.draw(screen)
+    for rect in hud.rects:
+        arena_view.mark(rect)
 
 def calculate_distance(x1, y1, x2, y2):
     """Calculates the Euclidean distance between the centers of two cubes."""
@@ -427,7 +640,7 @@ def move_ai(mode, target_x, target_y, current_x, current_y, speed, red_health):
     dx, dy = 0, 0
     distance = calculate_distance(current_x, current_y, target_x, target_y)
 
-    if mode not in ["Parried (Stun)", "Charge (Endlag)", "Charge (Windup)", "Beam (Windup)"]:
+    if mode not in STUCK_RED_CUBE_MODES:
 
         if red_health <= RETREAT_HEALTH_THRESHOLD and distance > MAINTAIN_RANGE_MAX:
             mode = "Defensive Retreat"
@@ -452,6 +665,13 @@ def move_ai(mode, target_x, target_y, current_x, current_y, speed, red_health):
 
         dx, dy = 0, 0
 
+    if not arena.open and (dx != 0 or dy != 0):
+        # around the walls along the flow field every AI cube shares
+        flow = arena.steer(current_x, current_y, CUBE_SIZE, target_x, target_y,
+                           away=(mode == "Defensive Retreat" or mode == "Back Off"))
+        if flow is not None:
+            dx, dy = flow
+
     move_x, move_y = 0, 0
     if dx != 0 or dy != 0:
         angle = math.atan2(dy, dx)
@@ -463,12 +683,14 @@ def move_ai(mode, target_x, target_y, current_x, current_y, speed, red_health):
         elif abs(move_y) > 0:
             game_state['ai_last_direction'] = 'down' if move_y > 0 else 'up'
 
-    move_x += random.uniform(-1, 1) * 0.5
-    move_y += random.uniform(-1, 1) * 0.5
+    move_x += rng.uniform(-1, 1) * 0.5
+    move_y += rng.uniform(-1, 1) * 0.5
 
-    if mode in ["Attack", "Close Gap", "Defensive Retreat", "Back Off"]:
-        new_x = max(0, min(current_x + move_x, WIDTH - CUBE_SIZE))
-        new_y = max(0, min(current_y + move_y, HEIGHT - CUBE_SIZE))
+    if mode in MOVING_RED_CUBE_MODES and not arena.open:
+        new_x, new_y = arena.resolve(current_x, current_y, CUBE_SIZE, CUBE_SIZE, move_x, move_y)
+    elif mode in MOVING_RED_CUBE_MODES:
+        new_x = max(0, min(current_x + move_x, arena.width - CUBE_SIZE))
+        new_y = max(0, min(current_y + move_y, arena.height - CUBE_SIZE))
     else:
 
         new_x = current_x
@@ -480,13 +702,16 @@ def check_hitbox_collision(hitbox_rect, target_x, target_y):
     """Checks if the target cube is inside the generated hitbox."""
     if not hitbox_rect:
         return False
-    target_rect = pygame.Rect(target_x, target_y, CUBE_SIZE, CUBE_SIZE)
+    target_rect.update(target_x, target_y, CUBE_SIZE, CUBE_SIZE)
     return hitbox_rect.colliderect(target_rect)
 
-def do_special_attack_blue():
-    """Triggers the blue cube's special purple hitbox attack."""
+def do_special_attack_blue(offset_ms=0.0):
+    """
+    Triggers the blue cube's special purple hitbox attack, pressed offset_ms
+    into the frame about to be simulated.
+    """
 
-    if not is_debug_mode and game_state['special_attack_cooldown_timer'] > 0:
+    if not is_debug_mode and game_state['special_attack_cooldown_timer'] > offset_ms:
         return 
 
     blue_x, blue_y = game_state['blue_x'], game_state['blue_y']
@@ -506,42 +731,49 @@ def do_special_attack_blue():
     else: 
         return 
 
-    hitbox_rect = pygame.Rect(hitbox_x, hitbox_y, CUBE_SIZE, CUBE_SIZE)
+    # each game state owns its hitbox rect (Cube_env swaps whole states), so later slashes reuse it
+    hitbox_rect = game_state['purple_hitbox_rect']
+    if hitbox_rect is None:
+        hitbox_rect = pygame.Rect(hitbox_x, hitbox_y, CUBE_SIZE, CUBE_SIZE)
+    else:
+        hitbox_rect.update(hitbox_x, hitbox_y, CUBE_SIZE, CUBE_SIZE)
 
     if game_state['red_active'] and check_hitbox_collision(hitbox_rect, game_state['red_x'], game_state['red_y']):
         game_state['red_health'] -= SPECIAL_ATTACK_DAMAGE
-        print(f"Blue Cube Slash hit! Damage: {SPECIAL_ATTACK_DAMAGE}. Red Health: {max(0, game_state['red_health'])}")
+        Combat_log.emit(Combat_log.EVENT_SLASH, Combat_log.ACTOR_BLUE, True, SPECIAL_ATTACK_DAMAGE, game_state['red_health'])
+    else:
+        Combat_log.emit(Combat_log.EVENT_SLASH, Combat_log.ACTOR_BLUE, False, 0, game_state['red_health'])
 
     game_state['purple_hitbox_active'] = True
     game_state['purple_hitbox_rect'] = hitbox_rect
-    game_state['hitbox_timer'] = HITBOX_DURATION_MS
+    game_state['hitbox_timer'] = HITBOX_DURATION_MS + offset_ms
 
     if not is_debug_mode:
-        game_state['special_attack_cooldown_timer'] = SPECIAL_ATTACK_COOLDOWN_MS
+        game_state['special_attack_cooldown_timer'] = SPECIAL_ATTACK_COOLDOWN_MS + offset_ms
     else:
         game_state['special_attack_cooldown_timer'] = 1 
 
-def do_special_attack_red():
-    """Triggers the red cube's special cyan beam attack (P2)."""
+def do_special_attack_red(offset_ms=0.0):
+    """Triggers the red cube's special cyan beam attack (P2), pressed offset_ms into the frame."""
 
     if not game_state['blue_active']:
         return
     if not game_state['red_active']:
         return
 
-    if not is_debug_mode and game_state['ai_special_attack_cooldown_timer'] > 0:
+    if not is_debug_mode and game_state['ai_special_attack_cooldown_timer'] > offset_ms:
         return 
 
     if game_state['ai_attack_state'] == 'Idle' and game_state['charge_state'] == 'Idle':
-        initiate_ai_special_attack_windup_red()
+        initiate_ai_special_attack_windup_red(offset_ms)
 
-def initiate_ai_special_attack_windup_red():
+def initiate_ai_special_attack_windup_red(offset_ms=0.0):
     """Transitions the Red Cube into the Special Windup state (always leads to Beam)."""
 
     game_state['ai_attack_state'] = 'SpecialWindup' 
     game_state['flash_count'] = 0
 
-    game_state['flash_timer'] = AI_FLASH_DURATION_MS 
+    game_state['flash_timer'] = AI_FLASH_DURATION_MS + offset_ms
     game_state['red_cube_mode'] = "Beam (Windup)" 
 
     if selected_mode == 'pvp':
@@ -575,61 +807,91 @@ def execute_ai_special_attack_red():
     game_state['ai_hitbox_timer'] = AI_SPECIAL_HITBOX_DURATION_MS
 
     beam_surface, beam_rect = get_ai_beam_rect()
-    blue_cube_rect = pygame.Rect(game_state['blue_x'], game_state['blue_y'], CUBE_SIZE, CUBE_SIZE)
+    blue_cube_rect = target_rect
+    blue_cube_rect.update(game_state['blue_x'], game_state['blue_y'], CUBE_SIZE, CUBE_SIZE)
 
     if game_state['blue_active'] and beam_rect.colliderect(blue_cube_rect):
         if not is_debug_mode:
             game_state['blue_health'] -= AI_SPECIAL_ATTACK_DAMAGE
-            print(f"Red Cube Beam hit! Damage: {AI_SPECIAL_ATTACK_DAMAGE}. Blue Health: {max(0, game_state['blue_health'])}")
+            Combat_log.emit(Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED, True, AI_SPECIAL_ATTACK_DAMAGE, game_state['blue_health'])
         else:
-            print("Red Cube Beam hit! (Debug Invincible)")
+            Combat_log.emit(Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED, True, 0, game_state['blue_health'])
+    else:
+        Combat_log.emit(Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED, False, 0, game_state['blue_health'])
 
     game_state['ai_special_attack_cooldown_timer'] = AI_SPECIAL_ATTACK_COOLDOWN_MS
 
     game_state['ai_attack_state'] = 'Idle'
     game_state['red_cube_mode'] = "Maintain" 
 
-def initiate_parry():
+def parry_window():
+    """
+    The match time (start, end) of the flash a parry has to land in to stop
+    the red cube's current windup, or None if there is no windup or that
+    flash has already gone by.
+    """
+    if game_state['charge_state'] == 'Windup':
+        success_count = (P2_CHARGE_FLASH_CYCLES * 2) + 1 if selected_mode == 'pvp' else (CHARGE_FLASH_CYCLES * 2)
+        duration = FLASH_DURATION_MS
+    elif game_state['ai_attack_state'] == 'SpecialWindup':
+        success_count = AI_SLASH_FLASH_CYCLES * 2
+        duration = AI_FLASH_DURATION_MS
+    else:
+        return None
+
+    flash_count = game_state['flash_count']
+    if flash_count > success_count or game_state['flash_timer'] <= 0:
+        return None
+
+    # the current flash ends flash_timer from now and every later one lasts `duration`
+    end = game_state['match_time'] + game_state['flash_timer'] + (success_count - flash_count) * duration
+    return end - duration, end
+
+def initiate_parry(offset_ms=0.0):
     """
-    Initiates the Blue Cube's parry.
-    Checks if it successfully parried an attack windup.
+    Initiates the Blue Cube's parry, pressed offset_ms into the frame.
+    The press is judged at its own match time against parry_window(), so
+    the window is the same length at any frame rate. A press up to
+    PARRY_BUFFER_MS early is held and lands when the window opens.
     """
     if not game_state['blue_active'] or game_state['game_over']:
         return
+    if game_state['parry_buffered']:
+        return
 
-    charge_windup_success_count = (P2_CHARGE_FLASH_CYCLES * 2) + 1 if selected_mode == 'pvp' else (CHARGE_FLASH_CYCLES * 2)
+    pressed_at = game_state['match_time'] + offset_ms
+    window = parry_window()
 
-    charge_windup_success = (
-        game_state['charge_state'] == 'Windup' and 
-        game_state['flash_count'] == charge_windup_success_count and 
-        game_state['flash_timer'] > 0 
-    )
+    if window is not None and window[0] <= pressed_at < window[1]:
+        land_parry(offset_ms)
+    elif window is not None and pressed_at < window[0] <= pressed_at + PARRY_BUFFER_MS:
+        game_state['parry_buffered'] = True
+        game_state['parry_buffer_until'] = pressed_at + PARRY_BUFFER_MS
+    else:
+        miss_parry(offset_ms)
 
-    special_windup_success = (
-        game_state['ai_attack_state'] == 'SpecialWindup' and
-        game_state['flash_count'] == (AI_SLASH_FLASH_CYCLES * 2) and 
-        game_state['flash_timer'] > 0
-    )
+def land_parry(offset_ms=0.0):
+    """A successful parry: stuns the red cube and cancels its windup."""
+    Combat_log.emit(Combat_log.EVENT_PARRY, Combat_log.ACTOR_BLUE, True)
 
-    if charge_windup_success or special_windup_success:
-        print("Successful Parry! Red Cube stunned.")
+    game_state['charge_state'] = 'Endlag' 
+    game_state['endlag_timer'] = ENDLAG_DURATION_MS * 2 
+    game_state['red_cube_mode'] = "Parried (Stun)"
 
-        game_state['charge_state'] = 'Endlag' 
-        game_state['endlag_timer'] = ENDLAG_DURATION_MS * 2 
-        game_state['red_cube_mode'] = "Parried (Stun)"
+    game_state['ai_attack_state'] = 'Idle'
+    game_state['flash_count'] = 0
+    game_state['flash_timer'] = 0
 
-        game_state['ai_attack_state'] = 'Idle'
-        game_state['flash_count'] = 0
-        game_state['flash_timer'] = 0
+    game_state['parry_active'] = True
+    game_state['parry_timer'] = PARRY_WINDOW_DURATION_MS + offset_ms
+    game_state['parry_buffered'] = False
 
-        game_state['parry_active'] = True
-        game_state['parry_timer'] = PARRY_WINDOW_DURATION_MS 
+def miss_parry(offset_ms=0.0):
+    Combat_log.emit(Combat_log.EVENT_PARRY, Combat_log.ACTOR_BLUE, False)
 
-    else:
-        print("Parry Attempt: Missed timing or no active windup.")
-
-        game_state['parry_active'] = True
-        game_state['parry_timer'] = PARRY_WINDOW_DURATION_MS // 2 
+    game_state['parry_active'] = True
+    game_state['parry_timer'] = PARRY_WINDOW_DURATION_MS // 2 + offset_ms
+    game_state['parry_buffered'] = False
 
 def check_ai_special_attack_trigger(distance_to_player):
     """Determines if the AI should try to use its special attack (Beam)."""
@@ -639,7 +901,7 @@ def check_ai_special_attack_trigger(distance_to_player):
         game_state['ai_attack_state'] == 'Idle' and 
         distance_to_player < AI_SPECIAL_ATTACK_RANGE):
 
-        if random.random() < 0.05:
+        if rng.random() < 0.05:
             return True
     return False
 
@@ -665,24 +927,57 @@ def get_ai_beam_rect():
     """
     Calculates the beam rectangle centered on the Red Cube and rotated towards the angle.
     Returns: A tuple (surface, rect) suitable for screen.blit()
+    A beam keeps its angle while it lasts (and P2 only fires along four), so
+    rotated beams are cached by angle. The returned rect is shared and updated in place.
     """
     red_center_x = game_state['red_x'] + CUBE_SIZE / 2
     red_center_y = game_state['red_y'] + CUBE_SIZE / 2
 
-    angle_deg = math.degrees(game_state['ai_beam_angle'])
+    size_key = (AI_BEAM_LENGTH, AI_BEAM_WIDTH)
+    key = size_key + (game_state['ai_beam_angle'],)
+    rotated_surface = beam_surfaces.get(key)
+    if rotated_surface is None:
+        beam_surface = beam_surfaces.get(size_key)
+        if beam_surface is None:
+            surface_size = max(AI_BEAM_LENGTH, AI_BEAM_WIDTH) + 10 
+            beam_surface = pygame.Surface((surface_size, surface_size), pygame.SRCALPHA)
 
-    surface_size = max(AI_BEAM_LENGTH, AI_BEAM_WIDTH) + 10 
-    beam_surface = pygame.Surface((surface_size, surface_size), pygame.SRCALPHA)
+            origin_offset = CUBE_SIZE / 2 
+            unrotated_beam_rect = pygame.Rect(surface_size // 2 + origin_offset, surface_size // 2 - AI_BEAM_WIDTH // 2, AI_BEAM_LENGTH - origin_offset, AI_BEAM_WIDTH)
+            pygame.draw.rect(beam_surface, CYAN, unrotated_beam_rect)
 
-    origin_offset = CUBE_SIZE / 2 
-    unrotated_beam_rect = pygame.Rect(surface_size // 2 + origin_offset, surface_size // 2 - AI_BEAM_WIDTH // 2, AI_BEAM_LENGTH - origin_offset, AI_BEAM_WIDTH)
-    pygame.draw.rect(beam_surface, CYAN, unrotated_beam_rect)
+        if len(beam_surfaces) >= MAX_CACHED_BEAMS:
+            beam_surfaces.clear()
+        beam_surfaces[size_key] = beam_surface
 
-    rotated_surface = pygame.transform.rotate(beam_surface, -angle_deg)
+        angle_deg = math.degrees(game_state['ai_beam_angle'])
+        rotated_surface = beam_surfaces[key] = pygame.transform.rotate(beam_surface, -angle_deg)
 
-    rotated_rect = rotated_surface.get_rect(center=(red_center_x, red_center_y))
+    beam_rect.size = rotated_surface.get_size()
+    beam_rect.center = (red_center_x, red_center_y)
 
-    return rotated_surface, rotated_rect
+    return rotated_surface, beam_rect
+
+def draw_ai_beam(view_x=0, view_y=0):
+    if render_backend is not None and render_backend.in_frame:
+        render_backend.draw_beam(game_state['red_x'] + CUBE_SIZE / 2 - view_x, game_state['red_y'] + CUBE_SIZE / 2 - view_y,
+                                 game_state['ai_beam_angle'])
+        return
+    # a filled quad rather than the rotated sprite: the AI aims anywhere, and a
+    # sprite per angle meant rotating a fresh 710px Surface for every beam
+    angle = game_state['ai_beam_angle']
+    along_x, along_y = math.cos(angle), math.sin(angle)
+    across_x, across_y = -along_y * AI_BEAM_WIDTH / 2, along_x * AI_BEAM_WIDTH / 2
+    center_x = game_state['red_x'] + CUBE_SIZE / 2 - view_x
+    center_y = game_state['red_y'] + CUBE_SIZE / 2 - view_y
+    near_x, near_y = center_x + along_x * CUBE_SIZE / 2, center_y + along_y * CUBE_SIZE / 2
+    far_x, far_y = center_x + along_x * AI_BEAM_DRAWN_REACH, center_y + along_y * AI_BEAM_DRAWN_REACH
+    corners = beam_corners
+    corners[0][0], corners[0][1] = near_x - across_x, near_y - across_y
+    corners[1][0], corners[1][1] = far_x - across_x, far_y - across_y
+    corners[2][0], corners[2][1] = far_x + across_x, far_y + across_y
+    corners[3][0], corners[3][1] = near_x + across_x, near_y + across_y
+    arena_view.mark(pygame.draw.polygon(screen, CYAN, corners))
 
 def execute_ai_special_attack():
     """
@@ -703,62 +998,77 @@ def execute_ai_special_attack():
     beam_end_x = red_center_x + AI_BEAM_LENGTH * math.cos(angle)
     beam_end_y = red_center_y + AI_BEAM_LENGTH * math.sin(angle)
 
-    blue_cube_rect = pygame.Rect(game_state['blue_x'], game_state['blue_y'], CUBE_SIZE, CUBE_SIZE)
+    blue_cube_rect = target_rect
+    blue_cube_rect.update(game_state['blue_x'], game_state['blue_y'], CUBE_SIZE, CUBE_SIZE)
 
     if game_state['blue_active'] and blue_cube_rect.clipline(beam_start_x, beam_start_y, beam_end_x, beam_end_y):
         if not is_debug_mode:
             game_state['blue_health'] -= AI_SPECIAL_ATTACK_DAMAGE
-            print(f"Red Cube Beam hit! Damage: {AI_SPECIAL_ATTACK_DAMAGE}. Blue Health: {max(0, game_state['blue_health'])}")
+            Combat_log.emit(Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED, True, AI_SPECIAL_ATTACK_DAMAGE, game_state['blue_health'])
         else:
-            print("Red Cube Beam hit! (Debug Invincible)")
+            Combat_log.emit(Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED, True, 0, game_state['blue_health'])
+    else:
+        Combat_log.emit(Combat_log.EVENT_BEAM, Combat_log.ACTOR_RED, False, 0, game_state['blue_health'])
 
     game_state['ai_special_attack_cooldown_timer'] = AI_SPECIAL_ATTACK_COOLDOWN_MS
 
     game_state['ai_attack_state'] = 'Idle'
     game_state['red_cube_mode'] = "Maintain" 
 
-def draw_cube_preview(x, y, color_name, size=30):
+def draw_cube_preview(x, y, color_name, size=30, surface=None):
     """Draws a cube preview with an optional outline."""
 
-    color = CUBE_COLOR_MAP.get(color_name.lower(), GRAY) 
+    surface = surface or screen
+    color = CUBE_COLOR_MAP.get(color_name.lower(), GRAY)
 
     rect = pygame.Rect(x, y, size, size)
-    pygame.draw.rect(screen, color, rect)
+    pygame.draw.rect(surface, color, rect)
 
-    pygame.draw.rect(screen, WHITE, rect, 2) 
+    pygame.draw.rect(surface, WHITE, rect, 2)
 
     return rect
 
-def draw_cube_detail_panel(cube_data):
+def draw_cube_detail_panel(cube_data, surface=None):
     """Draws the detailed stats panel for the selected cube."""
 
+    surface = surface or screen
+
     PANEL_WIDTH = 300
-    PANEL_HEIGHT = HEIGHT - 120 
+    PANEL_HEIGHT = HEIGHT - 120
     PANEL_X = WIDTH - PANEL_WIDTH - 20
     PANEL_Y = 80
 
-    pygame.draw.rect(screen, DARK_GRAY, (PANEL_X, PANEL_Y, PANEL_WIDTH, PANEL_HEIGHT), border_radius=10)
-    pygame.draw.rect(screen, WHITE, (PANEL_X, PANEL_Y, PANEL_WIDTH, PANEL_HEIGHT), 3, border_radius=10)
+    pygame.draw.rect(surface, DARK_GRAY, (PANEL_X, PANEL_Y, PANEL_WIDTH, PANEL_HEIGHT), border_radius=10)
+    pygame.draw.rect(surface, WHITE, (PANEL_X, PANEL_Y, PANEL_WIDTH, PANEL_HEIGHT), 3, border_radius=10)
 
     start_x = PANEL_X + 20
     current_y = PANEL_Y + 20
 
     panel_title = cube_data.get('name', f"Cube {cube_data['id']}").title()
-    draw_text(f"{panel_title} - Details", 36, WHITE, PANEL_X + PANEL_WIDTH // 2, current_y)
+    draw_text(f"{panel_title} - Details", 36, WHITE, PANEL_X + PANEL_WIDTH // 2, current_y, surface=surface)
     current_y += 50
 
     preview_size = 80
     preview_x = PANEL_X + PANEL_WIDTH // 2 - preview_size // 2
-    draw_cube_preview(preview_x, current_y, cube_data['color'], size=preview_size)
+    draw_cube_preview(preview_x, current_y, cube_data['color'], size=preview_size, surface=surface)
     current_y += preview_size + 20
 
-    draw_text(f"Color: {cube_data['color'].capitalize()}", 28, WHITE, start_x, current_y, align='left')
+    draw_text(f"Color: {cube_data['color'].capitalize()}", 28, WHITE, start_x, current_y, align='left', surface=surface)
     current_y += 30
 
-    draw_text(f"Max HP: {cube_data.get('max hp', 'N/A')}", 28, WHITE, start_x, current_y, align='left')
-    current_y += 40
+    draw_text(f"Max HP: {cube_data.get('max hp', 'N/A')}", 28, WHITE, start_x, current_y, align='left', surface=surface)
+    current_y += 30
 
-    draw_text("Attacks:", 30, CYAN, start_x, current_y, align='left')
+    record = Match_records.cube_record(cube_data['id'])
+    draw_text(f"Record: {record['wins']}W - {record['losses']}L", 28, WHITE, start_x, current_y, align='left', surface=surface)
+    current_y += 30
+    if record['matches']:
+        draw_text(f"Avg match: {record['avg_match_ms'] / 1000:.1f}s  Dealt: {record['damage_dealt']}",
+                  24, GRAY, start_x, current_y, align='left', surface=surface)
+        current_y += 25
+    current_y += 10
+
+    draw_text("Attacks:", 30, CYAN, start_x, current_y, align='left', surface=surface)
     current_y += 30
 
     attacks_text = cube_data.get('attacks', 'None')
@@ -769,53 +1079,105 @@ def draw_cube_detail_panel(cube_data):
         attacks_list = [attacks_text.strip()]
 
     for attack in attacks_list:
-        if current_y < PANEL_Y + PANEL_HEIGHT - 30: 
-            draw_text(f"- {attack}", 24, GRAY, start_x + 10, current_y, align='left')
+        if current_y < PANEL_Y + PANEL_HEIGHT - 30:
+            draw_text(f"- {attack}", 24, GRAY, start_x + 10, current_y, align='left', surface=surface)
             current_y += 25
 
-def achievements_scene():
-    """Renders the list of achievements and their status."""
+# --- scene layouts ---
+# Each build_* function fills a scene's cache (see Scenes.py) with its button
+# Rects and pre-rendered static layers. They may run on the preload thread, so
+# they only draw onto their own Surfaces.
+
+def new_layer():
+    """A full-screen opaque layer; the scene manager convert()s it on the main thread."""
+    return pygame.Surface((WIDTH, HEIGHT))
+
+def menu_button(action, rect, color, hover_color, label, font_size, radius, label_center=None):
+    """Layout of one clickable button: its Rect, colours and pre-rendered label."""
+    rect = pygame.Rect(rect)
+    center_x, center_y = label_center or rect.center
+    label_surface, label_rect = Scenes.render_text(label, font_size, BLACK, center_x, center_y)
+    return {'action': action, 'rect': rect, 'color': color, 'hover_color': hover_color,
+            'label': label_surface, 'label_rect': label_rect, 'radius': radius}
+
+def draw_menu_buttons(buttons, mouse_pos, click):
+    """Draws cached buttons in order. Returns the action of the button clicked this frame, if any."""
+    for button in buttons:
+        button_color = button['color']
+        if button['rect'].collidepoint(mouse_pos):
+            button_color = button['hover_color']
+            if click:
+                return button['action']
+
+        pygame.draw.rect(screen, button_color, button['rect'], border_radius=button['radius'])
+        screen.blit(button['label'], button['label_rect'])
+    return None
+
+def back_button(back_x, back_y):
+    """The small "Back (ESC)" button the list scenes share."""
+    button_width, button_height = 150, 40
+    return menu_button('back', (back_x - button_width // 2, back_y - button_height // 2, button_width, button_height),
+                       DARK_GRAY, GRAY, "Back (ESC)", 28, 5, (back_x, back_y))
 
-    global current_scene, running
+def build_main_menu(cache):
+    layer = cache['layers']['background'] = new_layer()
+    layer.fill(BLACK)
+    draw_text("CUBE COMBAT", 72, RED, WIDTH // 2, HEIGHT // 5, surface=layer)
 
-    mouse_x, mouse_y = pygame.mouse.get_pos()
-    click = False
+    button_width, button_height = 250, 60
+    center_x = WIDTH // 2
 
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-            return
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 1: 
-                click = True
-        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-            current_scene = "menu"
-            return
+    start_y = HEIGHT // 2 - 50
+    collected_y = start_y + button_height + 30
+    achievements_y = collected_y + button_height + 30
+    quit_y = achievements_y + button_height + 30
+
+    def button(action, y, color, hover_color, label):
+        return menu_button(action, (center_x - button_width // 2, y - button_height // 2, button_width, button_height),
+                           color, hover_color, label, 36, 10, (center_x, y))
+
+    cache['buttons'] = [
+        button('mode_select', start_y, GREEN, BRIGHT_GREEN, "START GAME"),
+        button('collected_cubes', collected_y, BLUE, CYAN, "COLLECTED CUBES"),
+        button('achievements', achievements_y, PINK, (255, 100, 150), "ACHIEVEMENTS"),
+        button('quit', quit_y, DARK_GRAY, GRAY, "QUIT"),
+    ]
 
-    screen.fill(BLACK) 
+def build_mode_select(cache):
+    layer = cache['layers']['background'] = new_layer()
+    layer.fill(BLACK)
+    draw_text("SELECT GAME MODE", 72, WHITE, WIDTH // 2, HEIGHT // 4, surface=layer)
 
+    button_width, button_height = 350, 60
+    center_x = WIDTH // 2
+
+    ai_y = HEIGHT // 2
+    player_y = ai_y + button_height + 30
+    back_y = player_y + button_height + 30
+
+    def button(action, y, color, hover_color, label):
+        return menu_button(action, (center_x - button_width // 2, y - button_height // 2, button_width, button_height),
+                           color, hover_color, label, 36, 10, (center_x, y))
+
+    cache['buttons'] = [
+        button('ai', ai_y, RED, (255, 100, 100), "PLAYER vs. AI"),
+        button('pvp', player_y, BLUE, CYAN, "PLAYER vs. PLAYER"),
+        button('back', back_y, DARK_GRAY, GRAY, "BACK"),
+    ]
+
+def build_achievements(cache):
     WARNING_Y = 20
-    SECTION_TITLE_Y = 80 
-    LIST_START_Y = 140 
+    SECTION_TITLE_Y = 80
+    LIST_START_Y = 140
 
-    draw_text("DEMO FEATURE: WIP", 30, RED, WIDTH // 2, WARNING_Y)
+    layer = cache['layers']['background'] = new_layer()
+    layer.fill(BLACK)
 
-    draw_text("--- ACHIEVEMENTS ---", 36, WHITE, WIDTH // 2, SECTION_TITLE_Y)
+    draw_text("DEMO FEATURE: WIP", 30, RED, WIDTH // 2, WARNING_Y, surface=layer)
 
-    button_width, button_height = 150, 40
-    back_x = 70
-    back_y = SECTION_TITLE_Y 
-    back_rect = pygame.Rect(back_x - button_width // 2, back_y - button_height // 2, button_width, button_height)
-
-    button_color = DARK_GRAY
-    if back_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = GRAY
-        if click: 
-            current_scene = "menu"
-            return 
+    draw_text("--- ACHIEVEMENTS ---", 36, WHITE, WIDTH // 2, SECTION_TITLE_Y, surface=layer)
 
-    pygame.draw.rect(screen, button_color, back_rect, border_radius=5)
-    draw_text("Back (ESC)", 28, BLACK, back_x, back_y)
+    cache['buttons'] = [back_button(70, SECTION_TITLE_Y)]
 
     current_y = LIST_START_Y
     start_x = 50
@@ -826,29 +1188,146 @@ def achievements_scene():
         box_rect = pygame.Rect(start_x, current_y, WIDTH - 100, item_height)
 
         box_color = GREEN if achievement['unlocked'] else DARK_GRAY
-        pygame.draw.rect(screen, box_color, box_rect, border_radius=5)
+        pygame.draw.rect(layer, box_color, box_rect, border_radius=5)
 
         text_color = BLACK if achievement['unlocked'] else WHITE
 
-        draw_text(f"#{achievement['id']} - {achievement['name']}", 30, text_color, start_x + 10, current_y + 10, align='left')
-        draw_text(f"Des: {achievement['description']}", 24, text_color, start_x + 10, current_y + 35, align='left')
-        draw_text(f"Unlocks: {achievement['unlocks']}", 24, text_color, start_x + 10, current_y + 55, align='left')
+        draw_text(f"#{achievement['id']} - {achievement['name']}", 30, text_color, start_x + 10, current_y + 10, align='left', surface=layer)
+        draw_text(f"Des: {achievement['description']}", 24, text_color, start_x + 10, current_y + 35, align='left', surface=layer)
+        draw_text(f"Unlocks: {achievement['unlocks']}", 24, text_color, start_x + 10, current_y + 55, align='left', surface=layer)
 
         status_text = "UNLOCKED" if achievement['unlocked'] else "LOCKED"
         status_color = BLACK if achievement['unlocked'] else RED
-        draw_text(status_text, 30, status_color, WIDTH - 60, current_y + item_height // 2, align='right')
+        draw_text(status_text, 30, status_color, WIDTH - 60, current_y + item_height // 2, align='right', surface=layer)
 
         current_y += item_height + 10
 
-    pygame.display.flip()
+# the right-hand area of the collected cubes scene that shows either the hint or a cube's panel
+COLLECTED_DETAIL_AREA = (300, 80, WIDTH - 300, HEIGHT - 80)
 
-def mode_select_menu():
-    global current_scene, running, selected_mode, character_select_state
+def build_collected_cubes(cache):
+    GRID_START_X = 50
+    GRID_START_Y = 100
+    CUBE_DISPLAY_SIZE = 60
+    PADDING = 20
+    COLUMNS = 3
+
+    layers = cache['layers']
+    layer = layers['background'] = new_layer()
+    layer.fill(BLACK)
+    draw_text("COLLECTED CUBES", 50, WHITE, WIDTH // 2, 40, surface=layer)
+
+    cache['buttons'] = [back_button(70, 40)]
+
+    cache['cube_rects'] = []
+    for i, cube in enumerate(all_cubes_data):
+        col = i % COLUMNS
+        row = i // COLUMNS
+
+        x_pos = GRID_START_X + col * (CUBE_DISPLAY_SIZE + PADDING)
+        y_pos = GRID_START_Y + row * (CUBE_DISPLAY_SIZE + PADDING)
+
+        cache['cube_rects'].append(draw_cube_preview(x_pos, y_pos, cube['color'], size=CUBE_DISPLAY_SIZE, surface=layer))
+
+    # one detail area per cube (and one for the hint), cut from a scratch copy of the background
+    area = pygame.Rect(COLLECTED_DETAIL_AREA)
+    scratch = new_layer()
+    scratch.fill(BLACK)
+    draw_text("Click a Cube to View Details", 36, DARK_GRAY, WIDTH * 0.7, HEIGHT // 2, surface=scratch)
+    layers['detail', None] = scratch.subsurface(area).copy()
+    for cube in all_cubes_data:
+        scratch.fill(BLACK)
+        draw_cube_detail_panel(cube, surface=scratch)
+        layers['detail', cube['id']] = scratch.subsurface(area).copy()
+    cache['detail_pos'] = area.topleft
+
+def build_character_select(cache):
+    GRID_START_X = 50
+    GRID_START_Y = 150
+    CUBE_DISPLAY_SIZE = 80
+    PADDING = 25
+    COLUMNS = 4
+
+    layer = cache['layers']['background'] = new_layer()
+    layer.fill(BLACK)
+    draw_text("CHARACTER SELECT", 60, WHITE, WIDTH // 2, 40, surface=layer)
 
-    mouse_x, mouse_y = pygame.mouse.get_pos() 
+    cache['instructions'] = {
+        'P1': Scenes.render_text("PLAYER 1: CHOOSE YOUR CUBE", 40, BLUE, WIDTH // 2, 90),
+        'P2': Scenes.render_text("PLAYER 2: CHOOSE YOUR CUBE", 40, RED, WIDTH // 2, 90),
+        'START': Scenes.render_text("BOTH PLAYERS SELECTED", 40, GREEN, WIDTH // 2, 90),
+    }
+    cache['messages'] = {}
+
+    cache['cube_rects'] = []
+    for i, cube in enumerate(all_cubes_data):
+        col = i % COLUMNS
+        row = i // COLUMNS
+
+        x_pos = GRID_START_X + col * (CUBE_DISPLAY_SIZE + PADDING)
+        y_pos = GRID_START_Y + row * (CUBE_DISPLAY_SIZE + PADDING)
+
+        cache['cube_rects'].append(draw_cube_preview(x_pos, y_pos, cube['color'], size=CUBE_DISPLAY_SIZE, surface=layer))
+
+    button_width, button_height = 250, 60
+    start_game_rect = (WIDTH // 2 - button_width // 2, HEIGHT - 80, button_width, button_height)
+    cache['buttons'] = [menu_button('start', start_game_rect, DARK_GRAY, GRAY, "START GAME", 36, 10)]
+
+def build_arena(cache):
+    """Warms what the first fight frames would otherwise render: the HUD's opening labels and the beam."""
+    font_size = 36 # Greg's `font`
+    labels = cache['hud_labels'] = {}
+    for key, widget in hud.widgets.items():
+        if widget['kind'] != 'label':
+            continue
+        if key == 'red_health':
+            templates = RED_HEALTH_TEMPLATES.values()
+            values = (INITIAL_RED_HEALTH,)
+        elif key == 'blue_health':
+            templates = (hud.templates[key],)
+            values = (INITIAL_BLUE_HEALTH,)
+        else:
+            templates = (hud.templates[key],)
+            values = (cube_stats[key],)
+        for template in templates:
+            for value in values:
+                text = template.format(value)
+                labels[text, widget['color']] = Scenes.font(font_size).render(text, True, widget['color'])
+
+    surface_size = max(AI_BEAM_LENGTH, AI_BEAM_WIDTH) + 10
+    beam_surface = pygame.Surface((surface_size, surface_size), pygame.SRCALPHA)
+    origin_offset = CUBE_SIZE / 2
+    unrotated_beam_rect = pygame.Rect(surface_size // 2 + origin_offset, surface_size // 2 - AI_BEAM_WIDTH // 2, AI_BEAM_LENGTH - origin_offset, AI_BEAM_WIDTH)
+    pygame.draw.rect(beam_surface, CYAN, unrotated_beam_rect)
+    cache['beam'] = ((AI_BEAM_LENGTH, AI_BEAM_WIDTH), beam_surface)
+
+def arena_ready(cache):
+    for key, label in cache['hud_labels'].items():
+        hud.label_cache.setdefault(key, label)
+    size_key, beam_surface = cache['beam']
+    beam_surfaces.setdefault(size_key, beam_surface)
+    hud.prepare()
+
+def enter_arena(cache):
+    load_debug_setting()
+    if arena_tiles_pending:
+        # prefetched with this scene's preload, so normally already decoded
+        arena_view.set_arena(arena, arena_tiles())
+
+def exit_arena(cache):
+    # a round can unlock achievements and changes the cube records; rebuild those scenes in the background
+    scenes.invalidate('achievements')
+    scenes.invalidate('collected_cubes')
+
+def achievements_scene():
+    """Renders the list of achievements and their status."""
+
+    global current_scene, running
+
+    mouse_pos = pygame.mouse.get_pos()
     click = False
 
-    for event in pygame.event.get():
+    for event in get_events():
         if event.type == pygame.QUIT:
             running = False
             return
@@ -859,58 +1338,51 @@ def mode_select_menu():
             current_scene = "menu"
             return
 
-    screen.fill(BLACK) 
-
-    draw_text("SELECT GAME MODE", 72, WHITE, WIDTH // 2, HEIGHT // 4)
+    cache = scenes.cache('achievements')
+    screen.blit(cache['layers']['background'], (0, 0))
 
-    button_width, button_height = 350, 60
-    center_x = WIDTH // 2
-
-    ai_y = HEIGHT // 2
-    player_y = ai_y + button_height + 30 
-    back_y = player_y + button_height + 30
-
-    ai_rect = pygame.Rect(center_x - button_width // 2, ai_y - button_height // 2, button_width, button_height)
-
-    button_color = RED 
-    if ai_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = (255, 100, 100) 
-        if click:
-            selected_mode = 'ai'
-            current_scene = "game"
-            reset_game_state(keep_stats=True) 
-            return 
-
-    pygame.draw.rect(screen, button_color, ai_rect, border_radius=10)
-    draw_text("PLAYER vs. AI", 36, BLACK, center_x, ai_y) 
-
-    player_rect = pygame.Rect(center_x - button_width // 2, player_y - button_height // 2, button_width, button_height)
+    if draw_menu_buttons(cache['buttons'], mouse_pos, click) == 'back':
+        current_scene = "menu"
+        return
 
-    button_color = BLUE
-    if player_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = CYAN
-        if click:
-            selected_mode = 'pvp' 
-            current_scene = "character_select" 
-            character_select_state = initial_char_select_state.copy() 
-            return 
+    present()
 
-    pygame.draw.rect(screen, button_color, player_rect, border_radius=10)
-    draw_text("PLAYER vs. PLAYER", 36, BLACK, center_x, player_y)
+def mode_select_menu():
+    global current_scene, running, selected_mode, character_select_state
 
-    back_rect = pygame.Rect(center_x - button_width // 2, back_y - button_height // 2, button_width, button_height)
+    mouse_pos = pygame.mouse.get_pos()
+    click = False
 
-    button_color = DARK_GRAY
-    if back_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = GRAY
-        if click:
+    for event in get_events():
+        if event.type == pygame.QUIT:
+            running = False
+            return
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 1:
+                click = True
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
             current_scene = "menu"
-            return 
+            return
 
-    pygame.draw.rect(screen, button_color, back_rect, border_radius=10)
-    draw_text("BACK", 36, BLACK, center_x, back_y)
+    cache = scenes.cache('mode_select')
+    screen.blit(cache['layers']['background'], (0, 0))
 
-    pygame.display.flip()
+    action = draw_menu_buttons(cache['buttons'], mouse_pos, click)
+    if action == 'ai':
+        selected_mode = 'ai'
+        current_scene = "game"
+        start_match()
+        return
+    if action == 'pvp':
+        selected_mode = 'pvp'
+        current_scene = "character_select"
+        character_select_state = initial_char_select_state.copy()
+        return
+    if action == 'back':
+        current_scene = "menu"
+        return
+
+    present()
 
 def character_select_scene():
     """Renders the PvP character selection screen."""
@@ -919,57 +1391,32 @@ def character_select_scene():
     mouse_x, mouse_y = pygame.mouse.get_pos()
     click = False
 
-    GRID_START_X = 50
-    GRID_START_Y = 150
-    CUBE_DISPLAY_SIZE = 80
-    PADDING = 25
-    COLUMNS = 4 
+    cache = scenes.cache('character_select')
+    start_game_rect = cache['buttons'][0]['rect']
 
-    button_width, button_height = 250, 60
-    start_game_rect = pygame.Rect(WIDTH // 2 - button_width // 2, HEIGHT - 80, button_width, button_height)
+    character_select_state['cube_rects'] = cache['cube_rects']
 
-    character_select_state['cube_rects'] = [] 
-
-    for event in pygame.event.get():
+    for event in get_events():
         if event.type == pygame.QUIT:
             running = False
             return
         if event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 1: 
+            if event.button == 1:
                 click = True
         if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-            current_scene = "mode_select" 
-            character_select_state = initial_char_select_state.copy() 
+            current_scene = "mode_select"
+            character_select_state = initial_char_select_state.copy()
             return
 
-    screen.fill(BLACK) 
+    screen.blit(cache['layers']['background'], (0, 0))
 
-    draw_text("CHARACTER SELECT", 60, WHITE, WIDTH // 2, 40)
-
-    instruction_text = ""
-    instruction_color = WHITE
-    if character_select_state['current_player'] == 'P1':
-        instruction_text = "PLAYER 1: CHOOSE YOUR CUBE"
-        instruction_color = BLUE
-    elif character_select_state['current_player'] == 'P2':
-        instruction_text = "PLAYER 2: CHOOSE YOUR CUBE"
-        instruction_color = RED
-    elif character_select_state['current_player'] == 'START':
-        instruction_text = "BOTH PLAYERS SELECTED"
-        instruction_color = GREEN
-
-    draw_text(instruction_text, 40, instruction_color, WIDTH // 2, 90)
+    instruction = cache['instructions'].get(character_select_state['current_player'])
+    if instruction is not None:
+        screen.blit(*instruction)
 
     hovered_cube_index = -1
     for i, cube in enumerate(all_cubes_data):
-        col = i % COLUMNS
-        row = i // COLUMNS
-
-        x_pos = GRID_START_X + col * (CUBE_DISPLAY_SIZE + PADDING)
-        y_pos = GRID_START_Y + row * (CUBE_DISPLAY_SIZE + PADDING)
-
-        cube_rect = draw_cube_preview(x_pos, y_pos, cube['color'], size=CUBE_DISPLAY_SIZE)
-        character_select_state['cube_rects'].append(cube_rect)
+        cube_rect = cache['cube_rects'][i]
 
         if cube_rect.collidepoint((mouse_x, mouse_y)):
             hovered_cube_index = i
@@ -1019,29 +1466,28 @@ def character_select_scene():
             if start_game_rect.collidepoint((mouse_x, mouse_y)):
 
                 current_scene = "game"
-                reset_game_state(keep_stats=True) 
+                start_match() 
                 return
 
-    if character_select_state['message']:
-        draw_text(character_select_state['message'], 28, RED, WIDTH // 2, HEIGHT - 120)
+    message = character_select_state['message']
+    if message:
+        rendered = cache['messages'].get(message)
+        if rendered is None:
+            rendered = cache['messages'][message] = Scenes.render_text(message, 28, RED, WIDTH // 2, HEIGHT - 120)
+        screen.blit(*rendered)
 
     if character_select_state['current_player'] == 'START':
-        button_color = DARK_GRAY
-        if start_game_rect.collidepoint((mouse_x, mouse_y)):
-            button_color = GRAY
-
-        pygame.draw.rect(screen, button_color, start_game_rect, border_radius=10)
-        draw_text("START GAME", 36, BLACK, start_game_rect.centerx, start_game_rect.centery)
+        draw_menu_buttons(cache['buttons'], (mouse_x, mouse_y), False)
 
-    pygame.display.flip()
+    present()
 
 def main_menu():
     global current_scene, running
 
-    mouse_x, mouse_y = pygame.mouse.get_pos()
+    mouse_pos = pygame.mouse.get_pos()
     click = False
 
-    for event in pygame.event.get():
+    for event in get_events():
         if event.type == pygame.QUIT:
             running = False
             return
@@ -1049,67 +1495,18 @@ def main_menu():
             if event.button == 1:
                 click = True
 
-    screen.fill(BLACK) 
-
-    draw_text("CUBE COMBAT", 72, RED, WIDTH // 2, HEIGHT // 5)
+    cache = scenes.cache('menu')
+    screen.blit(cache['layers']['background'], (0, 0))
 
-    button_width, button_height = 250, 60
-    center_x = WIDTH // 2
-
-    start_y = HEIGHT // 2 - 50
-    collected_y = start_y + button_height + 30 
-    achievements_y = collected_y + button_height + 30 
-    quit_y = achievements_y + button_height + 30
-
-    start_rect = pygame.Rect(center_x - button_width // 2, start_y - button_height // 2, button_width, button_height)
-
-    button_color = GREEN
-    if start_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = BRIGHT_GREEN
-        if click:
-            current_scene = "mode_select" 
-            return 
-
-    pygame.draw.rect(screen, button_color, start_rect, border_radius=10)
-    draw_text("START GAME", 36, BLACK, center_x, start_y)
-
-    collected_rect = pygame.Rect(center_x - button_width // 2, collected_y - button_height // 2, button_width, button_height)
-
-    button_color = BLUE
-    if collected_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = CYAN
-        if click:
-            current_scene = "collected_cubes" 
-            return 
-
-    pygame.draw.rect(screen, button_color, collected_rect, border_radius=10)
-    draw_text("COLLECTED CUBES", 36, BLACK, center_x, collected_y)
-
-    achievements_rect = pygame.Rect(center_x - button_width // 2, achievements_y - button_height // 2, button_width, button_height)
-
-    button_color = PINK 
-    if achievements_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = (255, 100, 150) 
-        if click:
-            current_scene = "achievements" 
-            return 
-
-    pygame.draw.rect(screen, button_color, achievements_rect, border_radius=10)
-    draw_text("ACHIEVEMENTS", 36, BLACK, center_x, achievements_y)
-
-    quit_rect = pygame.Rect(center_x - button_width // 2, quit_y - button_height // 2, button_width, button_height)
-
-    button_color = DARK_GRAY
-    if quit_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = GRAY
-        if click:
-            running = False
-            return 
-
-    pygame.draw.rect(screen, button_color, quit_rect, border_radius=10)
-    draw_text("QUIT", 36, BLACK, center_x, quit_y)
+    action = draw_menu_buttons(cache['buttons'], mouse_pos, click)
+    if action == 'quit':
+        running = False
+        return
+    if action is not None:
+        current_scene = action
+        return
 
-    pygame.display.flip()
+    present()
 
 def collected_cubes_scene():
     """Renders the list of collected cubes in a grid and a detailed stats panel."""
@@ -1119,57 +1516,31 @@ def collected_cubes_scene():
     mouse_x, mouse_y = pygame.mouse.get_pos()
     click = False
 
-    GRID_START_X = 50
-    GRID_START_Y = 100
-    CUBE_DISPLAY_SIZE = 60
-    PADDING = 20
-    COLUMNS = 3
-
-    cube_rects = [] 
-
-    for event in pygame.event.get():
+    for event in get_events():
         if event.type == pygame.QUIT:
             running = False
             return
         if event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 1: 
+            if event.button == 1:
                 click = True
         if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-            current_scene = "menu"
-            selected_cube_data = None 
-            return
-
-    screen.fill(BLACK) 
-    draw_text("COLLECTED CUBES", 50, WHITE, WIDTH // 2, 40)
-
-    button_width, button_height = 150, 40
-    back_x = 70
-    back_y = 40
-    back_rect = pygame.Rect(back_x - button_width // 2, back_y - button_height // 2, button_width, button_height)
-
-    button_color = DARK_GRAY
-    if back_rect.collidepoint((mouse_x, mouse_y)):
-        button_color = GRAY
-        if click: 
             current_scene = "menu"
             selected_cube_data = None
-            return 
-
-    pygame.draw.rect(screen, button_color, back_rect, border_radius=5)
-    draw_text("Back (ESC)", 28, BLACK, back_x, back_y)
-
-    for i, cube in enumerate(all_cubes_data):
-        col = i % COLUMNS
-        row = i // COLUMNS
+            return
 
-        x_pos = GRID_START_X + col * (CUBE_DISPLAY_SIZE + PADDING)
-        y_pos = GRID_START_Y + row * (CUBE_DISPLAY_SIZE + PADDING)
+    cache = scenes.cache('collected_cubes')
+    cube_rects = cache['cube_rects']
+    screen.blit(cache['layers']['background'], (0, 0))
 
-        cube_rect = draw_cube_preview(x_pos, y_pos, cube['color'], size=CUBE_DISPLAY_SIZE)
-        cube_rects.append(cube_rect)
+    if draw_menu_buttons(cache['buttons'], (mouse_x, mouse_y), click) == 'back':
+        current_scene = "menu"
+        selected_cube_data = None
+        return
 
-        if selected_cube_data and cube['id'] == selected_cube_data['id']:
-            pygame.draw.rect(screen, BRIGHT_GREEN, cube_rect, 5, border_radius=5)
+    if selected_cube_data:
+        for cube, cube_rect in zip(all_cubes_data, cube_rects):
+            if cube['id'] == selected_cube_data['id']:
+                pygame.draw.rect(screen, BRIGHT_GREEN, cube_rect, 5, border_radius=5)
 
     if click:
         clicked_on_panel = False
@@ -1193,13 +1564,13 @@ def collected_cubes_scene():
             if not clicked_on_cube:
                 selected_cube_data = None
 
-    if selected_cube_data:
-        draw_cube_detail_panel(selected_cube_data)
+    detail = cache['layers'].get(('detail', selected_cube_data['id'] if selected_cube_data else None))
+    if detail is not None:
+        screen.blit(detail, cache['detail_pos'])
     else:
+        draw_cube_detail_panel(selected_cube_data)
 
-        draw_text("Click a Cube to View Details", 36, DARK_GRAY, WIDTH * 0.7, HEIGHT // 2)
-
-    pygame.display.flip()
+    present()
 
 def reset_game_state(keep_stats=True):
     """
@@ -1229,8 +1600,7 @@ def reset_game_state(keep_stats=True):
     game_state['flash_count'] = 0
     game_state['endlag_timer'] = 0.0
 
-    game_state['purple_hitbox_active'] = False
-    game_state['purple_hitbox_rect'] = None
+    game_state['purple_hitbox_active'] = False   # the state keeps its hitbox rect for the next slash
     game_state['hitbox_timer'] = 0
     game_state['special_attack_cooldown_timer'] = 0 
     game_state['last_direction'] = 'right'
@@ -1244,32 +1614,31 @@ def reset_game_state(keep_stats=True):
 
     game_state['parry_active'] = False
     game_state['parry_timer'] = 0.0
+    game_state['parry_buffered'] = False
+    game_state['parry_buffer_until'] = 0.0
 
-    print("Game state reset.")
+    game_state['match_time'] = 0.0
 
-def check_debug_file():
-    """Reads the debug.txt file and updates the global debug flag."""
-    global is_debug_mode
-    try:
-        if os.path.exists(DEBUG_FILE):
-            with open(DEBUG_FILE, 'r') as f:
-                content = f.readline().strip().lower()
-                is_debug_mode_new = content == "debug = true"
-                if is_debug_mode_new != is_debug_mode:
-                    is_debug_mode = is_debug_mode_new
-                    print(f"Debug Mode Toggled: {is_debug_mode}")
-                return is_debug_mode
-        else:
-
-            if is_debug_mode:
-                is_debug_mode = False
-                print("Debug Mode Toggled: False (File removed)")
-            return False
-    except Exception as e:
-        if is_debug_mode:
-            is_debug_mode = False
-            print(f"Error reading debug file, disabling debug: {e}")
-        return False
+def get_match_cube_ids():
+    """Cube ids in this match: the PvP picks, or sword master vs angry sniper against the AI."""
+    if selected_mode == 'pvp':
+        return (character_select_state['p1_selection_id'] or 1,
+                character_select_state['p2_selection_id'] or 2)
+    return 1, DEV_CUBE_ID
+
+def start_match(seed=None):
+    """Resets the arena for a new round and logs which mode and cubes are playing."""
+    global logged_red_cube_mode, match_seed
+    reset_game_state(keep_stats=True)
+    # every round gets its own seed so a recording of its inputs replays exactly
+    match_seed = seed if seed is not None else random.getrandbits(63)
+    rng.seed(match_seed)
+    Combat_log.match_time = 0.0
+    logged_red_cube_mode = None
+
+    blue_cube_id, red_cube_id = get_match_cube_ids()
+    Combat_log.emit(Combat_log.EVENT_MATCH_START, Combat_log.ACTOR_NONE, False,
+                    Combat_log.MATCH_MODES.index(selected_mode), blue_cube_id * 1000 + red_cube_id)
 
 def handle_player_movement(cube_color, keys, current_move_speed):
     """Handles movement for a single player."""
@@ -1293,15 +1662,20 @@ def handle_player_movement(cube_color, keys, current_move_speed):
             dy += current_move_speed
             game_state['last_direction'] = 'down'
 
+        if not arena.open:
+            game_state['blue_x'], game_state['blue_y'] = arena.resolve(
+                game_state['blue_x'], game_state['blue_y'], CUBE_SIZE, CUBE_SIZE, dx, dy)
+            return
+
         game_state['blue_x'] += dx
         game_state['blue_y'] += dy
 
-        game_state['blue_x'] = max(0, min(game_state['blue_x'], WIDTH - CUBE_SIZE))
-        game_state['blue_y'] = max(0, min(game_state['blue_y'], HEIGHT - CUBE_SIZE))
+        game_state['blue_x'] = max(0, min(game_state['blue_x'], arena.width - CUBE_SIZE))
+        game_state['blue_y'] = max(0, min(game_state['blue_y'], arena.height - CUBE_SIZE))
 
     elif cube_color == 'red' and selected_mode == 'pvp':
 
-        ai_is_stuck = game_state['red_cube_mode'] in ["Parried (Stun)", "Charge (Endlag)", "Charge (Windup)", "Beam (Windup)"]
+        ai_is_stuck = game_state['red_cube_mode'] in STUCK_RED_CUBE_MODES
         if ai_is_stuck or game_state['game_over']:
              return 
 
@@ -1319,14 +1693,19 @@ def handle_player_movement(cube_color, keys, current_move_speed):
             dy += current_move_speed
             game_state['ai_last_direction'] = 'down'
 
+        if not arena.open:
+            game_state['red_x'], game_state['red_y'] = arena.resolve(
+                game_state['red_x'], game_state['red_y'], CUBE_SIZE, CUBE_SIZE, dx, dy)
+            return
+
         game_state['red_x'] += dx
         game_state['red_y'] += dy
 
-        game_state['red_x'] = max(0, min(game_state['red_x'], WIDTH - CUBE_SIZE))
-        game_state['red_y'] = max(0, min(game_state['red_y'], HEIGHT - CUBE_SIZE))
+        game_state['red_x'] = max(0, min(game_state['red_x'], arena.width - CUBE_SIZE))
+        game_state['red_y'] = max(0, min(game_state['red_y'], arena.height - CUBE_SIZE))
 
-def initiate_red_cube_charge_pvp():
-    """Triggers the Red Cube's charge attack in PvP mode."""
+def initiate_red_cube_charge_pvp(offset_ms=0.0):
+    """Triggers the Red Cube's charge attack in PvP mode, pressed offset_ms into the frame."""
     if not game_state['blue_active']:
         return
 
@@ -1335,7 +1714,7 @@ def initiate_red_cube_charge_pvp():
 
     game_state['charge_state'] = 'Windup'
     game_state['flash_count'] = 0
-    game_state['flash_timer'] = FLASH_DURATION_MS 
+    game_state['flash_timer'] = FLASH_DURATION_MS + offset_ms
 
     red_x, red_y = game_state['red_x'], game_state['red_y']
 
@@ -1354,81 +1733,86 @@ def initiate_red_cube_charge_pvp():
     game_state['charge_dy'] = math.sin(angle)
 
     game_state['red_cube_mode'] = "Charge (Windup)" 
-    print("Player 2 initiated Charge Windup.")
-
-running = True
-clock = pygame.time.Clock()
-
-while running:
-
-    dt = clock.tick(60) 
+    Combat_log.emit(Combat_log.EVENT_CHARGE_START, Combat_log.ACTOR_RED, True)
 
-    if current_scene == "menu":
-        main_menu()
-        continue
-
-    if current_scene == "mode_select": 
-        mode_select_menu()
-        continue
-
-    if current_scene == "character_select":
-        character_select_scene()
-        continue
-
-    if current_scene == "collected_cubes":
-        collected_cubes_scene()
-        continue
-
-    if current_scene == "achievements": 
-        achievements_scene()
-        continue
-
-    is_debug_mode = check_debug_file() 
-
-    keys = pygame.key.get_pressed()
+def move_charge(speed):
+    """
+    Moves the charging red cube one frame, `speed` px along its charge.
+    The move is swept against the blue cube, so a fast charge can't pass
+    through it: red stops at the point of contact and the hit lands. An
+    arena edge reached first clamps the move as before, and a wall inside
+    the arena stops it where red touches it. Returns True if red reached an
+    edge or a wall this frame.
+    """
+    x, y = game_state['red_x'], game_state['red_y']
+    move_x = game_state['charge_dx'] * speed
+    move_y = game_state['charge_dy'] * speed
+    wall_toi = Collision.sweep_bounds(x, y, CUBE_SIZE, CUBE_SIZE, move_x, move_y, 0, 0, arena.width, arena.height)
+    obstacle_toi = arena.sweep(x, y, CUBE_SIZE, CUBE_SIZE, move_x, move_y)
+    if obstacle_toi is not None and (wall_toi is None or obstacle_toi < wall_toi):
+        wall_toi = obstacle_toi
+    else:
+        obstacle_toi = None
+
+    if game_state['blue_active'] and game_state['blue_health'] > 0:
+        toi = Collision.sweep_aabb(x, y, CUBE_SIZE, CUBE_SIZE, move_x, move_y,
+                                   game_state['blue_x'], game_state['blue_y'], CUBE_SIZE, CUBE_SIZE)
+        if toi is not None and (wall_toi is None or toi <= wall_toi):
+            game_state['red_x'] = x + move_x * toi
+            game_state['red_y'] = y + move_y * toi
+            charge_hit()
+            return False
 
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
+    if obstacle_toi is not None:
+        game_state['red_x'] = x + move_x * obstacle_toi
+        game_state['red_y'] = y + move_y * obstacle_toi
+        return True
 
-        if event.type == pygame.KEYDOWN:
+    new_x = max(0, min(x + move_x, arena.width - CUBE_SIZE))
+    new_y = max(0, min(y + move_y, arena.height - CUBE_SIZE))
+    game_state['red_x'] = new_x
+    game_state['red_y'] = new_y
+    return wall_toi is not None
 
-            if game_state['blue_active'] and not game_state['game_over']:
-                if event.key == pygame.K_SPACE: 
-                    do_special_attack_blue()
-                if event.key == pygame.K_f: 
-                    initiate_parry()
+def charge_hit():
+    """The red cube's charge reaching the blue cube: a one-hit KO outside debug mode."""
+    if not is_debug_mode:
 
-            if selected_mode == 'pvp' and game_state['red_active'] and not game_state['game_over']:
-                if event.key == pygame.K_l: 
-                    do_special_attack_red()
-                if event.key == pygame.K_k: 
-                    initiate_red_cube_charge_pvp()
+        damage = game_state['blue_health']
+        game_state['blue_health'] = 0 
+        Combat_log.emit(Combat_log.EVENT_CHARGE_HIT, Combat_log.ACTOR_RED, True, damage, game_state['blue_health'])
+    else:
+        Combat_log.emit(Combat_log.EVENT_CHARGE_HIT, Combat_log.ACTOR_RED, False, 0, game_state['blue_health'])
 
-            if event.key == pygame.K_r and game_state['game_over']:
-                print("Restarting Game...")
-                reset_game_state(keep_stats=True) 
+    game_state['charge_state'] = 'Endlag' 
+    game_state['endlag_timer'] = ENDLAG_DURATION_MS 
+    game_state['red_cube_mode'] = "Charge (Endlag)"
 
-            if event.key == pygame.K_ESCAPE and not game_state['game_over']:
-                 current_scene = 'menu'
-                 selected_mode = None 
-                 reset_game_state(keep_stats=True) 
-                 print("Returning to Main Menu.")
+def handle_gameplay_keydown(key, offset_ms=0.0):
+    """
+    Runs the attack/parry action bound to a gameplay key for whichever player
+    owns it. offset_ms is how far into the frame about to be simulated the key
+    went down (see Inputs.InputQueue); timers start from that moment.
+    """
 
-    if game_state['game_over']:
-        screen.fill(WHITE)
-        draw_health_bars()
+    if game_state['blue_active'] and not game_state['game_over']:
+        if key == pygame.K_SPACE: 
+            do_special_attack_blue(offset_ms)
+        if key == pygame.K_f: 
+            initiate_parry(offset_ms)
 
-        winner = "Red Cube" if game_state['blue_health'] <= 0 else "Blue Cube"
-        winner_color = RED if game_state['blue_health'] <= 0 else BLUE
+    if selected_mode == 'pvp' and game_state['red_active'] and not game_state['game_over']:
+        if key == pygame.K_l: 
+            do_special_attack_red(offset_ms)
+        if key == pygame.K_k: 
+            initiate_red_cube_charge_pvp(offset_ms)
 
-        message = f"{winner} Wins! Press R to Restart"
+def update_game(dt, keys):
+    """Advances the gameplay simulation by one frame of dt milliseconds."""
+    global logged_red_cube_mode
 
-        game_over_text = font.render(message, True, winner_color)
-        text_rect = game_over_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
-        screen.blit(game_over_text, text_rect)
-        pygame.display.flip()
-        continue 
+    game_state['match_time'] += dt
+    Combat_log.match_time = game_state['match_time']
 
     current_move_speed = game_state.get('move_speed', MOVE_SPEED)
     if game_state['blue_active']:
@@ -1446,7 +1830,6 @@ while running:
         game_state['hitbox_timer'] -= dt
         if game_state['hitbox_timer'] <= 0:
             game_state['purple_hitbox_active'] = False
-            game_state['purple_hitbox_rect'] = None
 
     if game_state['special_attack_cooldown_timer'] > 0:
         if not is_debug_mode:
@@ -1470,7 +1853,7 @@ while running:
             target_x, target_y = game_state['blue_x'], game_state['blue_y']
             distance_to_player = calculate_distance(game_state['red_x'], game_state['red_y'], target_x, target_y)
 
-            ai_is_stuck = game_state['red_cube_mode'] in ["Parried (Stun)", "Charge (Endlag)", "Charge (Windup)", "Beam (Windup)"]
+            ai_is_stuck = game_state['red_cube_mode'] in STUCK_RED_CUBE_MODES
 
             if game_state['ai_attack_state'] == 'Idle' and not ai_is_stuck:
 
@@ -1481,28 +1864,33 @@ while running:
 
                 game_state['flash_timer'] -= dt
 
-                if game_state['flash_timer'] <= 0:
+                # the overshoot carries into the next flash, so a windup lasts as long at 30 FPS as at 144
+                while game_state['flash_timer'] <= 0:
                     game_state['flash_count'] += 1
+                    Combat_log.emit(Combat_log.EVENT_WINDUP_FLASH, Combat_log.ACTOR_RED, True, game_state['flash_count'])
 
                     if game_state['flash_count'] > (AI_SLASH_FLASH_CYCLES * 2) + 1:
-                        execute_ai_special_attack() 
-                    else:
-                        game_state['flash_timer'] = AI_FLASH_DURATION_MS 
+                        execute_ai_special_attack()
+                        break
+                    game_state['flash_timer'] += AI_FLASH_DURATION_MS
 
-                target_x, target_y = game_state['blue_x'], game_state['blue_y']
-                red_center_x = game_state['red_x'] + CUBE_SIZE / 2
-                red_center_y = game_state['red_y'] + CUBE_SIZE / 2
-                dx = target_x + CUBE_SIZE / 2 - red_center_x
-                dy = target_y + CUBE_SIZE / 2 - red_center_y
-                game_state['ai_beam_angle'] = math.atan2(dy, dx) 
+                # the beam may have fired above, which leaves the AI free again
+                if game_state['ai_attack_state'] == 'SpecialWindup':
+                    target_x, target_y = game_state['blue_x'], game_state['blue_y']
+                    red_center_x = game_state['red_x'] + CUBE_SIZE / 2
+                    red_center_y = game_state['red_y'] + CUBE_SIZE / 2
+                    dx = target_x + CUBE_SIZE / 2 - red_center_x
+                    dy = target_y + CUBE_SIZE / 2 - red_center_y
+                    game_state['ai_beam_angle'] = math.atan2(dy, dx) 
 
-                game_state['red_cube_mode'] = "Beam (Windup)" 
+                    game_state['red_cube_mode'] = "Beam (Windup)" 
 
-            if game_state['ai_attack_state'] == 'Idle' and not ai_is_stuck: 
+            # a charge in progress runs its course; only a free AI picks a new move
+            if game_state['ai_attack_state'] == 'Idle':
 
-                if game_state['charge_state'] == 'Idle':
+                if game_state['charge_state'] == 'Idle' and not ai_is_stuck:
 
-                    if random.random() < CHARGE_INITIATE_CHANCE:
+                    if rng.random() < CHARGE_INITIATE_CHANCE:
                         game_state['charge_state'] = 'Windup'
                         game_state['flash_count'] = 0
                         game_state['flash_timer'] = FLASH_DURATION_MS 
@@ -1514,6 +1902,7 @@ while running:
                         game_state['charge_dy'] = math.sin(angle)
 
                         game_state['red_cube_mode'] = "Charge (Windup)" 
+                        Combat_log.emit(Combat_log.EVENT_CHARGE_START, Combat_log.ACTOR_RED, False)
                     else:
 
                         new_red_x, new_red_y, new_mode = move_ai(
@@ -1536,37 +1925,21 @@ while running:
                     game_state['flash_timer'] -= dt
 
                     flash_end_count = (CHARGE_FLASH_CYCLES * 2)
-                    if game_state['flash_timer'] <= 0:
+                    while game_state['flash_timer'] <= 0:
                         game_state['flash_count'] += 1
+                        Combat_log.emit(Combat_log.EVENT_WINDUP_FLASH, Combat_log.ACTOR_RED, False, game_state['flash_count'])
 
                         if game_state['flash_count'] > flash_end_count:
                             game_state['charge_state'] = 'Charging'
-                            game_state['red_cube_mode'] = "Charge"
-                        else:
-                            game_state['flash_timer'] = FLASH_DURATION_MS
+                            break
+                        game_state['flash_timer'] += FLASH_DURATION_MS
 
-                    game_state['red_cube_mode'] = "Charge (Windup)" 
+                    game_state['red_cube_mode'] = "Charge" if game_state['charge_state'] == 'Charging' else "Charge (Windup)"
 
                 elif game_state['charge_state'] == 'Charging':
                     game_state['red_cube_mode'] = "Charge"
 
-                    move_x = game_state['charge_dx'] * CHARGE_SPEED
-                    move_y = game_state['charge_dy'] * CHARGE_SPEED
-                    new_x = game_state['red_x'] + move_x
-                    new_y = game_state['red_y'] + move_y
-
-                    hit_boundary = False
-                    if new_x <= 0 or new_x >= WIDTH - CUBE_SIZE:
-                        hit_boundary = True
-                        new_x = max(0, min(new_x, WIDTH - CUBE_SIZE)) 
-                    if new_y <= 0 or new_y >= HEIGHT - CUBE_SIZE:
-                        hit_boundary = True
-                        new_y = max(0, min(new_y, HEIGHT - CUBE_SIZE)) 
-
-                    game_state['red_x'] = new_x
-                    game_state['red_y'] = new_y
-
-                    if hit_boundary:
+                    if move_charge(CHARGE_SPEED):
                         game_state['charge_state'] = 'Endlag' 
                         game_state['endlag_timer'] = ENDLAG_DURATION_MS 
                         game_state['red_cube_mode'] = "Charge (Endlag)"
@@ -1586,13 +1959,15 @@ while running:
 
                 game_state['flash_timer'] -= dt
 
-                if game_state['flash_timer'] <= 0:
+                # the overshoot carries into the next flash, so a windup lasts as long at 30 FPS as at 144
+                while game_state['flash_timer'] <= 0:
                     game_state['flash_count'] += 1
+                    Combat_log.emit(Combat_log.EVENT_WINDUP_FLASH, Combat_log.ACTOR_RED, True, game_state['flash_count'])
 
                     if game_state['flash_count'] > (AI_SLASH_FLASH_CYCLES * 2) + 1:
-                        execute_ai_special_attack_red() 
-                    else:
-                        game_state['flash_timer'] = AI_FLASH_DURATION_MS 
+                        execute_ai_special_attack_red()
+                        break
+                    game_state['flash_timer'] += AI_FLASH_DURATION_MS
 
                 game_state['red_cube_mode'] = "Beam (Windup)" 
 
@@ -1601,41 +1976,28 @@ while running:
                 game_state['flash_timer'] -= dt
 
                 flash_end_count = (P2_CHARGE_FLASH_CYCLES * 2) 
-                if game_state['flash_timer'] <= 0:
+                while game_state['flash_timer'] <= 0:
                     game_state['flash_count'] += 1
+                    Combat_log.emit(Combat_log.EVENT_WINDUP_FLASH, Combat_log.ACTOR_RED, False, game_state['flash_count'])
 
                     if game_state['flash_count'] > flash_end_count:
                         game_state['charge_state'] = 'Charging'
                         game_state['red_cube_mode'] = "Charge"
-                    else:
-                        game_state['flash_timer'] = FLASH_DURATION_MS 
+                        break
+                    game_state['flash_timer'] += FLASH_DURATION_MS
 
                 game_state['red_cube_mode'] = "Charge (Windup)" 
 
             elif game_state['charge_state'] == 'Charging': 
                 game_state['red_cube_mode'] = "Charge"
 
-                move_x = game_state['charge_dx'] * (CHARGE_SPEED * 1.5)
-                move_y = game_state['charge_dy'] * (CHARGE_SPEED * 1.5)
-                new_x = game_state['red_x'] + move_x
-                new_y = game_state['red_y'] + move_y
-
-                hit_boundary = False
-                if new_x <= 0 or new_x >= WIDTH - CUBE_SIZE:
-                    hit_boundary = True
-                    new_x = max(0, min(new_x, WIDTH - CUBE_SIZE)) 
-                if new_y <= 0 or new_y >= HEIGHT - CUBE_SIZE:
-                    hit_boundary = True
-                    new_y = max(0, min(new_y, HEIGHT - CUBE_SIZE)) 
-
-                game_state['red_x'] = new_x
-                game_state['red_y'] = new_y
-
-                if hit_boundary:
+                if move_charge(CHARGE_SPEED * 1.5):
 
                     if not is_debug_mode:
                         game_state['red_health'] -= P2_BOUNDARY_DAMAGE
-                        print(f"Red Cube hit boundary! Damage: {P2_BOUNDARY_DAMAGE}. Red Health: {max(0, game_state['red_health'])}")
+                        Combat_log.emit(Combat_log.EVENT_BOUNDARY_HIT, Combat_log.ACTOR_RED, True, P2_BOUNDARY_DAMAGE, game_state['red_health'])
+                    else:
+                        Combat_log.emit(Combat_log.EVENT_BOUNDARY_HIT, Combat_log.ACTOR_RED, False, 0, game_state['red_health'])
 
                     game_state['charge_state'] = 'Endlag' 
                     game_state['endlag_timer'] = P2_BOUNDARY_STUN_MS 
@@ -1673,8 +2035,22 @@ while running:
                     game_state['ai_cyan_beam_active'] = False
                     game_state['ai_beam_angle'] = 0.0
 
+    if game_state['parry_buffered']:
+        # an early parry lands once the flashes reach its window, or misses when it runs out
+        window = parry_window()
+        if window is not None and window[0] <= game_state['match_time']:
+            land_parry()
+        elif window is None or game_state['match_time'] >= game_state['parry_buffer_until']:
+            miss_parry()
+
+    if game_state['red_cube_mode'] != logged_red_cube_mode:
+        logged_red_cube_mode = game_state['red_cube_mode']
+        Combat_log.emit(Combat_log.EVENT_AI_MODE, Combat_log.ACTOR_RED, False, Combat_log.AI_MODE_CODES[logged_red_cube_mode])
+
     is_charging = game_state['charge_state'] == 'Charging'
 
+    # a charge that moved this frame was swept by move_charge; this catches the frame
+    # it starts on and blue walking into it
     if is_charging:
 
         if (game_state['blue_x'] < game_state['red_x'] + CUBE_SIZE and
@@ -1683,33 +2059,28 @@ while running:
             game_state['blue_y'] + CUBE_SIZE > game_state['red_y']):
 
             if game_state['blue_active'] and game_state['blue_health'] > 0:
-                if not is_debug_mode:
-
-                    game_state['blue_health'] = 0 
-                    print(f"Red Cube Charge hit! INSTA-KILL! Blue Health: {max(0, game_state['blue_health'])}")
-                else:
-                    print("Red Cube Charge hit! (Debug Invincible)")
-
-                game_state['charge_state'] = 'Endlag' 
-                game_state['endlag_timer'] = ENDLAG_DURATION_MS 
-                game_state['red_cube_mode'] = "Charge (Endlag)"
+                charge_hit()
 
     if game_state['blue_health'] <= 0:
         if game_state['blue_active']:
-            print("Blue Cube Defeated!")
+            Combat_log.emit(Combat_log.EVENT_DEATH, Combat_log.ACTOR_BLUE)
             cube_stats['red_kills'] += 1 
-            save_stats(cube_stats)
+            if autosave_stats:
+                save_stats(cube_stats)
+        if not game_state['game_over']:
+            Combat_log.emit(Combat_log.EVENT_MATCH_END, Combat_log.ACTOR_RED)
         game_state['blue_active'] = False
         game_state['game_over'] = True
 
     if game_state['red_health'] <= 0:
         if game_state['red_active']:
-            print("Red Cube Defeated!")
+            Combat_log.emit(Combat_log.EVENT_DEATH, Combat_log.ACTOR_RED)
             cube_stats['blue_kills'] += 1 
-            save_stats(cube_stats)
+            if autosave_stats:
+                save_stats(cube_stats)
 
             if is_debug_mode and selected_mode == 'ai': 
-                print("Debug Mode: Red Cube Respawning...")
+                Combat_log.emit(Combat_log.EVENT_RESPAWN, Combat_log.ACTOR_RED)
                 game_state['red_active'] = INITIAL_RED_ACTIVE
                 game_state['red_health'] = INITIAL_RED_HEALTH
                 game_state['red_x'] = red_x
@@ -1720,29 +2091,199 @@ while running:
                 game_state['ai_special_attack_cooldown_timer'] = 0
             else:
 
+                if not game_state['game_over']:
+                    Combat_log.emit(Combat_log.EVENT_MATCH_END, Combat_log.ACTOR_BLUE)
                 game_state['red_active'] = False
                 game_state['game_over'] = True
 
-    screen.fill(WHITE) 
+def camera_focus():
+    """The arena point the camera keeps centred: P1, or halfway between the cubes in PvP."""
+    x, y = game_state['blue_x'] + CUBE_SIZE / 2, game_state['blue_y'] + CUBE_SIZE / 2
+    if selected_mode == 'pvp':
+        x = (x + game_state['red_x'] + CUBE_SIZE / 2) / 2
+        y = (y + game_state['red_y'] + CUBE_SIZE / 2) / 2
+    return x, y
+
+def effect_origin(actor):
+    """Arena centre of a cube, for hit effects; None if it isn't on the field."""
+    if actor == Combat_log.ACTOR_BLUE:
+        if game_state['blue_active']:
+            return game_state['blue_x'] + CUBE_SIZE / 2, game_state['blue_y'] + CUBE_SIZE / 2
+    elif game_state['red_active']:
+        return game_state['red_x'] + CUBE_SIZE / 2, game_state['red_y'] + CUBE_SIZE / 2
+    return None
+
+def draw_game():
+    """
+    Draws the arena, both cubes, active attacks and the HUD. On the software
+    path only what moved is redrawn over the baked arena, and dirty_rects
+    tells present() which parts of the screen changed.
+    """
+    global dirty_rects
+
+    focus_x, focus_y = camera_focus()
+    if render_backend is not None:
+        render_backend.begin_frame(WHITE)
+        arena_view.begin_frame(None, focus_x, focus_y)
+        for chunk, pos in arena_view.visible_chunks():
+            render_backend.draw_surface(chunk, pos)
+    else:
+        arena_view.begin_frame(screen, focus_x, focus_y)
+    view_x, view_y = arena_view.camera.x, arena_view.camera.y
 
     if game_state['blue_active']:
         blue_cube_color = get_blue_cube_color(game_state)
-        draw_cube(game_state['blue_x'], game_state['blue_y'], blue_cube_color)
+        draw_cube(game_state['blue_x'] - view_x, game_state['blue_y'] - view_y, blue_cube_color)
+        arena_view.mark(cube_rect)
 
     draw_health_bars()
 
     if game_state['purple_hitbox_active'] and game_state['purple_hitbox_rect']:
-        pygame.draw.rect(screen, PURPLE_TUPLE, game_state['purple_hitbox_rect'])
+        hitbox = game_state['purple_hitbox_rect']
+        view_rect.update(hitbox.x - view_x, hitbox.y - view_y, hitbox.w, hitbox.h)
+        if render_backend is not None:
+            render_backend.fill_rect(PURPLE_TUPLE, view_rect)
+        else:
+            pygame.draw.rect(screen, PURPLE_TUPLE, view_rect)
+            arena_view.mark(view_rect)
 
     if game_state['ai_cyan_beam_active']:
-        beam_surface, beam_rect = get_ai_beam_rect()
-        screen.blit(beam_surface, beam_rect)
+        draw_ai_beam(view_x, view_y)
 
     if game_state['red_active']:
         red_cube_color = get_red_cube_color(game_state)
-        draw_cube(game_state['red_x'], game_state['red_y'], red_cube_color)
+        draw_cube(game_state['red_x'] - view_x, game_state['red_y'] - view_y, red_cube_color)
+        arena_view.mark(cube_rect)
+
+    if particles is not None and particles.live:
+        if render_backend is not None:
+            particles.draw_backend(render_backend, view_x, view_y)
+        else:
+            arena_view.mark(particles.draw(screen, view_x, view_y))
+
+    if render_backend is None:
+        dirty_rects = arena_view.end_frame()
+
+def draw_game_over():
+    arena_view.invalidate()
+    screen.fill(WHITE)
+    draw_health_bars()
+    if particles is not None:
+        # the KO burst plays out behind the result
+        particles.draw(screen, arena_view.camera.x, arena_view.camera.y)
+
+    winner = "Red Cube" if game_state['blue_health'] <= 0 else "Blue Cube"
+    winner_color = RED if game_state['blue_health'] <= 0 else BLUE
+
+    message = f"{winner} Wins! Press R to Restart"
+
+    game_over_text = font.render(message, True, winner_color)
+    text_rect = game_over_text.get_rect(center=(WIDTH // 2, HEIGHT // 2))
+    screen.blit(game_over_text, text_rect)
 
-    pygame.display.flip() 
+def game_scene(dt):
+    """One fight frame: input, simulation and drawing."""
+    global running, current_scene, selected_mode
+
+    keys = pygame.key.get_pressed()
+
+    events = get_events()
+    for event in events:
+        if event.type == pygame.QUIT:
+            running = False
+
+        if event.type == pygame.KEYDOWN:
+
+            handle_gameplay_keydown(event.key, getattr(event, 'offset_ms', 0.0))
+
+            if event.key == pygame.K_r and game_state['game_over']:
+                print("Restarting Game...")
+                start_match() 
+
+            if event.key == pygame.K_ESCAPE and not game_state['game_over']:
+                 current_scene = 'menu'
+                 selected_mode = None 
+                 reset_game_state(keep_stats=True) 
+                 print("Returning to Main Menu.")
+
+    if particles is not None:
+        particles.update(dt)
+
+    if game_state['game_over']:
+        draw_game_over()
+        present()
+        return
 
-pygame.quit()
-sys.exit()
\ No newline at end of file
+    if recorder is not None:
+        recorder.record(keys, events, dt)
+    update_game(dt, keys)
+
+    draw_game()
+
+    present()
+
+# scene name -> per-frame function, layout/layer build, hooks and the scenes to preload from it
+scenes = Scenes.SceneManager(sys.modules[__name__])
+scenes.add("menu", 'main_menu', build=build_main_menu,
+           next_scenes=("mode_select", "collected_cubes", "achievements"))
+scenes.add("mode_select", 'mode_select_menu', build=build_mode_select, next_scenes=("character_select", "game"))
+scenes.add("character_select", 'character_select_scene', build=build_character_select, next_scenes=("game",))
+scenes.add("collected_cubes", 'collected_cubes_scene', build=build_collected_cubes, next_scenes=("menu",))
+scenes.add("achievements", 'achievements_scene', build=build_achievements, next_scenes=("menu",))
+scenes.add("game", 'game_scene', build=build_arena, ready=arena_ready, enter=enter_arena, exit=exit_arena,
+           next_scenes=("menu",), timed=True, assets=arena_tile_assets)
+
+
+if __name__ == "__main__":
+    # combat messages go through the buffered log; set CUBE_COMBAT_LOG to also keep them on disk
+    if os.environ.get("CUBE_COMBAT_CONSOLE", "1") != "0":
+        Combat_log.enable_console()
+    Combat_log.start_writer(os.environ.get("CUBE_COMBAT_LOG"), fmt=os.environ.get("CUBE_COMBAT_LOG_FORMAT", "jsonl"))
+    open_save_store()
+    Achievements.start(all_achievements_data,
+                       Achievements.default_rules(ENDLAG_DURATION_MS * 2, INITIAL_BLUE_HEALTH, DEV_CUBE_ID),
+                       save_achievement)
+    Match_records.start(save_store)
+    # music and combat sound effects; CUBE_AUDIO=0 turns them off, CUBE_AUDIO_BUFFER sets the mixer buffer
+    Audio.start(assets)
+    Render_backend.install(sys.modules[__name__])
+    # hit sparks, parry flashes and KO bursts; needs numpy, CUBE_PARTICLES=0 turns them off
+    particles = Particles.create()
+    if particles is not None:
+        particles.start(effect_origin)
+    # set CUBE_REPLAY_DIR to save every finished round as a replay file
+    recorder = Replay.Recorder(sys.modules[__name__], os.environ["CUBE_REPLAY_DIR"]) if os.environ.get("CUBE_REPLAY_DIR") else None
+    # in debug mode (or with CUBE_ALLOC_PROBE=1) count per-frame allocations by scene and code path
+    alloc_probe = None
+    if is_debug_mode or os.environ.get("CUBE_ALLOC_PROBE") == "1":
+        alloc_probe = Alloc_probe.install(sys.modules[__name__])
+
+    running = True
+    clock = pygame.time.Clock()
+    input_queue = Inputs.InputQueue()
+
+    while running:
+
+        # waits out the frame like clock.tick(60), stamping input as it arrives
+        dt = input_queue.wait_frame(clock, 60)
+
+        if alloc_probe is not None:
+            alloc_probe.begin_frame(current_scene)
+
+        scenes.run_frame(dt)
+
+        if assets.pending:
+            assets.collect()
+
+    if alloc_probe is not None:
+        alloc_probe.print_report()
+        alloc_probe.uninstall()
+    scenes.close()
+    Audio.stop()
+    if particles is not None:
+        particles.stop()
+    assets.close()
+    Achievements.stop()
+    Match_records.stop()
+    save_store.close()
+    pygame.quit()
@@ -0,0 +1,105 @@
+"""
+Retained-mode HUD layer for Cube Combat.
+
+Greg registers the HUD widgets once (bars and text labels with fixed
+positions). Each frame it only pushes the current values. Nothing is
+re-rendered unless a value actually changed. In that case the widgets are
+recomposited into one per-pixel-alpha layer, which is RLE-encoded so the
+transparent areas cost almost nothing. Drawing the HUD is then a single
+blit per frame, whatever the widgets hold.
+
+    hud = Hud((WIDTH, HEIGHT), font)
+    hud.add_bar('blue', (590, 10, 200, 20), BLUE, max_value=100)
+    hud.add_label('blue_text', "P1 (Blue): {}", WHITE, (590, 35))
+    ...
+    hud.update('blue', health)
+    hud.update('blue_text', health)
+    hud.draw(screen)
+"""
+
+import pygame
+
+MAX_CACHED_LABELS = 256
+BAR_OUTLINE_COLOR = (100, 100, 100)
+
+
+class Hud:
+    def __init__(self, size, font):
+        self.size = size
+        self.font = font
+        self.widgets = {}       # key -> widget dict, in draw order
+        self.values = {}        # key -> value the layer was last composited with
+        self.templates = {}     # key -> label template currently in use
+        self.label_cache = {}   # (text, color) -> rendered Surface
+        self.layer = None
+        self.rects = []         # where each widget was composited, for redrawing just those areas
+        self.dirty = True
+        self.recomposites = 0
+
+    def add_bar(self, key, rect, color, max_value, value=0, outline_color=BAR_OUTLINE_COLOR):
+        self.widgets[key] = {'kind': 'bar', 'rect': pygame.Rect(rect), 'color': color,
+                             'max_value': max_value, 'outline_color': outline_color}
+        self.values[key] = value
+        self.dirty = True
+
+    def add_label(self, key, template, color, pos, value=0):
+        self.widgets[key] = {'kind': 'label', 'color': color, 'pos': pos}
+        self.templates[key] = template
+        self.values[key] = value
+        self.dirty = True
+
+    def update(self, key, value):
+        if self.values[key] != value:
+            self.values[key] = value
+            self.dirty = True
+
+    def set_template(self, key, template):
+        """Swaps a label's text template, e.g. "AI (Red): {}" for "P2 (Red): {}"."""
+        if self.templates[key] != template:
+            self.templates[key] = template
+            self.dirty = True
+
+    def _label_surface(self, text, color):
+        key = (text, color)
+        surface = self.label_cache.get(key)
+        if surface is None:
+            if len(self.label_cache) >= MAX_CACHED_LABELS:
+                self.label_cache.clear()
+            surface = self.label_cache[key] = self.font.render(text, True, color)
+        return surface
+
+    def _recomposite(self):
+        if self.layer is None:
+            self.layer = pygame.Surface(self.size, pygame.SRCALPHA)
+            if pygame.display.get_surface() is not None:
+                self.layer = self.layer.convert_alpha()
+        layer = self.layer
+        layer.set_alpha(255, 0)     # drop the RLE encoding first; pygame.draw can't write into an RLE surface
+        layer.fill((0, 0, 0, 0))
+        self.rects.clear()
+
+        for key, widget in self.widgets.items():
+            value = self.values[key]
+            if widget['kind'] == 'bar':
+                rect = widget['rect']
+                width = int(rect.w * max(0, value / widget['max_value']))
+                pygame.draw.rect(layer, widget['outline_color'], rect, 1)
+                layer.fill(widget['color'], (rect.x, rect.y, width, rect.h))
+                self.rects.append(rect)
+            else:
+                text = self.templates[key].format(value)
+                self.rects.append(layer.blit(self._label_surface(text, widget['color']), widget['pos']))
+
+        layer.set_alpha(255, pygame.RLEACCEL)
+        self.dirty = False
+        self.recomposites += 1
+
+    def prepare(self):
+        """Creates and composites the layer now, so the first draw() doesn't have to."""
+        if self.dirty:
+            self._recomposite()
+
+    def draw(self, surface):
+        if self.dirty:
+            self._recomposite()
+        surface.blit(self.layer, (0, 0))
@@ -0,0 +1,171 @@
+"""
+One player's input for one frame, packed into a byte.
+
+Netplay sends these over the wire and Replay stores one per player per
+frame. Movement bits mirror the held keys. The attack/special bits are
+edges: the key went down during that frame.
+
+A press also has an offset: how far into the frame the key went down.
+pygame's events carry no timestamp, so InputQueue stamps them itself by
+draining the event queue every millisecond while the frame waits, instead
+of sleeping the whole wait in clock.tick(). Greg starts the press's timers
+and judges its parry at that point in match time rather than at the frame
+it was handled on. Offsets are kept as a byte fraction of the frame's dt
+(offset_byte / byte_offset), and live play uses the same rounded value a
+replay stores, so the two simulate identically. Netplay sends no offsets;
+its presses land on frame boundaries.
+
+    queue = InputQueue()
+    while running:
+        dt = queue.wait_frame(clock, 60)
+        for event in queue.take():
+            ...event.offset_ms...
+"""
+
+import time
+
+import pygame
+
+INPUT_UP = 1
+INPUT_DOWN = 2
+INPUT_LEFT = 4
+INPUT_RIGHT = 8
+INPUT_ATTACK = 16           # edge: SPACE for P1, L for P2
+INPUT_SPECIAL = 32          # edge: F for P1, K for P2
+MOVE_MASK = INPUT_UP | INPUT_DOWN | INPUT_LEFT | INPUT_RIGHT
+
+OFFSET_STEPS = 255          # an offset is stored as round(offset / dt * OFFSET_STEPS) in a byte
+PUMP_INTERVAL_S = 0.001     # how often InputQueue drains pygame's queue while a frame waits
+
+SIDE_KEYS = {
+    'blue': (pygame.K_w, pygame.K_s, pygame.K_a, pygame.K_d, pygame.K_SPACE, pygame.K_f),
+    'red': (pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_l, pygame.K_k),
+}
+
+
+def new_key_state():
+    """The held-key mapping Greg.update_game reads, covering both players' movement keys."""
+    return {key: False for keys in SIDE_KEYS.values() for key in keys[:4]}
+
+
+def read_local_input(side, keys, events):
+    up_key, down_key, left_key, right_key, attack_key, special_key = SIDE_KEYS[side]
+    value = 0
+    if keys[up_key]:
+        value |= INPUT_UP
+    if keys[down_key]:
+        value |= INPUT_DOWN
+    if keys[left_key]:
+        value |= INPUT_LEFT
+    if keys[right_key]:
+        value |= INPUT_RIGHT
+    for event in events:
+        if event.type == pygame.KEYDOWN:
+            if event.key == attack_key:
+                value |= INPUT_ATTACK
+            elif event.key == special_key:
+                value |= INPUT_SPECIAL
+    return value
+
+
+def press_offsets(side, events):
+    """(attack, special) offset_ms of `side`'s first press of each in `events`; 0.0 when unstamped."""
+    attack_key, special_key = SIDE_KEYS[side][4:]
+    attack = special = None
+    for event in events:
+        if event.type == pygame.KEYDOWN:
+            if event.key == attack_key and attack is None:
+                attack = getattr(event, 'offset_ms', 0.0)
+            elif event.key == special_key and special is None:
+                special = getattr(event, 'offset_ms', 0.0)
+    return attack or 0.0, special or 0.0
+
+
+def offset_byte(offset_ms, dt):
+    if dt <= 0:
+        return 0
+    return max(0, min(OFFSET_STEPS, round(offset_ms / dt * OFFSET_STEPS)))
+
+
+def byte_offset(value, dt):
+    return value * dt / OFFSET_STEPS
+
+
+def apply_input(game, keys, side, value, offsets=(0.0, 0.0)):
+    """
+    Sets `side`'s held keys in `keys` and fires its attack/special presses
+    into the Greg module `game`, each at its (attack, special) offset in ms.
+    """
+    up_key, down_key, left_key, right_key, attack_key, special_key = SIDE_KEYS[side]
+    keys[up_key] = bool(value & INPUT_UP)
+    keys[down_key] = bool(value & INPUT_DOWN)
+    keys[left_key] = bool(value & INPUT_LEFT)
+    keys[right_key] = bool(value & INPUT_RIGHT)
+    if value & INPUT_ATTACK:
+        game.handle_gameplay_keydown(attack_key, offsets[0])
+    if value & INPUT_SPECIAL:
+        game.handle_gameplay_keydown(special_key, offsets[1])
+
+
+class InputQueue:
+    """
+    Collects pygame events as they arrive, each stamped with
+    time.perf_counter(). wait_frame() stands in for clock.tick(fps) and
+    take() hands over the frame's events, KEYDOWNs with offset_ms set.
+    """
+
+    def __init__(self):
+        self.pending = []               # (arrival time, event)
+        self.frame_start = time.perf_counter()
+        self.frame_end = self.frame_start
+        self.dt = 0
+
+    def pump(self):
+        events = pygame.event.get()
+        if events:
+            now = time.perf_counter()
+            for event in events:
+                self.pending.append((now, event))
+
+    def wait_frame(self, clock, fps):
+        """Waits until 1/fps after the last frame, draining events as they come; returns dt in ms."""
+        deadline = self.frame_end + 1.0 / fps
+        self.pump()
+        while True:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                break
+            time.sleep(min(left, PUMP_INTERVAL_S))
+            self.pump()
+        self.dt = clock.tick()
+        self.frame_start, self.frame_end = self.frame_end, time.perf_counter()
+        return self.dt
+
+    def take(self):
+        """The events that arrived since the last take(), oldest first."""
+        self.pump()
+        pending, self.pending = self.pending, []
+        span = self.frame_end - self.frame_start
+        events = []
+        for arrived, event in pending:
+            if event.type == pygame.KEYDOWN:
+                fraction = (arrived - self.frame_start) / span if span > 0 else 1.0
+                # rounded to what a replay keeps, so a recording plays back the same
+                step = max(0, min(OFFSET_STEPS, round(fraction * OFFSET_STEPS)))
+                event.offset_ms = byte_offset(step, self.dt)
+            events.append(event)
+        return events
+
+
+def scripted_input(rng, state):
+    """Random-but-plausible inputs for headless runs: wander, slash and parry now and then."""
+    value = state.get('move', 0)
+    if rng.random() < 0.05:
+        value = rng.choice((0, INPUT_UP, INPUT_DOWN, INPUT_LEFT, INPUT_RIGHT,
+                            INPUT_UP | INPUT_LEFT, INPUT_DOWN | INPUT_RIGHT))
+        state['move'] = value
+    if rng.random() < 0.03:
+        value |= INPUT_ATTACK
+    if rng.random() < 0.03:
+        value |= INPUT_SPECIAL
+    return value
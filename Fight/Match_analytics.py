@@ -0,0 +1,239 @@
+"""
+Streaming analytics over Cube Combat combat logs.
+
+Reads JSONL or binary logs written by Combat_log one event at a time, so
+memory stays flat however many matches a file holds. Files are spread
+across worker processes and each worker returns small per-(cube, mode)
+totals that are merged at the end.
+
+    python Match_analytics.py logs/ --out summary/ --workers 8
+
+Writes three CSV tables into --out:
+    cube_summary.csv   hit rates, parry rate, time-to-kill, damage per cube and mode
+    damage_curve.csv   average damage dealt per DAMAGE_BUCKET_MS of match time
+    ai_modes.csv       share of match time the AI spends in each red_cube_mode
+"""
+
+import argparse
+import csv
+import glob
+import os
+import time
+from multiprocessing import Pool
+
+import Combat_log
+
+DAMAGE_BUCKET_MS = 5000
+MAX_DAMAGE_BUCKETS = 36     # three minutes; later damage lands in the last bucket
+
+COUNTERS = (
+    'matches', 'wins', 'losses',
+    'slash_attempts', 'slash_hits',
+    'beam_attempts', 'beam_hits',
+    'charge_attempts', 'charge_hits',
+    'parry_attempts', 'parry_successes',
+    'damage_dealt', 'damage_taken',
+    'ttk_total_ms', 'ttk_count',
+)
+
+
+def _new_totals():
+    return {
+        'counters': dict.fromkeys(COUNTERS, 0),
+        'damage_curve': [0] * MAX_DAMAGE_BUCKETS,
+    }
+
+
+def _totals_for(aggregates, cube_id, mode):
+    key = (cube_id, mode)
+    totals = aggregates['cubes'].get(key)
+    if totals is None:
+        totals = aggregates['cubes'][key] = _new_totals()
+    return totals
+
+
+def _close_ai_mode(aggregates, match, until):
+    """Credits the time since the last ai_mode change to that mode."""
+    if match['mode'] == 'ai' and match['ai_mode'] is not None:
+        spent = aggregates['ai_modes']
+        spent[match['ai_mode']] = spent.get(match['ai_mode'], 0.0) + max(0.0, until - match['ai_mode_since'])
+
+
+def _end_match(aggregates, match):
+    if match is not None:
+        _close_ai_mode(aggregates, match, match['last_time'])
+
+
+def analyze_file(path):
+    """Streams one log file and returns its aggregates. Runs inside a worker process."""
+    aggregates = {'cubes': {}, 'ai_modes': {}, 'events': 0, 'files': 1}
+    match = None
+
+    try:
+        events = Combat_log.read_log(path)
+        for event in events:
+            aggregates['events'] += 1
+            name = event['event']
+            t = event['t']
+
+            if name == 'match_start':
+                _end_match(aggregates, match)
+                match = {
+                    'mode': event['mode'],
+                    'cubes': {'blue': event['blue_cube'], 'red': event['red_cube']},
+                    'ai_mode': None,
+                    'ai_mode_since': 0.0,
+                    'last_time': t,
+                }
+                for side in ('blue', 'red'):
+                    _totals_for(aggregates, match['cubes'][side], match['mode'])['counters']['matches'] += 1
+                continue
+
+            if match is None:
+                continue    # events from before the first match_start have no cube to belong to
+            match['last_time'] = t
+
+            actor = event['actor']
+            if actor not in ('blue', 'red'):
+                continue
+            other = 'red' if actor == 'blue' else 'blue'
+            mine = _totals_for(aggregates, match['cubes'][actor], match['mode'])
+            theirs = _totals_for(aggregates, match['cubes'][other], match['mode'])
+            counters = mine['counters']
+            damage = event['value']
+
+            if name in ('slash', 'beam', 'charge_hit'):
+                stat = 'charge' if name == 'charge_hit' else name
+                if name != 'charge_hit':
+                    counters[stat + '_attempts'] += 1
+                if event['flag']:
+                    counters[stat + '_hits'] += 1
+                    counters['damage_dealt'] += damage
+                    theirs['counters']['damage_taken'] += damage
+                    bucket = min(int(t // DAMAGE_BUCKET_MS), MAX_DAMAGE_BUCKETS - 1)
+                    mine['damage_curve'][bucket] += damage
+            elif name == 'charge_start':
+                counters['charge_attempts'] += 1
+            elif name == 'boundary_hit':
+                counters['damage_taken'] += damage
+            elif name == 'parry':
+                counters['parry_attempts'] += 1
+                if event['flag']:
+                    counters['parry_successes'] += 1
+            elif name == 'match_end':
+                counters['wins'] += 1
+                counters['ttk_total_ms'] += t
+                counters['ttk_count'] += 1
+                theirs['counters']['losses'] += 1
+            elif name == 'ai_mode':
+                _close_ai_mode(aggregates, match, t)
+                match['ai_mode'] = event['ai_mode']
+                match['ai_mode_since'] = t
+
+        _end_match(aggregates, match)
+    except (IOError, ValueError, KeyError) as e:
+        print(f"Error reading combat log {path}: {e}")
+
+    return aggregates
+
+
+def merge(into, other):
+    into['events'] += other['events']
+    into['files'] += other['files']
+    for key, totals in other['cubes'].items():
+        target = into['cubes'].get(key)
+        if target is None:
+            into['cubes'][key] = totals
+            continue
+        for name, value in totals['counters'].items():
+            target['counters'][name] += value
+        for i, value in enumerate(totals['damage_curve']):
+            target['damage_curve'][i] += value
+    for mode, spent in other['ai_modes'].items():
+        into['ai_modes'][mode] = into['ai_modes'].get(mode, 0.0) + spent
+    return into
+
+
+def _rate(hits, attempts):
+    return round(hits / attempts, 4) if attempts else ''
+
+
+def write_tables(aggregates, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    rows = sorted(aggregates['cubes'].items(), key=lambda item: (item[0][0], str(item[0][1])))
+
+    with open(os.path.join(out_dir, 'cube_summary.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cube_id', 'mode', 'matches', 'wins', 'losses',
+                         'slash_hit_rate', 'beam_hit_rate', 'charge_hit_rate', 'parry_success_rate',
+                         'avg_time_to_kill_s', 'damage_dealt', 'damage_taken'])
+        for (cube_id, mode), totals in rows:
+            c = totals['counters']
+            writer.writerow([
+                cube_id, mode, c['matches'], c['wins'], c['losses'],
+                _rate(c['slash_hits'], c['slash_attempts']),
+                _rate(c['beam_hits'], c['beam_attempts']),
+                _rate(c['charge_hits'], c['charge_attempts']),
+                _rate(c['parry_successes'], c['parry_attempts']),
+                round(c['ttk_total_ms'] / c['ttk_count'] / 1000, 2) if c['ttk_count'] else '',
+                c['damage_dealt'], c['damage_taken'],
+            ])
+
+    with open(os.path.join(out_dir, 'damage_curve.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cube_id', 'mode'] + [f"{i * DAMAGE_BUCKET_MS // 1000}s" for i in range(MAX_DAMAGE_BUCKETS)])
+        for (cube_id, mode), totals in rows:
+            matches = totals['counters']['matches'] or 1
+            writer.writerow([cube_id, mode] + [round(value / matches, 3) for value in totals['damage_curve']])
+
+    total_ai_time = sum(aggregates['ai_modes'].values()) or 1.0
+    with open(os.path.join(out_dir, 'ai_modes.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['red_cube_mode', 'seconds', 'share'])
+        for mode in Combat_log.AI_MODES:
+            spent = aggregates['ai_modes'].get(mode, 0.0)
+            writer.writerow([mode, round(spent / 1000, 2), round(spent / total_ai_time, 4)])
+
+
+def find_logs(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in ('*.jsonl', '*.cclog', '*.bin'):
+                files.extend(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def analyze(paths, workers=None):
+    files = find_logs(paths)
+    result = {'cubes': {}, 'ai_modes': {}, 'events': 0, 'files': 0}
+    if not files:
+        return result
+    if workers == 1 or len(files) == 1:
+        for path in files:
+            merge(result, analyze_file(path))
+        return result
+    with Pool(workers) as pool:
+        for partial in pool.imap_unordered(analyze_file, files, chunksize=4):
+            merge(result, partial)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate Cube Combat combat logs")
+    parser.add_argument('paths', nargs='+', help="log files, globs or directories")
+    parser.add_argument('--out', default='analytics_out', help="directory for the CSV tables")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    aggregates = analyze(args.paths, args.workers)
+    write_tables(aggregates, args.out)
+    elapsed = time.perf_counter() - start
+    print(f"{aggregates['files']} files, {aggregates['events']} events in {elapsed:.1f}s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Per-cube match records for Cube Combat.
+
+Listens to Combat_log for match start, damage and match end events, and
+keeps running totals for each (cube, mode, opponent) and each (cube, mode)
+in memory. The numbers on the collected-cubes panel are therefore dict
+lookups, and nothing rescans old matches. Every finished match is also
+handed to Save_store.record_match(), which appends it to the match history
+and bumps the stored aggregates in one batched transaction. Leaderboards and
+history are served from indexed SQL on those tables.
+
+    python Match_records.py leaderboard [--mode ai]
+    python Match_records.py history 3
+"""
+
+import argparse
+import os
+import sys
+
+import Combat_log
+import Save_store
+
+MODE_ALL = Save_store.MODE_ALL
+RECORD_COLUMNS = Save_store.RECORD_COLUMNS
+_INDEX = {name: i for i, name in enumerate(RECORD_COLUMNS)}
+
+_store = None
+_records = {}       # (cube_id, mode, opponent) -> [matches, wins, losses, total_ms, damage_dealt, damage_taken]
+_totals = {}        # (cube_id, mode) -> same, with MODE_ALL summing every mode
+_match = None       # the match in progress: mode, cube ids and damage dealt and taken so far
+
+
+def _new_row():
+    return [0] * len(RECORD_COLUMNS)
+
+
+def _add(table, key, row):
+    target = table.get(key)
+    if target is None:
+        target = table[key] = _new_row()
+    for i, value in enumerate(row):
+        target[i] += value
+
+
+def _apply(cube_id, mode, opponent, row):
+    _add(_records, (cube_id, mode, opponent), row)
+    _add(_totals, (cube_id, mode), row)
+    _add(_totals, (cube_id, MODE_ALL), row)
+
+
+def _on_event(kind, time, actor, flag, value, extra):
+    global _match
+    if kind == Combat_log.EVENT_MATCH_START:
+        blue, red = divmod(int(extra), 1000)
+        _match = {'mode': Combat_log.MATCH_MODES[value], 'blue': blue, 'red': red, 'dealt': [0, 0, 0], 'taken': [0, 0, 0]}
+        return
+    if _match is None:
+        return
+
+    if kind == Combat_log.EVENT_MATCH_END:
+        finish(Combat_log.ACTOR_NAMES[actor], time)
+    elif not flag or actor == Combat_log.ACTOR_NONE:
+        return
+    elif kind == Combat_log.EVENT_BOUNDARY_HIT:
+        # the cube ran into the wall: damage it took that nobody dealt
+        _match['taken'][actor] += value
+    else:
+        _match['dealt'][actor] += value
+        _match['taken'][Combat_log.ACTOR_RED if actor == Combat_log.ACTOR_BLUE else Combat_log.ACTOR_BLUE] += value
+
+
+def finish(winner, duration_ms):
+    """Closes the match in progress; winner is 'blue', 'red' or None."""
+    global _match
+    match = _match
+    _match = None
+    if match is None or match['mode'] is None:
+        return
+
+    mode, blue, red = match['mode'], match['blue'], match['red']
+    blue_damage, red_damage = match['dealt'][Combat_log.ACTOR_BLUE], match['dealt'][Combat_log.ACTOR_RED]
+    blue_taken, red_taken = match['taken'][Combat_log.ACTOR_BLUE], match['taken'][Combat_log.ACTOR_RED]
+    for side, cube, opponent, dealt, taken in (('blue', blue, red, blue_damage, blue_taken),
+                                               ('red', red, blue, red_damage, red_taken)):
+        won = winner == side
+        lost = winner is not None and not won
+        _apply(cube, mode, opponent, (1, int(won), int(lost), duration_ms, dealt, taken))
+
+    if _store is not None:
+        _store.record_match(mode, blue, red, winner, duration_ms, blue_damage, red_damage, blue_taken, red_taken)
+
+
+def cube_record(cube_id, mode=MODE_ALL, opponent=None):
+    """Totals for a cube as a dict, optionally narrowed to one mode and opponent."""
+    if opponent is None:
+        row = _totals.get((cube_id, mode))
+    else:
+        row = _records.get((cube_id, mode, opponent))
+    record = dict(zip(RECORD_COLUMNS, row or _new_row()))
+    record['avg_match_ms'] = record['total_ms'] / record['matches'] if record['matches'] else 0.0
+    return record
+
+
+def leaderboard(mode=MODE_ALL, limit=10):
+    return _store.leaderboard(mode, limit) if _store is not None else []
+
+
+def history(cube_id, limit=20):
+    return _store.match_history(cube_id, limit) if _store is not None else []
+
+
+def start(store):
+    """Loads the stored aggregates and starts recording matches into `store`."""
+    global _store, _match
+    _store = store
+    _match = None
+    _records.clear()
+    _totals.clear()
+    for row in store.load_cube_records():
+        _apply(row['cube_id'], row['mode'], row['opponent'], [row[name] for name in RECORD_COLUMNS])
+
+    kinds = (Combat_log.EVENT_MATCH_START, Combat_log.EVENT_MATCH_END,
+             Combat_log.EVENT_SLASH, Combat_log.EVENT_BEAM, Combat_log.EVENT_CHARGE_HIT, Combat_log.EVENT_BOUNDARY_HIT)
+    Combat_log.unsubscribe(_on_event)
+    Combat_log.subscribe(_on_event, kinds=kinds, sync=True)
+
+
+def stop():
+    global _store
+    Combat_log.unsubscribe(_on_event)
+    _store = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat match records")
+    sub = parser.add_subparsers(dest='command', required=True)
+    board = sub.add_parser('leaderboard', help="cubes ranked by wins")
+    board.add_argument('--mode', default=MODE_ALL, help="ai, pvp or * for all (default)")
+    board.add_argument('--limit', type=int, default=10)
+    past = sub.add_parser('history', help="recent matches for one cube")
+    past.add_argument('cube_id', type=int)
+    past.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Save_file", "profile.db"))
+    args = parser.parse_args()
+
+    store = Save_store.SaveStore(args.db)
+    if args.command == 'leaderboard':
+        rows = store.leaderboard(args.mode, args.limit)
+        print(f"{'cube':>4} {'matches':>7} {'wins':>5} {'losses':>6} {'avg s':>6} {'dealt':>6}")
+        for row in rows:
+            avg = row['total_ms'] / row['matches'] / 1000 if row['matches'] else 0.0
+            print(f"{row['cube_id']:>4} {row['matches']:>7} {row['wins']:>5} {row['losses']:>6} "
+                  f"{avg:>6.1f} {row['damage_dealt']:>6}")
+    else:
+        for row in store.match_history(args.cube_id, args.limit):
+            print(f"#{row['id']} {row['mode']:<3} blue {row['blue_cube']} vs red {row['red_cube']}: "
+                  f"{row['winner'] or 'no result'} in {row['duration_ms'] / 1000:.1f}s "
+                  f"({row['blue_damage']}-{row['red_damage']} damage)")
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,545 @@
+"""
+Online PvP for Cube Combat over UDP, with input delay plus rollback.
+
+Both peers run the same fixed-step simulation (Greg.update_game at 60 Hz).
+Only inputs go over the wire. Local inputs are scheduled INPUT_DELAY frames
+ahead. The remote player's inputs are predicted until they arrive. When a
+prediction turns out wrong, the match is rewound to the saved state for
+that frame and re-simulated with the real inputs, so parry flash frames
+line up exactly on both screens.
+
+    python Netplay.py --side blue --port 7000 --peer 127.0.0.1:7001
+    python Netplay.py --side red  --port 7001 --peer 127.0.0.1:7000
+
+The host plays P1 (WASD, SPACE slash, F parry) and the guest plays P2
+(arrows, L beam, K charge). --loss and --latency simulate a bad network.
+
+    python Netplay.py --selftest --loss 0.2 --latency 40
+
+runs two headless peers over 127.0.0.1 with scripted inputs and checks that
+both finish on the same game state. It also replays a match with remote
+inputs arriving late and checks that the combat log matches a run without
+rollbacks.
+
+Combat events from a frame are held back until every input for that frame
+has arrived. A rollback re-simulates the frame and replaces its events,
+so achievements, records, audio and particles only ever see what really
+happened, a few frames late at worst.
+"""
+
+import os
+import sys
+
+if "--headless" in sys.argv or "--selftest" in sys.argv:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import random
+import socket
+import struct
+import subprocess
+import time
+import zlib
+
+import pygame
+
+import Achievements
+import Combat_log
+import Greg
+from Inputs import INPUT_ATTACK, INPUT_LEFT, MOVE_MASK, new_key_state, apply_input, read_local_input, scripted_input
+import Match_records
+import Snapshot
+
+FRAME_MS = 1000 / 60
+INPUT_DELAY = 2
+MAX_ROLLBACK = 8
+SNAPSHOT_RING = 16          # must be larger than MAX_ROLLBACK + INPUT_DELAY
+INPUT_WINDOW = 64           # inputs resent per packet, covers dropped packets
+LINGER_S = 1.0
+
+PACKET_MAGIC = 0xCB07
+PACKET_HEADER = struct.Struct('!HiiibB')  # magic, sender frame, ack, first input frame, advantage, count
+
+
+_checksum_buffer = bytearray(Snapshot.STATE_SIZE)
+
+
+def state_checksum():
+    """CRC of the packed game state, identical on both peers when they are in sync."""
+    Snapshot.capture(_checksum_buffer)
+    return zlib.crc32(_checksum_buffer)
+
+
+class RollbackSession:
+    """Keeps both players' input streams and the snapshot ring for one networked match."""
+
+    def __init__(self, side, sock, peer, input_delay=INPUT_DELAY, max_rollback=MAX_ROLLBACK,
+                 loss=0.0, latency_ms=0, seed=None):
+        self.side = side
+        self.remote_side = 'red' if side == 'blue' else 'blue'
+        self.sock = sock
+        self.peer = peer
+        self.input_delay = input_delay
+        self.max_rollback = max_rollback
+
+        self.loss = loss
+        self.latency_s = latency_ms / 1000
+        self.net_rng = random.Random(seed)
+        self.outbox = []
+
+        self.frame = 0                  # next frame to simulate
+        self.local_inputs = {f: 0 for f in range(input_delay)}
+        self.remote_inputs = {}
+        self.used_remote = {}           # what was fed to the simulation for each remote frame
+        self.confirmed_remote = -1      # highest frame with every remote input received
+        self.remote_ack = -1            # highest frame of ours the peer has confirmed
+        self.remote_frame = 0
+        self.remote_advantage = 0
+        self.first_mismatch = None
+        self.snapshots = Snapshot.SnapshotRing(SNAPSHOT_RING)
+        self.frame_events = {}          # frame -> combat events it emitted, held until it is confirmed
+        self.published = 0              # next frame whose events go to Combat_log
+
+        self.keys = new_key_state()
+
+        self.rollbacks = 0
+        self.resim_frames = 0
+        self.last_rollback_depth = 0
+        self.stalls = 0
+
+    @property
+    def frame_advantage(self):
+        return self.frame - self.remote_frame
+
+    # network
+
+    def send(self):
+        first = self.remote_ack + 1
+        last = min(self.frame + self.input_delay - 1, first + INPUT_WINDOW - 1)
+        inputs = bytes(self.local_inputs.get(f, 0) for f in range(first, last + 1))
+        advantage = max(-128, min(127, self.frame_advantage))
+        packet = PACKET_HEADER.pack(PACKET_MAGIC, self.frame, self.confirmed_remote, first, advantage, len(inputs)) + inputs
+
+        if self.net_rng.random() < self.loss:
+            return
+        self.outbox.append((time.perf_counter() + self.latency_s, packet))
+        self.flush_outbox()
+
+    def flush_outbox(self):
+        now = time.perf_counter()
+        while self.outbox and self.outbox[0][0] <= now:
+            _, packet = self.outbox.pop(0)
+            try:
+                self.sock.sendto(packet, self.peer)
+            except OSError:
+                pass
+
+    def poll(self):
+        self.flush_outbox()
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(2048)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            if len(data) < PACKET_HEADER.size:
+                continue
+            magic, frame, ack, first, advantage, count = PACKET_HEADER.unpack_from(data)
+            if magic != PACKET_MAGIC:
+                continue
+
+            self.remote_frame = max(self.remote_frame, frame)
+            self.remote_advantage = advantage
+            self.remote_ack = max(self.remote_ack, ack)
+
+            inputs = data[PACKET_HEADER.size:PACKET_HEADER.size + count]
+            for offset, value in enumerate(inputs):
+                self.receive_input(first + offset, value)
+
+    def receive_input(self, f, value):
+        """Takes the remote player's input for frame f, marking a rollback if it was mispredicted."""
+        if f <= self.confirmed_remote or f in self.remote_inputs:
+            return
+        self.remote_inputs[f] = value
+        if f < self.frame and self.used_remote.get(f) != value:
+            if self.first_mismatch is None or f < self.first_mismatch:
+                self.first_mismatch = f
+
+        while self.confirmed_remote + 1 in self.remote_inputs:
+            self.confirmed_remote += 1
+
+    # simulation
+
+    def remote_input(self, f):
+        """Real input if it arrived, otherwise the last known movement with no new presses."""
+        value = self.remote_inputs.get(f)
+        if value is None:
+            value = self.remote_inputs.get(self.confirmed_remote, 0) & MOVE_MASK
+        self.used_remote[f] = value
+        return value
+
+    def simulate(self, f):
+        self.snapshots.save(f)
+        inputs = {self.side: self.local_inputs.get(f, 0), self.remote_side: self.remote_input(f)}
+        # a re-simulated frame's events replace the ones from its mispredicted run
+        events = self.frame_events[f] = []
+        Combat_log.capture = events
+        try:
+            # always blue then red, so both peers resolve same-frame presses in the same order;
+            # only the input byte goes over the wire, so presses land at the start of their frame
+            apply_input(Greg, self.keys, 'blue', inputs['blue'])
+            apply_input(Greg, self.keys, 'red', inputs['red'])
+            if not Greg.game_state['game_over']:
+                Greg.update_game(FRAME_MS, self.keys)
+        finally:
+            Combat_log.capture = None
+
+    def publish_confirmed(self):
+        """Hands Combat_log the events of every simulated frame that can no longer be rolled back."""
+        while self.published < self.frame and self.published <= self.confirmed_remote:
+            for event in self.frame_events.pop(self.published, ()):
+                Combat_log.publish(*event)
+            self.published += 1
+
+    def rollback(self):
+        if self.first_mismatch is None:
+            return
+        start = self.first_mismatch
+        self.first_mismatch = None
+
+        self.snapshots.load(start)
+        for f in range(start, self.frame):
+            self.simulate(f)
+
+        self.rollbacks += 1
+        self.last_rollback_depth = self.frame - start
+        self.resim_frames += self.frame - start
+
+    def can_advance(self):
+        if self.frame - self.confirmed_remote > self.max_rollback:
+            return False
+        # GGPO-style time sync: the peer that is running ahead gives up a frame
+        if self.frame_advantage - self.remote_advantage >= 2 and self.frame % 4 == 0:
+            return False
+        return True
+
+    def tick(self, local_input, target_frame=None):
+        """One loop iteration: receive, rewind if needed, maybe advance a frame, send. Returns True if it advanced."""
+        self.poll()
+        self.rollback()
+
+        advanced = False
+        if target_frame is None or self.frame < target_frame:
+            if self.can_advance():
+                self.local_inputs[self.frame + self.input_delay] = local_input
+                self.simulate(self.frame)
+                self.frame += 1
+                advanced = True
+            else:
+                self.stalls += 1
+        self.publish_confirmed()
+
+        if self.frame % 60 == 0:
+            self.prune()
+
+        self.send()
+        return advanced
+
+    def prune(self):
+        """Drops inputs that can no longer be resent or rolled back to."""
+        oldest = min(self.frame - SNAPSHOT_RING, self.confirmed_remote, self.remote_ack) - 1
+        for inputs in (self.local_inputs, self.remote_inputs, self.used_remote):
+            for f in [f for f in inputs if f < oldest]:
+                del inputs[f]
+
+    def finished(self, target_frame):
+        return (self.frame >= target_frame and self.confirmed_remote >= target_frame - 1
+                and self.remote_ack >= target_frame - 1 and self.first_mismatch is None)
+
+
+def draw_net_stats(session):
+    lines = (
+        f"Rollbacks: {session.rollbacks} (last {session.last_rollback_depth}f)",
+        f"Frame adv: {session.frame_advantage:+d}  Delay: {session.input_delay}f",
+        f"Stalls: {session.stalls}",
+    )
+    for i, line in enumerate(lines):
+        Greg.draw_text(line, 22, Greg.BLACK, Greg.WIDTH // 2, 15 + i * 18)
+
+
+def start_match(side, port, peer, args):
+    Greg.open_save_store()
+    Greg.selected_mode = 'pvp'
+    Greg.is_debug_mode = False
+    Greg.autosave_stats = False
+    if not args.headless:
+        # scripted headless runs stay out of the player's records
+        Achievements.start(Greg.all_achievements_data,
+                           Achievements.default_rules(Greg.ENDLAG_DURATION_MS * 2, Greg.INITIAL_BLUE_HEALTH, Greg.DEV_CUBE_ID),
+                           Greg.save_achievement)
+        Match_records.start(Greg.save_store)
+    Greg.start_match()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('0.0.0.0', port))
+    sock.setblocking(False)
+
+    return RollbackSession(side, sock, peer, input_delay=args.delay, max_rollback=args.max_rollback,
+                           loss=args.loss, latency_ms=args.latency, seed=args.seed)
+
+
+def run_window(session):
+    pygame.display.set_caption(f"Cube Combat - Online ({session.side})")
+    clock = pygame.time.Clock()
+    stats_saved = False
+    running = True
+
+    while running:
+        clock.tick(60)
+
+        events = pygame.event.get()
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                running = False
+
+        local_input = read_local_input(session.side, pygame.key.get_pressed(), events)
+        session.tick(local_input)
+
+        state = Greg.game_state
+        if state['game_over'] and session.confirmed_remote >= session.frame - 1 and not stats_saved:
+            Greg.save_stats(Greg.cube_stats)
+            stats_saved = True
+
+        Greg.draw_game()
+        draw_net_stats(session)
+        if state['game_over']:
+            winner = "Red Cube" if state['blue_health'] <= 0 else "Blue Cube"
+            Greg.draw_text(f"{winner} Wins! Press ESC to leave", 36, Greg.BLACK, Greg.WIDTH // 2, Greg.HEIGHT // 2)
+        pygame.display.flip()
+
+    session.sock.close()
+
+
+def run_headless(session, frames, fps):
+    script_rng = random.Random(f"{session.side}-{session.net_rng.random()}")
+    script_state = {}
+    frame_s = 1 / fps if fps else 0
+    next_tick = time.perf_counter()
+
+    while not session.finished(frames):
+        advanced = session.tick(scripted_input(script_rng, script_state), target_frame=frames)
+        if frame_s:
+            next_tick += frame_s
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        elif not advanced:
+            time.sleep(0.0005)
+
+    # keep answering so the peer also learns that we have all of its inputs
+    linger_end = time.perf_counter() + LINGER_S
+    while time.perf_counter() < linger_end:
+        session.tick(0, target_frame=frames)
+        time.sleep(0.005)
+
+    print(f"RESULT {session.side} frame={session.frame} checksum={state_checksum():08x} "
+          f"rollbacks={session.rollbacks} resim={session.resim_frames} stalls={session.stalls}", flush=True)
+    session.sock.close()
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class _NullSocket:
+    """Stands in for the UDP socket when a test hands a session its remote inputs directly."""
+
+    def sendto(self, packet, peer):
+        pass
+
+    def recvfrom(self, size):
+        raise BlockingIOError
+
+
+HIT_EVENTS = (Combat_log.EVENT_SLASH, Combat_log.EVENT_BEAM, Combat_log.EVENT_CHARGE_HIT)
+
+
+def _hits(events):
+    return [event for event in events if event[0] in HIT_EVENTS and event[3]]
+
+
+class _CheckedSession(RollbackSession):
+    """Counts re-simulated frames whose hits came out differently from the mispredicted run."""
+
+    changed_hits = 0
+
+    def simulate(self, f):
+        before = self.frame_events.get(f)
+        super().simulate(f)
+        if before is not None and _hits(before) != _hits(self.frame_events[f]):
+            self.changed_hits += 1
+
+
+def _log_run(blue, red, lag, setup=None):
+    """
+    Plays the given per-frame inputs twice from the same state, straight
+    through and through a session that gets P2's inputs `lag` frames late.
+    Returns (events straight, events through rollback, session).
+    """
+    events = []
+
+    def record(*event):
+        events.append(event)
+
+    Greg.selected_mode = 'pvp'
+    Greg.is_debug_mode = False
+    Greg.autosave_stats = False
+    Combat_log.subscribe(record, sync=True)
+    try:
+        Greg.start_match(0)
+        if setup is not None:
+            setup(Greg.game_state)
+        # both runs start from exactly this state; start_match leaves a few fields from the last match
+        start = bytearray(Snapshot.snapshot_size(include_rng=True))
+        Snapshot.capture(start, include_rng=True)
+        events.clear()
+
+        keys = new_key_state()
+        for f in range(len(blue)):
+            apply_input(Greg, keys, 'blue', blue[f])
+            apply_input(Greg, keys, 'red', red[f])
+            if not Greg.game_state['game_over']:
+                Greg.update_game(FRAME_MS, keys)
+        expected = list(events)
+        events.clear()
+
+        Snapshot.restore(start, include_rng=True)
+        session = _CheckedSession('blue', _NullSocket(), None, input_delay=0)
+        while session.frame < len(blue):
+            for f in range(session.confirmed_remote + 1, session.frame - lag + 1):
+                session.receive_input(f, red[f])
+            session.remote_frame = session.frame
+            session.tick(blue[session.frame])
+        for f in range(session.confirmed_remote + 1, len(red)):
+            session.receive_input(f, red[f])
+        session.rollback()
+        session.publish_confirmed()
+    finally:
+        Combat_log.unsubscribe(record)
+    return expected, events, session
+
+
+def _report_log(name, expected, events, session):
+    print(f"LOG {name}: {len(expected)} events straight, {len(events)} through rollback "
+          f"({session.rollbacks} rollbacks, {session.changed_hits} frames with corrected hits)")
+    if events == expected:
+        return True
+    for i, (got, want) in enumerate(zip(events, expected)):
+        if got != want:
+            print(f"  first difference at event {i}: {got} != {want}")
+            break
+    return False
+
+
+def log_selftest(frames=1800, lag=6, seed=7):
+    """
+    Checks that rollbacks leave the combat log as if every input had been
+    on time. P2 first steps into P1's slash with inputs that arrive `lag`
+    frames late, so the slash misses on the predicted inputs and hits once
+    they arrive. Then a whole scripted match is played with the same lag.
+    """
+    speed = Greg.MOVE_SPEED
+    blue_x, blue_y = 100, 200
+
+    def step_in(state):
+        # P1 faces P2, whose left edge is 2.5 steps past the slash hitbox
+        state['blue_x'], state['blue_y'] = blue_x, blue_y
+        state['last_direction'] = 'right'
+        state['red_x'], state['red_y'] = blue_x + 2 * Greg.CUBE_SIZE + 2.5 * speed, blue_y
+
+    steps = 3
+    blue = [0] * steps + [INPUT_ATTACK] + [0] * (lag + 4)
+    red = [INPUT_LEFT] * steps + [0] * (len(blue) - steps)
+    expected, events, session = _log_run(blue, red, lag, step_in)
+    ok = _report_log("late step into a slash", expected, events, session)
+    if ok and session.changed_hits == 0:
+        print("  the late input never changed a hit")
+        ok = False
+
+    rng = random.Random(seed)
+    blue_state, red_state = {}, {}
+    blue = [scripted_input(rng, blue_state) for _ in range(frames)]
+    red = [scripted_input(rng, red_state) for _ in range(frames)]
+    return _report_log("scripted match", *_log_run(blue, red, lag)) and ok
+
+
+def selftest(args):
+    """Runs two headless peers over loopback and checks they end on the same state."""
+    ports = (_free_udp_port(), _free_udp_port())
+    procs = []
+    for side, port, peer_port, seed in (('blue', ports[0], ports[1], 1), ('red', ports[1], ports[0], 2)):
+        cmd = [sys.executable, os.path.abspath(__file__), '--headless',
+               '--side', side, '--port', str(port), '--peer', f'127.0.0.1:{peer_port}',
+               '--frames', str(args.frames), '--fps', str(args.fps),
+               '--loss', str(args.loss), '--latency', str(args.latency),
+               '--delay', str(args.delay), '--max-rollback', str(args.max_rollback), '--seed', str(seed)]
+        procs.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True))
+
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate(timeout=max(60, args.frames / 10))
+        result = [line for line in out.splitlines() if line.startswith("RESULT")]
+        results.append(result[-1] if result else f"no result (exit {proc.returncode})")
+
+    for line in results:
+        print(line)
+    checksums = [line.split("checksum=")[1].split()[0] if "checksum=" in line else None for line in results]
+    if checksums[0] is None or checksums[0] != checksums[1]:
+        print("SELFTEST FAIL: peers desynced")
+        return 1
+    if not log_selftest():
+        print("SELFTEST FAIL: the combat log after rollbacks differs from the corrected run")
+        return 1
+    print("SELFTEST PASS")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat online PvP with rollback")
+    parser.add_argument('--side', choices=('blue', 'red'), default='blue')
+    parser.add_argument('--port', type=int, default=7000)
+    parser.add_argument('--peer', default='127.0.0.1:7001', help="host:port of the other player")
+    parser.add_argument('--delay', type=int, default=INPUT_DELAY, help="input delay in frames")
+    parser.add_argument('--max-rollback', type=int, default=MAX_ROLLBACK)
+    parser.add_argument('--loss', type=float, default=0.0, help="simulated outgoing packet loss (0-1)")
+    parser.add_argument('--latency', type=int, default=0, help="simulated one-way latency in ms")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--headless', action='store_true', help="scripted inputs, no window")
+    parser.add_argument('--frames', type=int, default=1800, help="match length for --headless/--selftest")
+    parser.add_argument('--fps', type=int, default=0, help="pace headless runs, 0 = as fast as possible")
+    parser.add_argument('--selftest', action='store_true')
+    args = parser.parse_args()
+
+    if args.delay + args.max_rollback >= SNAPSHOT_RING:
+        parser.error(f"--delay + --max-rollback must stay below {SNAPSHOT_RING}")
+
+    if args.selftest:
+        sys.exit(selftest(args))
+
+    host, peer_port = args.peer.rsplit(':', 1)
+    session = start_match(args.side, args.port, (host, int(peer_port)), args)
+
+    if args.headless:
+        run_headless(session, args.frames, args.fps)
+    else:
+        run_window(session)
+        Achievements.stop()
+        Match_records.stop()
+    Greg.save_store.close()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""
+Particles and hit effects for Cube Combat.
+
+Slash hits, beam hits, parries, charge hits, boundary damage and KOs
+throw out bursts of small square sparks. Every particle lives in one set
+of preallocated NumPy arrays (position, velocity, remaining and total
+life, gravity and sprite), MAX_PARTICLES long. A frame updates all of
+them in a handful of vectorized operations, with no per-particle Python.
+
+Bursts are spawned from Combat_log events. start() subscribes a sync
+subscriber, so the sparks appear on the same frame as the hit. The events
+only say who was hit, so Greg passes a locate(actor) function that gives
+a cube's centre in arena pixels:
+
+    particles = create()                    # None without numpy, or with CUBE_PARTICLES=0
+    particles.start(locate)
+    ...
+    particles.update(dt)                    # dt in ms
+    dirty = particles.draw(screen, camera_x, camera_y)
+
+Sprites are pooled. Each (color, size) an effect uses is pre-rendered
+once at FADE_LEVELS sizes, and a particle shrinks through them as it
+dies. A frame is then one Surface.blits() call (or, with a GPU renderer,
+one texture copy per particle through Render_backend.draw_surfaces()).
+
+The cap is hard. Particles are stored as a ring, so a burst that doesn't
+fit takes the slots of the oldest particles. Past SOFT_CAP_SHARE of the
+cap, new bursts are thinned, except for KOs. Each frame's update and
+draw time is also measured. While it runs over FRAME_BUDGET_MS, `quality`
+drops, bursts get smaller, and at low quality only every other particle
+is drawn. It recovers once frames are cheap again.
+
+Effects are cosmetic. They draw from their own random generator and never
+touch the game state, so replays and netplay are unaffected.
+
+    python Particles.py bench --particles 4000
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import pygame
+
+import Combat_log
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_PARTICLES = 4096
+SOFT_CAP_SHARE = 0.75       # past this share of the cap, bursts other than KOs are thinned
+FRAME_BUDGET_MS = 3.0       # update + draw time above which quality drops
+MIN_QUALITY = 0.15
+QUALITY_DECAY = 0.8         # quality multiplier for each frame over budget
+QUALITY_RECOVERY = 0.02     # quality regained for each frame within budget
+THIN_DRAW_QUALITY = 0.5     # below this quality, only every other particle is drawn
+FADE_LEVELS = 4
+DRAG = 3.0                  # share of velocity lost per second
+
+# name -> (count, speed px/s, life s, size px, gravity px/s^2, spread in radians either side of the hit, colors)
+EFFECTS = {
+    'slash':    (36, (90, 320), (0.18, 0.42), 6, 0, 1.1, ((128, 0, 128), (200, 120, 255))),
+    'beam':     (28, (60, 260), (0.15, 0.35), 5, 0, 0.8, ((0, 255, 255), (200, 255, 255))),
+    'parry':    (48, (280, 300), (0.22, 0.28), 5, 0, math.pi, ((255, 255, 255), (255, 230, 90))),
+    'charge':   (40, (120, 380), (0.25, 0.5), 7, 300, 0.9, ((255, 0, 0), (255, 140, 0))),
+    'boundary': (20, (60, 200), (0.2, 0.4), 5, 200, math.pi, ((100, 100, 100), (200, 200, 200))),
+    'ko_blue':  (700, (60, 520), (0.6, 1.4), 8, 420, math.pi, ((0, 0, 255), (0, 0, 139), (255, 255, 255))),
+    'ko_red':   (700, (60, 520), (0.6, 1.4), 8, 420, math.pi, ((255, 0, 0), (139, 0, 0), (255, 255, 255))),
+}
+UNTHINNED = ('ko_blue', 'ko_red')
+# rows of ParticleSystem.spawn, the scratch a burst draws its random values into
+SPAWN_THETA, SPAWN_SPEED, SPAWN_X, SPAWN_Y, SPAWN_LIFE, SPAWN_VEL_X, SPAWN_COLOR = range(7)
+SPAWN_ROWS = 7
+
+_EVENTS = (
+    Combat_log.EVENT_MATCH_START,
+    Combat_log.EVENT_SLASH,
+    Combat_log.EVENT_BEAM,
+    Combat_log.EVENT_PARRY,
+    Combat_log.EVENT_CHARGE_HIT,
+    Combat_log.EVENT_BOUNDARY_HIT,
+    Combat_log.EVENT_DEATH,
+)
+
+
+def create(max_particles=MAX_PARTICLES, seed=None):
+    """A ParticleSystem, or None when effects are off (CUBE_PARTICLES=0) or numpy is missing."""
+    if os.environ.get("CUBE_PARTICLES", "1") == "0":
+        return None
+    if np is None:
+        print("Particles disabled: numpy is not installed")
+        return None
+    return ParticleSystem(max_particles, seed)
+
+
+class ParticleSystem:
+    def __init__(self, max_particles=MAX_PARTICLES, seed=None):
+        self.capacity = max_particles
+        self.rng = np.random.default_rng(seed)
+        self.locate = None
+
+        n = max_particles
+        self.pos = np.zeros((n, 2), dtype=np.float32)
+        self.vel = np.zeros((n, 2), dtype=np.float32)
+        self.life = np.zeros(n, dtype=np.float32)
+        self.max_life = np.ones(n, dtype=np.float32)
+        self.gravity = np.zeros(n, dtype=np.float32)
+        self.sprite = np.zeros(n, dtype=np.intp)       # first of the particle's FADE_LEVELS sprites
+        self.alive = np.zeros(n, dtype=np.bool_)
+        # scratch, so update() and draw() don't allocate
+        self.step = np.zeros((n, 2), dtype=np.float32)
+        self.fall = np.zeros(n, dtype=np.float32)
+        self.slots = np.arange(n, dtype=np.intp)
+        self.even = self.slots % 2 == 0
+        self.shown = np.zeros(n, dtype=np.bool_)
+        self.test = np.zeros(n, dtype=np.bool_)
+        self.order = np.zeros(n, dtype=np.intp)
+        self.level = np.zeros(n, dtype=np.intp)
+        self.fade = np.zeros(n, dtype=np.float32)
+        self.edge = np.zeros(n, dtype=np.float32)
+        self.corner = np.zeros((n, 2), dtype=np.float32)
+        # draw order; the slot past the end takes the particles left out
+        self.index = np.zeros(n + 1, dtype=np.intp)
+        self.drawn_sprite = np.zeros(n + 1, dtype=np.intp)
+        self.drawn_half = np.zeros(n + 1, dtype=np.float32)
+        self.drawn_corner = np.zeros((n + 1, 2), dtype=np.float32)
+        self.bound = np.zeros(n + 1, dtype=np.float32)
+        self.xy = np.zeros((n + 1, 2), dtype=np.intp)
+        self.spawn = np.zeros((SPAWN_ROWS, n), dtype=np.float32)
+        self.spawn_color = np.zeros(n, dtype=np.intp)
+
+        self.head = 0       # next ring slot to spawn into
+        self.used = 0       # slots ever spawned into; update() only looks at these
+        self.live = 0
+        self.quality = 1.0
+        self.frame_ms = 0.0
+        self.spawned = 0
+        self.dropped = 0    # particles thinned out of bursts or overwritten before they died
+        self.rect = pygame.Rect(0, 0, 0, 0)
+
+        self._build_sprites()
+
+    def _build_sprites(self):
+        """One sprite per (color, size) an effect uses, at each fade level, smallest first."""
+        self.groups = {}        # (color, size) -> index of its first sprite
+        sprites, halves = [], []
+        convert = pygame.display.get_surface() is not None
+        for count, speeds, lives, size, gravity, spread, colors in EFFECTS.values():
+            for color in colors:
+                if (color, size) in self.groups:
+                    continue
+                self.groups[(color, size)] = len(sprites)
+                for level in range(FADE_LEVELS):
+                    side = max(1, round(size * (level + 1) / FADE_LEVELS))
+                    sprite = pygame.Surface((side, side))
+                    sprite.fill(color)
+                    sprites.append(sprite.convert() if convert else sprite)
+                    halves.append(side / 2)
+        self.sprites = np.empty(len(sprites), dtype=object)
+        self.sprites[:] = sprites
+        self.frame_sprites = np.empty(self.capacity + 1, dtype=object)
+        self.half = np.array(halves, dtype=np.float32)
+        self.effect_sprites = {name: np.array([self.groups[(color, effect[3])] for color in effect[6]], dtype=np.intp)
+                               for name, effect in EFFECTS.items()}
+
+    # events
+
+    def start(self, locate):
+        """Spawns effects from combat events. locate(actor) gives a cube's centre, or None if it isn't on the field."""
+        self.locate = locate
+        Combat_log.subscribe(self._on_event, kinds=_EVENTS, sync=True)
+
+    def stop(self):
+        Combat_log.unsubscribe(self._on_event)
+        self.locate = None
+
+    def _on_event(self, kind, time, actor, flag, value, extra):
+        if kind == Combat_log.EVENT_MATCH_START:
+            self.clear()
+            return
+        other = Combat_log.ACTOR_RED if actor == Combat_log.ACTOR_BLUE else Combat_log.ACTOR_BLUE
+        if kind == Combat_log.EVENT_SLASH and flag:
+            self._hit('slash', actor, other)
+        elif kind == Combat_log.EVENT_BEAM and flag:
+            self._hit('beam', actor, other)
+        elif kind == Combat_log.EVENT_CHARGE_HIT:
+            self._hit('charge', actor, other)
+        elif kind == Combat_log.EVENT_PARRY and flag:
+            self._hit('parry', None, actor)
+        elif kind == Combat_log.EVENT_BOUNDARY_HIT:
+            self._hit('boundary', None, actor)
+        elif kind == Combat_log.EVENT_DEATH:
+            self._hit('ko_blue' if actor == Combat_log.ACTOR_BLUE else 'ko_red', None, actor)
+
+    def _hit(self, name, attacker, target):
+        """A burst at `target`, thrown away from `attacker` (every way if None)."""
+        at = self.locate(target)
+        if at is None:
+            return
+        angle = 0.0
+        if attacker is not None:
+            source = self.locate(attacker)
+            if source is not None and source != at:
+                angle = math.atan2(at[1] - source[1], at[0] - source[0])
+        self.burst(name, at[0], at[1], angle)
+
+    # particles
+
+    def clear(self):
+        self.life[:] = 0
+        self.alive[:] = False
+        self.head = self.used = self.live = 0
+
+    def burst(self, name, x, y, angle=0.0):
+        """Spawns one of EFFECTS at (x, y), centred on `angle`. Returns how many particles it got."""
+        count, speeds, lives, size, gravity, spread, colors = EFFECTS[name]
+        scale = self.quality
+        soft_cap = self.capacity * SOFT_CAP_SHARE
+        if name not in UNTHINNED and self.live > soft_cap:
+            scale *= max(0.0, (self.capacity - self.live) / (self.capacity - soft_cap))
+        n = min(int(count * scale), self.capacity)
+        self.dropped += count - n
+        if n <= 0:
+            return 0
+
+        # ring slots; whatever still lives there was the oldest. A burst wraps round the ring at most once.
+        head = self.head
+        first = min(n, self.capacity - head)
+        overwritten = int(np.count_nonzero(self.alive[head:head + first]))
+        if n > first:
+            overwritten += int(np.count_nonzero(self.alive[:n - first]))
+        end = head + n
+        self.used = self.capacity if end >= self.capacity else max(self.used, end)
+        self.head = end % self.capacity
+
+        uniform = self._uniform
+        theta = uniform(angle - spread, angle + spread, n, SPAWN_THETA)
+        speed = uniform(speeds[0], speeds[1], n, SPAWN_SPEED)
+        spawn_x = uniform(x - size, x + size, n, SPAWN_X)
+        spawn_y = uniform(y - size, y + size, n, SPAWN_Y)
+        life = uniform(lives[0], lives[1], n, SPAWN_LIFE)
+        vel_x = np.cos(theta, out=self.spawn[SPAWN_VEL_X, :n])
+        vel_x *= speed
+        vel_y = np.sin(theta, out=theta)
+        vel_y *= speed
+        color = self.spawn_color[:n]
+        np.copyto(color, uniform(0, len(colors), n, SPAWN_COLOR), casting='unsafe')
+        sprite = np.take(self.effect_sprites[name], color, out=color, mode='clip')
+
+        for start, count, offset in ((head, first, 0), (0, n - first, first)):
+            if not count:
+                continue
+            ring, part = slice(start, start + count), slice(offset, offset + count)
+            self.pos[ring, 0] = spawn_x[part]
+            self.pos[ring, 1] = spawn_y[part]
+            self.vel[ring, 0] = vel_x[part]
+            self.vel[ring, 1] = vel_y[part]
+            self.life[ring] = life[part]
+            self.max_life[ring] = life[part]
+            self.gravity[ring] = gravity
+            self.sprite[ring] = sprite[part]
+            self.alive[ring] = True
+        self.live += n - overwritten
+        self.spawned += n
+        self.dropped += overwritten
+        return n
+
+    def _uniform(self, low, high, n, row):
+        """n uniform draws in [low, high), into spawn row `row`; Generator.uniform() would allocate them."""
+        values = self.rng.random(dtype=np.float32, out=self.spawn[row, :n])
+        values *= high - low
+        values += low
+        return values
+
+    def update(self, dt):
+        """Moves every particle on by dt milliseconds, in one vectorized pass."""
+        if not self.live:
+            return
+        started = time.perf_counter()
+        n = self.used
+        seconds = dt / 1000.0
+        vel = self.vel[:n]
+        vel *= max(0.0, 1.0 - DRAG * seconds)
+        np.multiply(self.gravity[:n], seconds, out=self.fall[:n])
+        vel[:, 1] += self.fall[:n]
+        np.multiply(vel, seconds, out=self.step[:n])
+        self.pos[:n] += self.step[:n]
+        life = self.life[:n]
+        life -= seconds
+        np.greater(life, 0.0, out=self.alive[:n])
+        self.live = int(np.count_nonzero(self.alive[:n]))
+        self.frame_ms = (time.perf_counter() - started) * 1000
+
+    def _batch(self, view_x, view_y, view_w, view_h):
+        """
+        (sprites, [x, y] rows) of the live particles on screen, and sets self.rect
+        around them. Both are views of preallocated buffers, valid until the next call.
+        Every slot is worked on, dead or not, so that nothing is sliced or allocated.
+        """
+        fade, level, edge, corner = self.fade, self.level, self.edge, self.corner
+        np.divide(self.life, self.max_life, out=fade)
+        fade *= FADE_LEVELS
+        np.copyto(level, fade, casting='unsafe')
+        np.minimum(level, FADE_LEVELS - 1, out=level)
+        level += self.sprite
+        # once the sprites are picked, the fade buffer holds their half sizes; dead slots can fade
+        # below their first sprite, but they are masked out below
+        half = np.take(self.half, level, out=fade, mode='clip')
+
+        # top-left corners on screen, and how far off the top or left a sprite can start and still show
+        for axis, view in ((0, view_x), (1, view_y)):
+            column = corner[:, axis]
+            np.subtract(self.pos[:, axis], half, out=column)
+            column -= view
+        np.multiply(half, -2.0, out=edge)
+
+        shown, test = self.shown, self.test
+        np.greater(corner[:, 0], edge, out=shown)
+        shown &= np.less(corner[:, 0], view_w, out=test)
+        shown &= np.greater(corner[:, 1], edge, out=test)
+        shown &= np.less(corner[:, 1], view_h, out=test)
+        shown &= self.alive
+        if self.quality < THIN_DRAW_QUALITY:
+            # slots, not frames, pick who is left out, so nothing flickers
+            shown &= self.even
+
+        # a running count of the shown slots gives each one its place in the batch;
+        # np.flatnonzero() would allocate the index
+        order = self.order
+        np.copyto(order, shown)
+        np.add.accumulate(order, out=order)
+        n = int(order[-1])
+        if not n:
+            self.rect.update(0, 0, 0, 0)
+            return (), ()
+        order -= 1
+        np.copyto(order, self.capacity, where=np.logical_not(shown, out=test))
+        np.put(self.index, order, self.slots, mode='clip')
+
+        np.take(level, self.index, out=self.drawn_sprite, mode='clip')
+        np.take(half, self.index, out=self.drawn_half, mode='clip')
+        np.take(corner, self.index, axis=0, out=self.drawn_corner, mode='clip')
+        np.copyto(self.xy, self.drawn_corner, casting='unsafe')
+        x, y, extreme = self.drawn_corner[:, 0], self.drawn_corner[:, 1], self._extreme
+        side = extreme(np.maximum, self.drawn_half, n) * 2
+        left, top = max(int(extreme(np.minimum, x, n)), 0), max(int(extreme(np.minimum, y, n)), 0)
+        right = min(int(extreme(np.maximum, x, n) + side) + 1, view_w)
+        bottom = min(int(extreme(np.maximum, y, n) + side) + 1, view_h)
+        self.rect.update(left, top, right - left, bottom - top)
+        np.take(self.sprites, self.drawn_sprite, out=self.frame_sprites, mode='clip')
+        # rows of reused buffers rather than fresh lists, so a frame of sparks leaves nothing on the heap
+        return self.frame_sprites[:n], self.xy[:n]
+
+    def _extreme(self, ufunc, values, n):
+        """ufunc.reduce() over values[:n], through a scratch buffer: a NumPy reduction allocates about 1 KB."""
+        ufunc.accumulate(values[:n], out=self.bound[:n])
+        return self.bound[n - 1]
+
+    def _measure(self, started):
+        self.frame_ms += (time.perf_counter() - started) * 1000
+        if self.frame_ms > FRAME_BUDGET_MS:
+            self.quality = max(MIN_QUALITY, self.quality * QUALITY_DECAY)
+        elif self.quality < 1.0:
+            self.quality = min(1.0, self.quality + QUALITY_RECOVERY)
+        self.frame_ms = 0.0
+
+    def draw(self, surface, view_x=0, view_y=0):
+        """Blits the live particles in one batch; returns the screen Rect they cover (pooled)."""
+        if not self.live:
+            self.rect.update(0, 0, 0, 0)
+            return self.rect
+        started = time.perf_counter()
+        sprites, positions = self._batch(view_x, view_y, *surface.get_size())
+        if len(sprites):
+            surface.blits(zip(sprites, positions), doreturn=False)
+        self._measure(started)
+        return self.rect
+
+    def draw_backend(self, backend, view_x=0, view_y=0):
+        """draw() through a Render_backend.HardwareBackend, as cached textures."""
+        if not self.live:
+            return
+        started = time.perf_counter()
+        sprites, positions = self._batch(view_x, view_y, *backend.size)
+        if len(sprites):
+            backend.draw_surfaces(zip(sprites, positions))
+        self._measure(started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat particles")
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench = sub.add_parser('bench', help="time update + draw with a steady number of live particles")
+    bench.add_argument('--particles', type=int, default=4000, help="live particles to keep up")
+    bench.add_argument('--cap', type=int, default=MAX_PARTICLES)
+    bench.add_argument('--frames', type=int, default=600)
+    bench.add_argument('--size', default='800x600')
+    args = parser.parse_args()
+
+    if np is None:
+        print("Error: numpy is not installed")
+        return 1
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    screen = pygame.display.set_mode((width, height))
+    background = screen.copy()
+    background.fill((255, 255, 255))
+
+    system = ParticleSystem(args.cap, seed=0)
+    rng = np.random.default_rng(0)
+    names = tuple(EFFECTS)
+    times, live = [], []
+    for frame in range(args.frames):
+        while system.live < args.particles:
+            name = names[rng.integers(len(names))]
+            if system.burst(name, rng.uniform(0, width), rng.uniform(0, height), rng.uniform(-math.pi, math.pi)) == 0:
+                break
+        screen.blit(background, (0, 0))
+        started = time.perf_counter()
+        system.update(1000 / 60)
+        system.draw(screen)
+        times.append((time.perf_counter() - started) * 1000)
+        live.append(system.live)
+    pygame.quit()
+
+    times.sort()
+    print(f"{args.frames} frames, {sum(live) / len(live):.0f} live particles on average (cap {args.cap})")
+    print(f"update + draw: {sum(times) / len(times):.3f} ms/frame, p99 {times[int(len(times) * 0.99)]:.3f} ms")
+    print(f"quality {system.quality:.2f}, spawned {system.spawned}, dropped {system.dropped}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Optional GPU render backend for Cube Combat.
+
+By default Greg draws everything with pygame.draw / Surface.blit onto the
+display surface. install() can swap in a pygame._sdl2.video Renderer for
+the fight scene. The cube sprite, the beam and the HUD labels are uploaded
+as textures once. Each frame is then a batch of texture copies and
+fill_rects, which SDL sends to the GPU together on present(). That also
+removes the per-frame beam Surface + transform.rotate, because the texture
+is rotated on the GPU.
+
+Menus and the game-over screen still draw onto an offscreen `screen`
+surface, which present() uploads into a streaming texture.
+
+Without a GPU (no accelerated driver listed, or one that fails to create:
+a broken GL stack, a remote session), auto mode uses SDL's own software
+renderer. That still batches the fight scene into one present() and
+rotates the beam without a new Surface. Greg stays on pygame.draw only
+when no renderer can be made at all (old SDL, no pygame._sdl2) or there
+is no window to show it in (SDL_VIDEODRIVER=dummy or offscreen).
+
+    CUBE_RENDERER=auto      try the GPU, then SDL's software renderer, then pygame.draw (default)
+    CUBE_RENDERER=hardware  use an SDL renderer even if it is not accelerated
+    CUBE_RENDERER=software  always draw with pygame.draw
+"""
+
+import math
+import os
+from collections import OrderedDict
+
+import pygame
+
+SDL_RENDERER_ACCELERATED = 0x2
+MAX_LABEL_TEXTURES = 64
+MAX_STATIC_TEXTURES = 128
+
+
+def renderer_available():
+    """pygame._sdl2 is there and the video driver has a window to render into."""
+    try:
+        from pygame._sdl2 import video
+    except ImportError:
+        return False
+    return os.environ.get("SDL_VIDEODRIVER") not in ("dummy", "offscreen")
+
+
+def accelerated_driver_available():
+    if not renderer_available():
+        return False
+    from pygame._sdl2 import video
+    return any(info.flags & SDL_RENDERER_ACCELERATED for info in video.get_drivers())
+
+
+class HardwareBackend:
+    """Draws the fight scene through an SDL renderer. `in_frame` is True between begin_frame() and present()."""
+
+    def __init__(self, size, caption, cube_size, beam_length, beam_width, beam_color, accelerated=True, vsync=True):
+        from pygame._sdl2 import sdl2, video
+
+        self.video = video
+        self.size = size
+        self.cube_size = cube_size
+        self.window = video.Window(caption, size)
+        try:
+            self.renderer = video.Renderer(self.window, accelerated=1 if accelerated else -1, vsync=vsync)
+        except sdl2.error as e:
+            # _sdl2 raises its own error class, not pygame.error
+            self.window.destroy()
+            raise pygame.error(str(e)) from e
+        self.in_frame = False
+
+        self.canvas = video.Texture(self.renderer, size, streaming=True)
+
+        # one white square tinted per draw with color mod
+        cube = pygame.Surface((cube_size, cube_size))
+        cube.fill((255, 255, 255))
+        self.cube = video.Texture.from_surface(self.renderer, cube)
+
+        # the beam as it would look at angle 0, starting at the edge of the red cube; the software
+        # path draws it on a (length + 10) square centred on the cube, so only half of it shows
+        self.beam_offset = cube_size / 2
+        visible_length = (max(beam_length, beam_width) + 10) // 2 - self.beam_offset
+        beam = pygame.Surface((int(visible_length), beam_width))
+        beam.fill(beam_color)
+        self.beam = video.Texture.from_surface(self.renderer, beam)
+        self.beam_rect = pygame.Rect(0, 0, beam.get_width(), beam_width)
+        self.beam_origin = (-self.beam_offset, beam_width / 2)
+
+        self.colors = {}               # (r, g, b) -> (r, g, b, 255), which draw_color needs
+        self.labels = OrderedDict()    # (text, color, font id) -> Texture, least recently used first
+        self.statics = OrderedDict()   # id(Surface) -> (Surface, Texture) for surfaces that never change
+        self.rect = pygame.Rect(0, 0, 0, 0)
+
+    def _rgba(self, color):
+        rgba = self.colors.get(color)
+        if rgba is None:
+            rgba = self.colors[color] = tuple(pygame.Color(color))
+        return rgba
+
+    def begin_frame(self, clear_color):
+        self.renderer.draw_color = self._rgba(clear_color)
+        self.renderer.clear()
+        self.in_frame = True
+
+    def fill_rect(self, color, rect):
+        self.renderer.draw_color = self._rgba(color)
+        self.renderer.fill_rect(rect)
+
+    def outline_rect(self, color, rect):
+        self.renderer.draw_color = self._rgba(color)
+        self.renderer.draw_rect(rect)
+
+    def draw_cube(self, x, y, color):
+        self.cube.color = color
+        self.rect.update(x, y, self.cube_size, self.cube_size)
+        self.cube.draw(dstrect=self.rect)
+
+    def draw_beam(self, center_x, center_y, angle_rad):
+        self.beam_rect.topleft = (center_x + self.beam_offset, center_y - self.beam_rect.h / 2)
+        self.beam.draw(dstrect=self.beam_rect, angle=math.degrees(angle_rad), origin=self.beam_origin)
+
+    def draw_label(self, font, text, color, pos):
+        key = (text, color, id(font))
+        texture = self.labels.get(key)
+        if texture is None:
+            texture = self.video.Texture.from_surface(self.renderer, font.render(text, True, color))
+            self.labels[key] = texture
+            if len(self.labels) > MAX_LABEL_TEXTURES:
+                self.labels.popitem(last=False)
+        else:
+            self.labels.move_to_end(key)
+        self.rect.update(pos[0], pos[1], texture.width, texture.height)
+        texture.draw(dstrect=self.rect)
+
+    def draw_surface(self, surface, pos):
+        """Draws a Surface that never changes (a baked arena chunk, a particle sprite), uploading it the first time."""
+        entry = self.statics.get(id(surface))
+        if entry is None or entry[0] is not surface:
+            entry = self.statics[id(surface)] = (surface, self.video.Texture.from_surface(self.renderer, surface))
+            if len(self.statics) > MAX_STATIC_TEXTURES:
+                self.statics.popitem(last=False)
+        else:
+            self.statics.move_to_end(id(surface))
+        texture = entry[1]
+        self.rect.update(pos[0], pos[1], texture.width, texture.height)
+        texture.draw(dstrect=self.rect)
+
+    def draw_surfaces(self, pairs):
+        """draw_surface() for each (Surface, pos) in `pairs`, e.g. a frame of particles."""
+        draw = self.draw_surface
+        for surface, pos in pairs:
+            draw(surface, pos)
+
+    def present(self, screen):
+        """Shows the frame. Outside a fight frame the software `screen` surface is what gets shown."""
+        if not self.in_frame:
+            self.canvas.update(screen)
+            self.canvas.draw()
+        self.renderer.present()
+        self.in_frame = False
+
+
+def install(game, mode=None):
+    """
+    Picks a backend for the Greg module `game` and returns it (None means software).
+    Greg's draw functions check game.render_backend themselves.
+    """
+    mode = mode or os.environ.get("CUBE_RENDERER", "auto")
+    if mode == "software" or (mode == "auto" and not renderer_available()):
+        return None
+
+    size = (game.WIDTH, game.HEIGHT)
+    caption = pygame.display.get_caption()[0] if pygame.display.get_init() else "Cube Combat"
+    # auto without a GPU goes straight to SDL's software renderer
+    accelerated = mode == "auto" and accelerated_driver_available()
+    try:
+        # a renderer can't share the window pygame.display.set_mode made, so swap it for an SDL window
+        pygame.display.quit()
+        pygame.display.init()
+        try:
+            backend = HardwareBackend(size, caption, game.CUBE_SIZE, game.AI_BEAM_LENGTH, game.AI_BEAM_WIDTH,
+                                      game.CYAN, accelerated=accelerated, vsync=accelerated)
+        except pygame.error as e:
+            if not accelerated:
+                raise
+            print(f"Accelerated renderer unavailable ({e}); trying SDL's software renderer.")
+            accelerated = False
+            backend = HardwareBackend(size, caption, game.CUBE_SIZE, game.AI_BEAM_LENGTH, game.AI_BEAM_WIDTH,
+                                      game.CYAN, accelerated=False, vsync=False)
+    except (ImportError, pygame.error) as e:
+        print(f"Hardware renderer unavailable ({e}); using software rendering.")
+        game.screen = pygame.display.set_mode(size)
+        pygame.display.set_caption(caption)
+        return None
+
+    game.screen = pygame.Surface(size)
+    game.render_backend = backend
+    print(f"Using hardware renderer ({'accelerated' if accelerated else 'SDL software' if mode == 'auto' else 'forced'}).")
+    return backend
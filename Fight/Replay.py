@@ -0,0 +1,490 @@
+"""
+Match recordings and headless replay-to-video export for Cube Combat.
+
+A replay is the round's rng seed and arena (its number in arenas.txt and a
+hash of its layout) plus, for every simulated frame, both
+players' input bytes (see Inputs), the frame's dt and when in the frame
+each attack/special press landed, as byte fractions of dt. Greg's simulation is
+deterministic given those, so a replay file is a few bytes per frame and
+any round can be rebuilt exactly. A replay whose arena is missing or has
+been edited since it was recorded is refused rather than played into
+different walls.
+
+    CUBE_REPLAY_DIR=replays python Greg.py        # record every finished round
+
+Export re-runs replays with the dummy video driver through the same draw
+code the game uses (draw_game / draw_game_over). Frames are sampled at any
+fps, scaled to any resolution, and piped as raw pixels to ffmpeg straight
+from the surface's buffer with no copy. Without ffmpeg, an image sequence
+is written instead. Several replays are exported in parallel, one per
+worker process, as fast as the CPU allows.
+
+    python Replay.py simulate --out replays --matches 8
+    python Replay.py export replays/*.ccrep --out videos --size 1280x720 --fps 30
+
+--selftest records two short rounds, checks they load back unchanged (and
+that an older format is refused), and exports both in parallel in a child process that has to exit on its own:
+
+    python Replay.py --selftest
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import glob
+import multiprocessing
+import random
+import shutil
+import signal
+import struct
+import subprocess
+import tempfile
+import time
+
+import pygame
+
+import Combat_log
+import Inputs
+
+MAGIC = b"CCREP4\n"
+# magic, mode code, blue cube, red cube, debug, seed, frame count, arena, arena layout hash (Arena.layout_hash)
+HEADER = struct.Struct('<7sBBB?QIBI')
+# blue input, red input, dt (ms), then blue attack/special and red attack/special offsets (Inputs.offset_byte)
+FRAME = struct.Struct('<BBdBBBB')
+
+
+FRAME_MS = 1000 / 60
+MAX_SIMULATED_FRAMES = 60 * 60 * 5
+GAME_OVER_TAIL_S = 2.0
+
+
+class Replay:
+    def __init__(self, mode, blue_cube, red_cube, debug, seed, arena, arena_hash, frames=b""):
+        self.mode = mode
+        self.blue_cube = blue_cube
+        self.red_cube = red_cube
+        self.debug = debug
+        self.seed = seed
+        self.arena = arena                  # the Arena's number in arenas.txt
+        self.arena_hash = arena_hash        # its layout_hash when recorded
+        self.frames = bytearray(frames)     # FRAME records back to back
+
+    @property
+    def frame_count(self):
+        return len(self.frames) // FRAME.size
+
+    def add_frame(self, blue_input, red_input, dt, offsets=(0, 0, 0, 0)):
+        self.frames += FRAME.pack(blue_input, red_input, dt, *offsets)
+
+    def iter_frames(self):
+        return FRAME.iter_unpack(self.frames)
+
+    def save(self, path):
+        header = HEADER.pack(MAGIC, Combat_log.MATCH_MODES.index(self.mode), self.blue_cube, self.red_cube,
+                             self.debug, self.seed, self.frame_count, self.arena, self.arena_hash)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(self.frames)
+        os.replace(tmp_path, path)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic = data[:len(MAGIC)]
+    if magic != MAGIC:
+        if magic.startswith(MAGIC[:5]):
+            raise ValueError(f"{path} is a {magic.decode('ascii', 'replace').strip()} replay; "
+                             f"only {MAGIC.decode('ascii').strip()} can be played back")
+        raise ValueError(f"{path} is not a Cube Combat replay")
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is truncated (no complete header)")
+    magic, mode, blue_cube, red_cube, debug, seed, count, arena, arena_hash = HEADER.unpack_from(data)
+    frames = data[HEADER.size:HEADER.size + count * FRAME.size]
+    if len(frames) != count * FRAME.size:
+        raise ValueError(f"{path} is truncated ({len(frames) // FRAME.size} of {count} frames)")
+    return Replay(Combat_log.MATCH_MODES[mode], blue_cube, red_cube, debug, seed, arena, arena_hash, frames)
+
+
+class Recorder:
+    """
+    Records the live game's rounds. Call record() once per simulated frame,
+    before update_game; a round is written to `directory` when it ends.
+    """
+
+    def __init__(self, game, directory):
+        self.game = game
+        self.directory = directory
+        self.replay = None
+        os.makedirs(directory, exist_ok=True)
+        Combat_log.subscribe(self._on_event, kinds=(Combat_log.EVENT_MATCH_START, Combat_log.EVENT_MATCH_END), sync=True)
+
+    def _on_event(self, kind, time_ms, actor, flag, value, extra):
+        game = self.game
+        if kind == Combat_log.EVENT_MATCH_START:
+            blue_cube, red_cube = divmod(int(extra), 1000)
+            self.replay = Replay(Combat_log.MATCH_MODES[value], blue_cube, red_cube, game.is_debug_mode, game.match_seed,
+                                 game.arena.id, game.arena.layout_hash)
+        elif self.replay is not None:
+            replay, self.replay = self.replay, None
+            name = time.strftime("%Y%m%d-%H%M%S") + f"-{replay.mode}-{replay.blue_cube}v{replay.red_cube}.ccrep"
+            try:
+                replay.save(os.path.join(self.directory, name))
+            except IOError as e:
+                print(f"Error saving replay: {e}")
+
+    def record(self, keys, events, dt):
+        if self.replay is not None:
+            offsets = [Inputs.offset_byte(offset, dt)
+                       for side in ('blue', 'red') for offset in Inputs.press_offsets(side, events)]
+            self.replay.add_frame(Inputs.read_local_input('blue', keys, events),
+                                  Inputs.read_local_input('red', keys, events), dt, offsets)
+
+    def close(self):
+        Combat_log.unsubscribe(self._on_event)
+
+
+def _game():
+    """Greg, imported on first use so importing this module never opens a window."""
+    import Greg
+    Greg.autosave_stats = False
+    return Greg
+
+
+def check_arena(replay, arena):
+    """Raises ValueError if `arena` isn't the one `replay` was recorded in, or has different walls now."""
+    if arena.id != replay.arena:
+        raise ValueError(f"recorded in arena {replay.arena}, which arenas.txt no longer has (or can't be used)")
+    if arena.layout_hash != replay.arena_hash:
+        raise ValueError(f"arena {arena.id} ({arena.name}) has been edited since this replay was recorded "
+                         f"(layout {arena.layout_hash:08x}, recorded {replay.arena_hash:08x})")
+
+
+def play(replay, game=None):
+    """Re-runs a replay, yielding after every simulated frame. ValueError if its arena has changed."""
+    game = game or _game()
+    if game.arena.id != replay.arena:
+        game.select_arena(replay.arena)
+    check_arena(replay, game.arena)
+    game.selected_mode = replay.mode
+    game.is_debug_mode = replay.debug
+    game.start_match(replay.seed)
+
+    keys = Inputs.new_key_state()
+    for blue_input, red_input, dt, *offsets in replay.iter_frames():
+        offsets = [Inputs.byte_offset(value, dt) for value in offsets]
+        Inputs.apply_input(game, keys, 'blue', blue_input, offsets[:2])
+        Inputs.apply_input(game, keys, 'red', red_input, offsets[2:])
+        if not game.game_state['game_over']:
+            game.update_game(dt, keys)
+        yield game.game_state
+
+
+def simulate(seed, mode='ai', max_frames=MAX_SIMULATED_FRAMES, game=None):
+    """Plays an AI round against scripted inputs and returns its Replay."""
+    game = game or _game()
+    script_rng = random.Random(seed)
+    replay = Replay(mode, 1, 2, False, script_rng.getrandbits(63), game.arena.id, game.arena.layout_hash)
+    game.selected_mode = mode
+    game.is_debug_mode = False
+    game.start_match(replay.seed)
+
+    keys = Inputs.new_key_state()
+    blue_state, red_state = {}, {}
+    for _ in range(max_frames):
+        blue_input = Inputs.scripted_input(script_rng, blue_state)
+        red_input = Inputs.scripted_input(script_rng, red_state) if mode == 'pvp' else 0
+        replay.add_frame(blue_input, red_input, FRAME_MS)
+        Inputs.apply_input(game, keys, 'blue', blue_input)
+        Inputs.apply_input(game, keys, 'red', red_input)
+        game.update_game(FRAME_MS, keys)
+        if game.game_state['game_over']:
+            break
+    return replay
+
+
+# frame sinks: write(surface) is called once per output frame
+
+def raw_pixel_format(surface):
+    """ffmpeg's name for the surface's in-memory pixel layout, or None if it has no direct equivalent."""
+    if surface.get_bytesize() != 4:
+        return None
+    layouts = {
+        (0xff0000, 0xff00, 0xff): 'bgr',
+        (0xff, 0xff00, 0xff0000): 'rgb',
+    }
+    r, g, b, a = surface.get_masks()
+    layout = layouts.get((r, g, b))
+    if layout is None or sys.byteorder != 'little':
+        return None
+    return layout + ('a' if a else '0')
+
+
+class FfmpegSink:
+    def __init__(self, path, size, fps, surface, ffmpeg='ffmpeg'):
+        pixel_format = raw_pixel_format(surface)
+        if pixel_format is None or surface.get_pitch() != size[0] * 4:
+            raise ValueError("Output surface layout can't be piped to ffmpeg as raw video")
+        self.proc = subprocess.Popen(
+            [ffmpeg, '-loglevel', 'error', '-y',
+             '-f', 'rawvideo', '-pix_fmt', pixel_format, '-s', f"{size[0]}x{size[1]}", '-r', str(fps), '-i', '-',
+             '-pix_fmt', 'yuv420p', path],
+            stdin=subprocess.PIPE)
+
+    def write(self, surface):
+        view = surface.get_view('0')    # the surface's own pixel memory, no copy
+        self.proc.stdin.write(view)
+        del view                        # unlocks the surface for the next frame's drawing
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait():
+            raise RuntimeError(f"ffmpeg exited with status {self.proc.returncode}")
+
+
+class RawSink:
+    """Headerless frames in the surface's native layout, e.g. for piping into another tool later."""
+
+    def __init__(self, path, size, fps, surface):
+        self.out = open(path, 'wb')
+
+    def write(self, surface):
+        view = surface.get_view('0')
+        self.out.write(view)
+        del view
+
+    def close(self):
+        self.out.close()
+
+
+class ImageSequenceSink:
+    def __init__(self, path, size, fps, surface):
+        self.directory = path
+        self.frame = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, surface):
+        pygame.image.save(surface, os.path.join(self.directory, f"frame_{self.frame:06d}.png"))
+        self.frame += 1
+
+    def close(self):
+        pass
+
+
+def _output_path(replay_path, out_dir, encoder):
+    base = os.path.join(out_dir, os.path.splitext(os.path.basename(replay_path))[0])
+    return {'ffmpeg': base + ".mp4", 'raw': base + ".raw", 'png': base}[encoder]
+
+
+def export(replay_path, out_dir, size=None, fps=60, encoder='auto', tail_s=GAME_OVER_TAIL_S):
+    """Renders one replay to a video (or frames) in out_dir. Returns (path, frames written, seconds taken)."""
+    started = time.perf_counter()
+    game = _game()
+    replay = load(replay_path)
+    if encoder == 'auto':
+        encoder = 'ffmpeg' if shutil.which('ffmpeg') else 'png'
+
+    native = (game.WIDTH, game.HEIGHT)
+    size = tuple(size or native)
+    # Greg draws into whatever `screen` is, so give it a surface whose bytes ffmpeg can take as-is
+    game.screen = pygame.Surface(native, 0, 32)
+    output = game.screen if size == native else pygame.Surface(size, 0, 32)
+
+    path = _output_path(replay_path, out_dir, encoder)
+    sink = {'ffmpeg': FfmpegSink, 'raw': RawSink, 'png': ImageSequenceSink}[encoder](path, size, fps, output)
+
+    frame_ms = 1000 / fps
+    next_frame_at = 0.0
+    written = 0
+
+    def emit_frame():
+        if output is not game.screen:
+            pygame.transform.smoothscale(game.screen, size, output)
+        sink.write(output)
+
+    try:
+        for state in play(replay, game):
+            if state['match_time'] < next_frame_at:
+                continue
+            game.draw_game()
+            while next_frame_at <= state['match_time']:
+                emit_frame()
+                written += 1
+                next_frame_at += frame_ms
+
+        if game.game_state['game_over']:
+            game.draw_game_over()
+            for _ in range(int(tail_s * fps)):
+                emit_frame()
+                written += 1
+    finally:
+        sink.close()
+
+    return path, written, time.perf_counter() - started
+
+
+def _export_job(job):
+    replay_path, out_dir, size, fps, encoder = job
+    try:
+        return replay_path, export(replay_path, out_dir, size, fps, encoder), None
+    except Exception as e:
+        return replay_path, None, f"{type(e).__name__}: {e}"
+
+
+def export_many(replay_paths, out_dir, size=None, fps=60, encoder='auto', workers=None):
+    """Exports replays in parallel, one per worker process. Yields (replay path, result, error) as they finish."""
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(path, out_dir, size, fps, encoder) for path in replay_paths]
+    if workers == 1 or len(jobs) == 1:
+        for job in jobs:
+            yield _export_job(job)
+        return
+    # spawn, so every worker starts its own SDL instead of inheriting a forked one
+    pool = multiprocessing.get_context('spawn').Pool(workers)
+    try:
+        yield from pool.imap_unordered(_export_job, jobs)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        # SDL turns SIGTERM into a quit event, so workers are asked to exit rather than terminated
+        pool.join()
+
+
+def _parse_size(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+SELFTEST_FRAMES = 120
+SELFTEST_EXPORT_TIMEOUT_S = 60
+SELFTEST_EXPORT_ROUNDS = 3
+
+
+def _check(results, what, ok):
+    print(f"{'ok  ' if ok else 'FAIL'} {what}")
+    results.append(ok)
+
+
+def selftest():
+    """Save/load round trips, and a two-worker export that writes both files and exits."""
+    results = []
+    game = _game()
+    with tempfile.TemporaryDirectory(prefix='replay-selftest-') as directory:
+        paths = []
+        for seed in (0, 1):
+            replay = simulate(seed, max_frames=SELFTEST_FRAMES, game=game)
+            path = os.path.join(directory, f"sim-{seed}.ccrep")
+            replay.save(path)
+            loaded = load(path)
+            _check(results, f"replay {seed} loads back unchanged",
+                   loaded.frames == replay.frames and loaded.seed == replay.seed and loaded.arena_hash == replay.arena_hash)
+            paths.append((path, replay.frame_count))
+
+        older = os.path.join(directory, 'older.ccrep')
+        with open(paths[0][0], 'rb') as f:
+            data = f.read()
+        with open(older, 'wb') as f:
+            f.write(b"CCREP3\n" + data[len(MAGIC):])
+        try:
+            load(older)
+            refused = False
+        except ValueError:
+            refused = True
+        _check(results, "a replay in an older format is refused", refused)
+
+        # in a child process, so an export that never exits fails the check instead of hanging it; a few
+        # times over, because whether workers are stuck at pool shutdown depends on timing
+        out = os.path.join(directory, 'videos')
+        command = [sys.executable, os.path.abspath(__file__), 'export', *(path for path, _ in paths),
+                   '--out', out, '--workers', '2', '--encoder', 'raw']
+        statuses = []
+        for _ in range(SELFTEST_EXPORT_ROUNDS):
+            # in its own session, so a hung exporter can be killed along with its workers
+            exporter = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+            try:
+                statuses.append(exporter.wait(SELFTEST_EXPORT_TIMEOUT_S))
+            except subprocess.TimeoutExpired:
+                statuses.append(None)
+                if hasattr(os, 'killpg'):
+                    os.killpg(exporter.pid, signal.SIGKILL)
+                else:
+                    exporter.kill()
+                exporter.wait()
+        _check(results, f"two replays export in parallel and the exporter exits within {SELFTEST_EXPORT_TIMEOUT_S}s "
+                        f"({SELFTEST_EXPORT_ROUNDS} runs)", statuses == [0] * SELFTEST_EXPORT_ROUNDS)
+        frame_bytes = game.WIDTH * game.HEIGHT * 4
+        for path, frames in paths:
+            video = _output_path(path, out, 'raw')
+            written = os.path.getsize(video) // frame_bytes if os.path.exists(video) else 0
+            _check(results, f"{os.path.basename(video)} has a frame for every simulated frame", written >= frames)
+
+    print("SELFTEST", "PASS" if all(results) else "FAIL")
+    return 0 if all(results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cube Combat replays")
+    parser.add_argument('--selftest', action='store_true', help="check saving, loading and parallel export")
+    sub = parser.add_subparsers(dest='command')
+
+    sim = sub.add_parser('simulate', help="record AI rounds against scripted inputs")
+    sim.add_argument('--out', default='replays')
+    sim.add_argument('--matches', type=int, default=4)
+    sim.add_argument('--seed', type=int, default=0)
+    sim.add_argument('--mode', choices=('ai', 'pvp'), default='ai')
+    sim.add_argument('--max-frames', type=int, default=MAX_SIMULATED_FRAMES)
+
+    exp = sub.add_parser('export', help="render replays to video")
+    exp.add_argument('replays', nargs='+', help="replay files, globs or directories")
+    exp.add_argument('--out', default='videos')
+    exp.add_argument('--size', type=_parse_size, default=None, help="WIDTHxHEIGHT (default: the game's 800x600)")
+    exp.add_argument('--fps', type=float, default=60)
+    exp.add_argument('--encoder', choices=('auto', 'ffmpeg', 'png', 'raw'), default='auto')
+    exp.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    if args.selftest:
+        return selftest()
+    if args.command is None:
+        parser.error("a command is required (simulate or export)")
+    if args.command == 'simulate':
+        os.makedirs(args.out, exist_ok=True)
+        for i in range(args.matches):
+            replay = simulate(args.seed + i, args.mode, args.max_frames)
+            path = os.path.join(args.out, f"sim-{args.mode}-{args.seed + i:05d}.ccrep")
+            replay.save(path)
+            print(f"{path}: {replay.frame_count} frames")
+        return 0
+
+    paths = []
+    for pattern in args.replays:
+        if os.path.isdir(pattern):
+            paths.extend(glob.glob(os.path.join(pattern, '*.ccrep')))
+        else:
+            paths.extend(glob.glob(pattern))
+    paths = sorted(set(paths))
+
+    started = time.perf_counter()
+    failures = 0
+    for replay_path, result, error in export_many(paths, args.out, args.size, args.fps, args.encoder, args.workers):
+        if error:
+            failures += 1
+            print(f"{replay_path}: {error}")
+            continue
+        path, frames, seconds = result
+        print(f"{path}: {frames} frames in {seconds:.1f}s ({frames / args.fps / max(seconds, 1e-9):.1f}x real time)")
+    print(f"{len(paths) - failures}/{len(paths)} replays exported in {time.perf_counter() - started:.1f}s")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
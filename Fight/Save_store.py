@@ -0,0 +1,345 @@
+"""
+One crash-safe save store for Cube Combat, backed by SQLite in WAL mode.
+
+Everything the game loads at startup (kill stats, achievement progress,
+the cube roster and which cubes are unlocked, settings) lives in a single
+`profile` table keyed by (section, key). Loading the whole profile is one
+indexed scan. Writes are queued by put() and committed by a background
+thread in batched transactions, so gameplay never waits on fsync.
+Finished matches go into a `matches` history table. The per-cube totals
+in `cube_records` / `cube_totals` are bumped in the same transaction, so
+reading a leaderboard never has to rescan the history.
+
+The first time a profile is opened, migrate() imports the old
+stats.txt / achievements.txt / cubes.txt / debug.txt data. After that the
+text files are no longer read.
+
+    python Save_store.py dump     # print the profile
+    python Save_store.py migrate  # re-import the text files
+    python Save_store.py set debug true   # change a setting; a running game reads it at the next fight
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+SCHEMA_VERSION = 1
+BATCH_INTERVAL_S = 0.2
+
+SECTION_STATS = 'stats'
+SECTION_ACHIEVEMENT = 'achievement'
+SECTION_CUBE = 'cube'
+SECTION_SETTING = 'setting'
+SECTION_META = 'meta'
+INT_KEYED_SECTIONS = (SECTION_ACHIEVEMENT, SECTION_CUBE)
+
+MODE_ALL = '*'   # cube_totals row that sums every mode
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile (
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (section, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    played_at REAL NOT NULL,
+    mode TEXT NOT NULL,
+    blue_cube INTEGER NOT NULL,
+    red_cube INTEGER NOT NULL,
+    winner TEXT,
+    duration_ms REAL NOT NULL,
+    blue_damage INTEGER NOT NULL,
+    red_damage INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS matches_by_blue_cube ON matches (blue_cube, id);
+CREATE INDEX IF NOT EXISTS matches_by_red_cube ON matches (red_cube, id);
+
+CREATE TABLE IF NOT EXISTS cube_records (
+    cube_id INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    opponent INTEGER NOT NULL,
+    matches INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    damage_dealt INTEGER NOT NULL,
+    damage_taken INTEGER NOT NULL,
+    PRIMARY KEY (cube_id, mode, opponent)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cube_totals (
+    cube_id INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    matches INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    total_ms REAL NOT NULL,
+    damage_dealt INTEGER NOT NULL,
+    damage_taken INTEGER NOT NULL,
+    PRIMARY KEY (cube_id, mode)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cube_totals_leaderboard ON cube_totals (mode, wins DESC, matches);
+"""
+
+RECORD_COLUMNS = ('matches', 'wins', 'losses', 'total_ms', 'damage_dealt', 'damage_taken')
+
+_UPSERT_SET = ", ".join(f"{c} = {c} + excluded.{c}" for c in RECORD_COLUMNS)
+UPSERT_CUBE_RECORD = (
+    f"INSERT INTO cube_records (cube_id, mode, opponent, {', '.join(RECORD_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    f"ON CONFLICT (cube_id, mode, opponent) DO UPDATE SET {_UPSERT_SET}"
+)
+UPSERT_CUBE_TOTAL = (
+    f"INSERT INTO cube_totals (cube_id, mode, {', '.join(RECORD_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    f"ON CONFLICT (cube_id, mode) DO UPDATE SET {_UPSERT_SET}"
+)
+INSERT_MATCH = (
+    "INSERT INTO matches (played_at, mode, blue_cube, red_cube, winner, duration_ms, blue_damage, red_damage) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_STOP = object()
+
+
+class SaveStore:
+    """A profile database. put() is safe to call from the game loop; it only queues."""
+
+    def __init__(self, path, batch_interval=BATCH_INTERVAL_S):
+        self.path = path
+        self.batch_interval = batch_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.conn = self._connect()
+        self.conn.executescript(SCHEMA)
+
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="save-store-writer", daemon=True)
+        self._writer.start()
+        self._closed = False
+        self._lock = threading.Lock()   # nothing is queued behind the writer's stop marker
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # reading
+
+    def load_profile(self):
+        """Returns {section: {key: value}} for the whole profile in one query."""
+        profile = {SECTION_STATS: {}, SECTION_ACHIEVEMENT: {}, SECTION_CUBE: {}, SECTION_SETTING: {}, SECTION_META: {}}
+        for section, key, value in self.conn.execute("SELECT section, key, value FROM profile"):
+            if section in INT_KEYED_SECTIONS:
+                key = int(key)
+            profile.setdefault(section, {})[key] = json.loads(value)
+        return profile
+
+    def get(self, section, key, default=None):
+        row = self.conn.execute("SELECT value FROM profile WHERE section = ? AND key = ?", (section, str(key))).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def is_migrated(self):
+        return self.get(SECTION_META, 'schema_version') is not None
+
+    # writing
+
+    def _enqueue(self, item):
+        """Hands an item to the writer; after close() there is none, so writes raise like reads do."""
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError(f"save store {self.path} is closed")
+            self._queue.put(item)
+
+    def put(self, section, key, value):
+        """Queues one value; it is committed with whatever else arrives in the same batch window."""
+        self._enqueue(('put', (section, str(key)), json.dumps(value)))
+
+    def execute(self, sql, params=()):
+        """Queues an arbitrary statement to run inside the next batch transaction."""
+        self._enqueue(('sql', [(sql, params)]))
+
+    def execute_together(self, statements):
+        """Queues [(sql, params), ...] that must land in the same transaction."""
+        self._enqueue(('sql', list(statements)))
+
+    def flush(self):
+        """Blocks until everything queued so far is committed."""
+        done = threading.Event()
+        self._enqueue(('flush', done))
+        done.wait()
+
+    # match history
+
+    def record_match(self, mode, blue_cube, red_cube, winner, duration_ms, blue_damage, red_damage,
+                     blue_taken=None, red_taken=None):
+        """
+        Appends a finished match and bumps the per-cube aggregates in the same
+        transaction. *_damage is what each side dealt; *_taken defaults to what
+        the other side dealt, and is more when a cube also hurt itself on a wall.
+        """
+        blue_taken = red_damage if blue_taken is None else blue_taken
+        red_taken = blue_damage if red_taken is None else red_taken
+        statements = [(INSERT_MATCH, (time.time(), mode, blue_cube, red_cube, winner, duration_ms, blue_damage, red_damage))]
+        for side, cube, opponent, dealt, taken in (('blue', blue_cube, red_cube, blue_damage, blue_taken),
+                                                   ('red', red_cube, blue_cube, red_damage, red_taken)):
+            row = (1, int(winner == side), int(winner is not None and winner != side), duration_ms, dealt, taken)
+            statements.append((UPSERT_CUBE_RECORD, (cube, mode, opponent) + row))
+            statements.append((UPSERT_CUBE_TOTAL, (cube, mode) + row))
+            statements.append((UPSERT_CUBE_TOTAL, (cube, MODE_ALL) + row))
+        self.execute_together(statements)
+
+    def load_cube_records(self):
+        """Every (cube, mode, opponent) aggregate row, as dicts."""
+        columns = ('cube_id', 'mode', 'opponent') + RECORD_COLUMNS
+        rows = self.conn.execute(f"SELECT {', '.join(columns)} FROM cube_records")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def leaderboard(self, mode=MODE_ALL, limit=10):
+        """Cubes ordered by wins, straight off the cube_totals_leaderboard index."""
+        columns = ('cube_id',) + RECORD_COLUMNS
+        rows = self.conn.execute(
+            f"SELECT {', '.join(columns)} FROM cube_totals WHERE mode = ? ORDER BY wins DESC, matches LIMIT ?",
+            (mode, limit))
+        return [dict(zip(columns, row)) for row in rows]
+
+    def match_history(self, cube_id, limit=20):
+        """Most recent matches a cube played on either side."""
+        columns = ('id', 'played_at', 'mode', 'blue_cube', 'red_cube', 'winner', 'duration_ms', 'blue_damage', 'red_damage')
+        select = f"SELECT {', '.join(columns)} FROM matches"
+        rows = self.conn.execute(
+            f"SELECT * FROM ({select} WHERE blue_cube = ? ORDER BY id DESC LIMIT ?) "
+            f"UNION SELECT * FROM ({select} WHERE red_cube = ? ORDER BY id DESC LIMIT ?) "
+            f"ORDER BY id DESC LIMIT ?",
+            (cube_id, limit, cube_id, limit, limit))
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _write_loop(self):
+        conn = self._connect()
+        running = True
+        while running:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.batch_interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or batch[-1] is _STOP or batch[-1][0] == 'flush':
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            puts = {}
+            statements = []
+            waiters = []
+            for item in batch:
+                if item is _STOP:
+                    running = False
+                elif item[0] == 'flush':
+                    waiters.append(item[1])
+                elif item[0] == 'put':
+                    puts[item[1]] = item[2]     # later writes to the same key win
+                else:
+                    statements.extend(item[1])
+
+            if puts or statements:
+                try:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "INSERT INTO profile (section, key, value) VALUES (?, ?, ?) "
+                        "ON CONFLICT (section, key) DO UPDATE SET value = excluded.value",
+                        [(section, key, value) for (section, key), value in puts.items()],
+                    )
+                    for sql, params in statements:
+                        conn.execute(sql, params)
+                    conn.execute("COMMIT")
+                except sqlite3.Error as e:
+                    print(f"Error saving profile: {e}")
+                    try:
+                        conn.execute("ROLLBACK")
+                    except sqlite3.Error:
+                        pass
+
+            for done in waiters:
+                done.set()
+
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error:
+            pass
+        conn.close()
+
+    def migrate(self, stats, achievements, cubes, settings):
+        """One-time import of the old text save files, in a single transaction."""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while we were waiting for the lock
+            if conn.execute("SELECT 1 FROM profile WHERE section = ? AND key = 'schema_version'", (SECTION_META,)).fetchone():
+                conn.execute("COMMIT")
+                return False
+
+            rows = [(SECTION_STATS, key, json.dumps(value)) for key, value in stats.items()]
+            rows += [(SECTION_ACHIEVEMENT, str(a['id']), json.dumps(a)) for a in achievements]
+            rows += [(SECTION_CUBE, str(c['id']), json.dumps(dict(c, unlocked=c.get('unlocked', True)))) for c in cubes]
+            rows += [(SECTION_SETTING, key, json.dumps(value)) for key, value in settings.items()]
+            rows.append((SECTION_META, 'schema_version', json.dumps(SCHEMA_VERSION)))
+            rows.append((SECTION_META, 'migrated_at', json.dumps(time.time())))
+
+            conn.executemany(
+                "INSERT INTO profile (section, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (section, key) DO UPDATE SET value = excluded.value", rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def close(self):
+        """Commits what is queued and stops the writer. put(), execute() and flush() raise after this."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._writer.join()
+        self.conn.close()
+
+
+def main():
+    import Greg
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'dump'
+    store = Greg.open_save_store()
+    if command == 'migrate':
+        store.execute("DELETE FROM profile WHERE section = ? AND key = 'schema_version'", (SECTION_META,))
+        store.flush()
+        Greg.migrate_text_saves()
+        print("Re-imported the text save files.")
+    elif command == 'set':
+        if len(sys.argv) != 4:
+            print("Error: usage: Save_store.py set <setting> <json value>")
+            return 1
+        try:
+            value = json.loads(sys.argv[3])
+        except ValueError:
+            value = sys.argv[3]
+        store.put(SECTION_SETTING, sys.argv[2], value)
+        store.flush()
+    profile = store.load_profile()
+    print(json.dumps(profile, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    sys.exit(main())
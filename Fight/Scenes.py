@@ -0,0 +1,202 @@
+"""
+Scene manager for Cube Combat.
+
+Greg still picks the scene with the `current_scene` string; the manager
+notices when it changes and runs the old scene's exit hook and the new
+scene's enter hook. Each scene gets a cache dict, filled once by its build
+function, that holds its layout (button Rects, grid Rects) and its
+pre-rendered static layers. The per-frame scene function then only blits
+the layers and draws what actually changes, such as hover colours or
+selection borders.
+
+After every switch, the builds for the scenes the player is likely to open
+next are queued on a background thread. For example, leaving the main menu
+for mode select starts building the roster gallery and the arena. Build
+functions only create Surfaces and render text (with this thread's own
+Fonts, see font()). Surfaces the build puts in cache['layers'] are
+convert()ed on the main thread once the build is done, spread over the
+following frames, and the scene's ready hook runs then too (for main-thread
+work such as handing the results to Greg's own caches). Images a scene
+lists in `assets` are prefetched through the game's AssetManager at the
+same time, so the scene's assets.get() calls find them decoded. By the
+time the player clicks, the next scene's cache is normally ready, so its
+first frame costs the same as any other.
+
+    scenes = SceneManager(game)
+    scenes.add('menu', 'main_menu', build=build_main_menu, next_scenes=('mode_select',))
+    ...
+    while running:
+        scenes.run_frame(dt)
+
+Scene functions are looked up on the game module by name every frame, so
+wrappers installed later (Alloc_probe) still apply.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pygame
+
+_local = threading.local()
+
+
+def font(size):
+    """pygame's default font at `size`, cached per thread (a Font must not be shared between threads)."""
+    fonts = getattr(_local, 'fonts', None)
+    if fonts is None:
+        fonts = _local.fonts = {}
+    text_font = fonts.get(size)
+    if text_font is None:
+        text_font = fonts[size] = pygame.font.Font(None, size)
+    return text_font
+
+
+def render_text(text, font_size, color, x, y, align='center'):
+    """Renders text placed the way Greg.draw_text places it. Returns (surface, rect)."""
+    text_surface = font(font_size).render(text, True, color)
+    text_rect = text_surface.get_rect()
+
+    if align == 'center':
+        text_rect.center = (x, y)
+    elif align == 'left':
+        text_rect.topleft = (x, y)
+    elif align == 'right':
+        text_rect.topright = (x, y)
+
+    return text_surface, text_rect
+
+
+class Scene:
+    def __init__(self, name, function, build=None, ready=None, enter=None, exit=None, next_scenes=(), timed=False,
+                 assets=()):
+        self.name = name
+        self.function = function        # name of the per-frame function on the game module
+        self.build = build              # build(cache), may run on the preload thread
+        self.ready = ready              # ready(cache), main thread, once per finished build
+        self.enter = enter              # enter(cache), main thread
+        self.exit = exit                # exit(cache), main thread
+        self.next_scenes = next_scenes  # preloaded after entering this scene
+        self.timed = timed              # the frame function takes dt
+        self.assets = assets            # asset names to prefetch with the build, or a function returning them
+
+
+class SceneManager:
+    def __init__(self, game, preload=True):
+        self.game = game
+        self.scenes = {}
+        self.caches = {}        # scene -> finished (installed) cache
+        self.pending = {}       # scene -> Future of (cache, generation)
+        self.generations = {}   # bumped by invalidate() so stale builds are dropped
+        self.current = None
+        self.preload = preload
+        self.executor = None
+        self.builds = 0
+        self.blocking_builds = 0    # builds the main thread had to do (or wait for) itself
+
+    def add(self, name, function, build=None, ready=None, enter=None, exit=None, next_scenes=(), timed=False,
+            assets=()):
+        self.scenes[name] = Scene(name, function, build, ready, enter, exit, next_scenes, timed, assets)
+        self.generations.setdefault(name, 0)
+
+    # caches
+
+    def _build(self, name, generation):
+        cache = {'layers': {}}
+        build = self.scenes[name].build
+        if build is not None:
+            build(cache)
+        return cache, generation
+
+    def _install(self, name, cache):
+        if pygame.display.get_surface() is not None:
+            layers = cache['layers']
+            for key, layer in layers.items():
+                layers[key] = layer.convert_alpha() if layer.get_flags() & pygame.SRCALPHA else layer.convert()
+        ready = self.scenes[name].ready
+        if ready is not None:
+            ready(cache)
+        self.caches[name] = cache
+        self.builds += 1
+        return cache
+
+    def cache(self, name):
+        """The scene's cache, finishing (or doing) its build now if it isn't ready yet."""
+        cache = self.caches.get(name)
+        if cache is not None:
+            return cache
+        self.blocking_builds += 1
+        future = self.pending.pop(name, None)
+        if future is not None:
+            cache, generation = future.result()
+            if generation == self.generations[name]:
+                return self._install(name, cache)
+        cache, _ = self._build(name, self.generations[name])
+        return self._install(name, cache)
+
+    def invalidate(self, name):
+        """Drops the scene's cache; it is rebuilt on the next preload or visit."""
+        self.caches.pop(name, None)
+        self.pending.pop(name, None)
+        self.generations[name] += 1
+
+    def preload_scenes(self, names):
+        """Queues builds for `names`, dropping queued builds that haven't started and are no longer likely."""
+        if not self.preload:
+            return
+        for name, future in list(self.pending.items()):
+            if name not in names and future.cancel():
+                del self.pending[name]
+        for name in names:
+            scene = self.scenes.get(name)
+            if scene is not None:
+                self._prefetch(scene)
+            if scene is None or scene.build is None or name in self.caches or name in self.pending:
+                continue
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scene-preload')
+            self.pending[name] = self.executor.submit(self._build, name, self.generations[name])
+
+    def _prefetch(self, scene):
+        assets = getattr(self.game, 'assets', None)
+        if assets is None or not scene.assets:
+            return
+        assets.prefetch(scene.assets() if callable(scene.assets) else scene.assets)
+
+    def _collect(self):
+        """Installs at most one finished preload per frame, so conversions don't pile up in one frame."""
+        for name, future in self.pending.items():
+            if future.done():
+                del self.pending[name]
+                cache, generation = future.result()
+                if generation == self.generations[name]:
+                    self._install(name, cache)
+                return
+
+    # switching
+
+    def switch(self, name):
+        previous = self.scenes.get(self.current)
+        if previous is not None and previous.exit is not None:
+            previous.exit(self.caches.get(previous.name))
+        self.current = name
+        scene = self.scenes[name]
+        cache = self.cache(name)
+        if scene.enter is not None:
+            scene.enter(cache)
+        self.preload_scenes(scene.next_scenes)
+
+    def run_frame(self, dt=None):
+        name = self.game.current_scene
+        if name != self.current:
+            self.switch(name)
+        elif self.pending:
+            self._collect()
+        scene = self.scenes[name]
+        function = getattr(self.game, scene.function)
+        return function(dt) if scene.timed else function()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.pending.clear()
@@ -0,0 +1,713 @@
+"""
+Web server for the Fbt_7 site (Start.html, Html_scripts/, Js_scripts/, assets/).
+
+Every file is read once at startup into a route table keyed by the
+lower-cased URL path. The pages link to each other with inconsistent case
+('chat.html' for Chat.html, '../js_scripts/Time.js', 'styles.css'), and all
+of those links resolve. Text files (HTML, CSS, JS) are compressed once at
+startup into gzip and, when the brotli package is installed, brotli
+variants, so a request only picks the smallest variant the browser accepts.
+Requests never touch the disk.
+
+Every response carries an ETag and Last-Modified, and a matching
+If-None-Match or If-Modified-Since gets a bodiless 304. Uncompressed
+responses support single byte ranges (Range and If-Range), so the 400 KB mp3
+on Not_a_secret.html can be seeked and resumed. Connections are kept alive,
+so a browser loads a page and its CSS and JS over one socket.
+
+A small JSON API serves live data from the game's save store
+(Save_file/profile.db):
+
+    /api/stats                            kill counts, achievements and cube unlocks
+    /api/leaderboard?mode=ai&limit=10     cubes ranked by wins (mode: ai, pvp or * for all)
+    /api/history?cube=3&limit=20          recent matches for one cube
+
+API responses are cached for API_TTL_S, so many browsers polling at once
+cost one query per interval. Queries run on one database thread, so the
+event loop never blocks on SQLite.
+
+POST /api/chat is the chat page's streaming proxy to the local LLM backend
+(see Chat_proxy.py); --chat-backend '' turns it off.
+
+    python Site_server.py --port 8000
+
+--selftest serves a small generated site and a stub chat backend on free
+local ports and checks routing, gzip, ranges, validators, the API cache and
+the chat stream, cache and queue limit:
+
+    python Site_server.py --selftest
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import Chat_proxy
+import Save_store
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SITE_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+SITE_DIRS = ('Html_scripts', 'Js_scripts', 'assets')
+INDEX_PAGE = 'Start.html'
+SAVE_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Save_file', 'profile.db')
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8000
+KEEPALIVE_TIMEOUT_S = 15
+MAX_HEADER_BYTES = 16 * 1024
+API_TTL_S = 1.0
+MAX_API_LIMIT = 100
+API_ROUTES = ('/api/stats', '/api/leaderboard', '/api/history')
+CHAT_ROUTE = '/api/chat'
+CHAT_STATS_ROUTE = '/api/chat/stats'
+MAX_BODY_BYTES = 64 * 1024
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_BYTES = 256
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+STATUS_TEXT = {
+    200: 'OK', 204: 'No Content', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+    404: 'Not Found', 405: 'Method Not Allowed', 413: 'Content Too Large', 416: 'Range Not Satisfiable',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+CHAT_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+    'Access-Control-Max-Age': '86400',
+}
+
+_date_cache = [0, '']
+
+
+def http_date():
+    """The Date header, formatted at most once a second."""
+    now = int(time.time())
+    if now != _date_cache[0]:
+        _date_cache[0] = now
+        _date_cache[1] = formatdate(now, usegmt=True)
+    return _date_cache[1]
+
+
+class Resource:
+    """One response body with its validators and precompressed variants."""
+
+    def __init__(self, body, content_type, mtime, cache_control='no-cache'):
+        self.body = body
+        self.content_type = content_type
+        self.mtime = int(mtime)
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.cache_control = cache_control
+        self.encoded = {}       # 'br' / 'gzip' -> bytes, only where it is smaller
+
+    def compress(self, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+        if len(self.body) < MIN_COMPRESS_BYTES or not self.content_type.startswith(COMPRESSIBLE_TYPES):
+            return self
+        variants = {'gzip': gzip.compress(self.body, gzip_level, mtime=0)}
+        if brotli is not None:
+            variants['br'] = brotli.compress(self.body, quality=brotli_quality)
+        for encoding, data in variants.items():
+            if len(data) < len(self.body) * 0.9:
+                self.encoded[encoding] = data
+        return self
+
+
+def content_type(path):
+    guessed = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if guessed.startswith('text/') or guessed in ('application/javascript', 'application/json'):
+        guessed += '; charset=utf-8'
+    return guessed
+
+
+def load_site(root=SITE_ROOT):
+    """Lower-cased URL path -> Resource for every file the site serves."""
+    routes = {}
+    files = [INDEX_PAGE]
+    for directory in SITE_DIRS:
+        for parent, _, names in os.walk(os.path.join(root, directory)):
+            files.extend(os.path.relpath(os.path.join(parent, name), root) for name in names if not name.startswith('.'))
+
+    for relative in files:
+        path = os.path.join(root, relative)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+        except OSError:
+            continue
+        url = '/' + relative.replace(os.sep, '/').lower()
+        if url in routes:
+            print(f"Skipping {relative}: its URL collides with another file when case is ignored")
+            continue
+        kind = content_type(relative)
+        cache_control = 'no-cache' if kind.startswith('text/html') else 'public, max-age=300'
+        routes[url] = Resource(body, kind, mtime, cache_control).compress()
+
+    index = routes.get('/' + INDEX_PAGE.lower())
+    if index is not None:
+        routes['/'] = index
+    return routes
+
+
+def pick_encoding(resource, accept_encoding):
+    """The smallest precompressed variant the client accepts, or None for identity."""
+    if not resource.encoded or not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(name.strip().lower())
+    best = None
+    for encoding, data in resource.encoded.items():
+        if (encoding in accepted or '*' in accepted) and (best is None or len(data) < len(resource.encoded[best])):
+            best = encoding
+    return best
+
+
+def etag_matches(header, etag):
+    """If-None-Match / If-Range comparison, ignoring W/ and our per-encoding suffixes."""
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        tag = tag.removeprefix('W/').strip('"')
+        if tag.split('-', 1)[0] == etag:
+            return True
+    return False
+
+
+def not_modified(resource, headers):
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, resource.etag)
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return resource.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header, length):
+    """
+    (start, end) inclusive for a single 'bytes=' range, None to ignore the
+    header (malformed or multi-range: send the whole body) or False when it
+    can't be satisfied.
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return False
+            return max(0, length - suffix), length - 1
+        start = int(first)
+        end = int(last) if last else length - 1
+    except ValueError:
+        return None
+    if start >= length or end < start:
+        return False
+    return start, min(end, length - 1)
+
+
+class SiteServer:
+    def __init__(self, root=SITE_ROOT, db_path=SAVE_DB_PATH, access_log=False, chat_backend=Chat_proxy.DEFAULT_BACKEND):
+        self.root = root
+        # None disables POST /api/chat
+        self.chat = Chat_proxy.ChatProxy(chat_backend) if chat_backend else None
+        self.routes = load_site(root)
+        self.db_path = db_path
+        self.store = None
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='site-db')
+        self.api_cache = {}     # request target -> (expires, Resource)
+        self.access_log = access_log
+        self.requests = 0
+        self.server = None
+
+    # API
+
+    def _query(self, route, query):
+        """Runs on the database thread."""
+        if self.store is None:
+            self.store = Save_store.SaveStore(self.db_path)
+        store = self.store
+        limit = max(1, min(MAX_API_LIMIT, int(query.get('limit', ['10'])[0])))
+
+        if route == '/api/stats':
+            profile = store.load_profile()
+            achievements = profile[Save_store.SECTION_ACHIEVEMENT].values()
+            cubes = profile[Save_store.SECTION_CUBE].values()
+            return {
+                'kills': profile[Save_store.SECTION_STATS],
+                'achievements': {'unlocked': sum(1 for a in achievements if a.get('unlocked')), 'total': len(achievements),
+                                 'list': [{'name': a.get('name'), 'description': a.get('description'),
+                                           'unlocked': bool(a.get('unlocked'))} for a in achievements]},
+                'cubes': {'unlocked': sum(1 for c in cubes if c.get('unlocked')), 'total': len(cubes)},
+            }
+        if route == '/api/leaderboard':
+            mode = query.get('mode', [Save_store.MODE_ALL])[0]
+            return {'mode': mode, 'cubes': store.leaderboard(mode, limit)}
+        if route == '/api/history':
+            cube_id = int(query['cube'][0])
+            return {'cube': cube_id, 'matches': store.match_history(cube_id, limit)}
+        raise KeyError(route)
+
+    async def api(self, target):
+        cached = self.api_cache.get(target)
+        now = time.monotonic()
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        parts = urlsplit(target)
+        route = parts.path.lower().rstrip('/')
+        query = parse_qs(parts.query)
+        data = await asyncio.get_running_loop().run_in_executor(self.db_executor, self._query, route, query)
+        body = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+        resource = Resource(body, 'application/json; charset=utf-8', time.time(), 'no-cache').compress(gzip_level=6, brotli_quality=5)
+        if len(self.api_cache) > 256:
+            self.api_cache.clear()
+        self.api_cache[target] = (now + API_TTL_S, resource)
+        return resource
+
+    # HTTP
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT_S)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, 400, keep_alive=False)
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ')
+                except ValueError:
+                    await self.send_error(writer, 400, keep_alive=False)
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(':')
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    await self.send_error(writer, 400, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.send_error(writer, 413, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = 'close' not in connection if version == 'HTTP/1.1' else 'keep-alive' in connection
+                self.requests += 1
+                status = await self.respond(writer, method, target, headers, body, keep_alive)
+                if self.access_log:
+                    print(f"{method} {target} {status}")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, method, target, headers, body, keep_alive):
+        path = unquote(urlsplit(target).path).lower()
+        if path.rstrip('/') == CHAT_ROUTE and self.chat is not None:
+            return await self.respond_chat(writer, method, body, keep_alive)
+        if method not in ('GET', 'HEAD'):
+            return await self.send_error(writer, 405, keep_alive, extra={'Allow': 'GET, HEAD'})
+
+        if path.rstrip('/') == CHAT_STATS_ROUTE and self.chat is not None:
+            data = json.dumps(self.chat.stats()).encode('utf-8')
+            return await self.send(writer, 200, {'Content-Type': 'application/json; charset=utf-8', 'Cache-Control': 'no-store'},
+                                   data, keep_alive, method == 'HEAD')
+        if path.startswith('/api/'):
+            try:
+                resource = await self.api(target)
+            except (KeyError, ValueError):
+                return await self.send_error(writer, 404 if path.rstrip('/') not in API_ROUTES else 400, keep_alive)
+            except sqlite3.Error as e:
+                print(f"Stats query failed for {target}: {e}")
+                return await self.send_error(writer, 500, keep_alive)
+        else:
+            resource = self.routes.get(path)
+            if resource is None:
+                return await self.send_error(writer, 404, keep_alive)
+
+        response_headers = {
+            'Content-Type': resource.content_type,
+            'Last-Modified': resource.last_modified,
+            'Cache-Control': resource.cache_control,
+        }
+        if resource.encoded:
+            response_headers['Vary'] = 'Accept-Encoding'
+
+        encoding = pick_encoding(resource, headers.get('accept-encoding'))
+        response_headers['ETag'] = f'"{resource.etag}-{encoding}"' if encoding else f'"{resource.etag}"'
+
+        if not_modified(resource, headers):
+            return await self.send(writer, 304, response_headers, b'', keep_alive, head_only=True)
+
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+            return await self.send(writer, 200, response_headers, resource.encoded[encoding], keep_alive, method == 'HEAD')
+
+        body = resource.body
+        response_headers['Accept-Ranges'] = 'bytes'
+        range_header = headers.get('range')
+        if_range = headers.get('if-range')
+        if range_header and (if_range is None or etag_matches(if_range, resource.etag) or if_range == resource.last_modified):
+            byte_range = parse_range(range_header, len(body))
+            if byte_range is False:
+                return await self.send_error(writer, 416, keep_alive, extra={'Content-Range': f'bytes */{len(body)}'})
+            if byte_range is not None:
+                start, end = byte_range
+                response_headers['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+                return await self.send(writer, 206, response_headers, memoryview(body)[start:end + 1], keep_alive, method == 'HEAD')
+
+        return await self.send(writer, 200, response_headers, body, keep_alive, method == 'HEAD')
+
+    async def respond_chat(self, writer, method, body, keep_alive):
+        """POST /api/chat streams through Chat_proxy; CORS is allowed so a Chat.html opened from disk works too."""
+        if method == 'OPTIONS':
+            return await self.send(writer, 204, dict(CHAT_CORS_HEADERS), b'', keep_alive)
+        if method != 'POST':
+            return await self.send_error(writer, 405, keep_alive, extra={'Allow': 'POST, OPTIONS'})
+        try:
+            prompt, model = Chat_proxy.parse_request(body)
+        except ValueError as e:
+            return await self.send(writer, 400, {'Content-Type': 'text/plain; charset=utf-8', **CHAT_CORS_HEADERS},
+                                   f'{e}\n'.encode('utf-8'), keep_alive)
+        if self.chat.full():
+            return await self.send_error(writer, 503, keep_alive, extra={'Retry-After': '5', **CHAT_CORS_HEADERS})
+        return await self.chat.stream(writer, prompt, model, keep_alive)
+
+    async def send(self, writer, status, headers, body, keep_alive, head_only=False):
+        lines = [f'HTTP/1.1 {status} {STATUS_TEXT[status]}', f'Date: {http_date()}']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        if status not in (204, 304):
+            lines.append(f'Content-Length: {len(body)}')
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body and not head_only:
+            writer.write(body)
+        await writer.drain()
+        return status
+
+    async def send_error(self, writer, status, keep_alive=True, extra=None):
+        body = f'{status} {STATUS_TEXT[status]}\n'.encode('ascii')
+        headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        headers.update(extra or {})
+        return await self.send(writer, status, headers, body, keep_alive)
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        if self.chat is not None:
+            await self.chat.start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.db_executor.shutdown(wait=True)
+        if self.chat is not None:
+            self.chat.close()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+async def serve(host, port, root, db_path, access_log, chat_backend):
+    site = SiteServer(root, db_path, access_log, chat_backend)
+    server = await site.start(host, port)
+    total = sum(len(resource.body) for resource in site.routes.values())
+    compressed = sum(1 for resource in site.routes.values() if resource.encoded)
+    print(f"Serving {len(site.routes)} routes ({total / 1024:.0f} KB, {compressed} precompressed"
+          f"{'' if brotli is not None else ', gzip only: install brotli for br'}) on http://{host}:{port}/")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        site.close()
+
+
+# self-test
+
+SELFTEST_PAGE = ('<!DOCTYPE html>\n<html><head><link rel="stylesheet" href="styles.css"></head><body>\n'
+                 + '<p>Cube Combat, a fight between two cubes.</p>\n' * 40 + '</body></html>\n').encode('utf-8')
+SELFTEST_SCRIPT = ('// clock\n' + 'document.title = new Date().toLocaleTimeString();\n' * 20).encode('utf-8')
+SELFTEST_AUDIO_BYTES = 4096
+SELFTEST_STUB_DELAY_S = 0.02
+SELFTEST_TIMEOUT_S = 60
+
+
+def _check(results, what, ok):
+    print(f"{'ok  ' if ok else 'FAIL'} {what}")
+    results.append(ok)
+
+
+def _write_site(root):
+    """Start.html, a page, a script and an mp3 under `root`, with the case the real site uses."""
+    files = {
+        INDEX_PAGE: SELFTEST_PAGE,
+        os.path.join('Html_scripts', 'Chat.html'): SELFTEST_PAGE.replace(b'Cube Combat', b'Chat with the cube'),
+        os.path.join('Js_scripts', 'Time.js'): SELFTEST_SCRIPT,
+        os.path.join('assets', 'song.mp3'): os.urandom(SELFTEST_AUDIO_BYTES),
+    }
+    for relative, body in files.items():
+        path = os.path.join(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(body)
+    return files
+
+
+async def _fetch(port, method, target, headers=None, body=b''):
+    """(status, headers, body) for one request on its own connection. A chunked body comes back as
+    a list of (seconds since the request, chunk), so a stream's timing can be checked."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    lines = [f'{method} {target} HTTP/1.1', 'Host: selftest', 'Connection: close']
+    lines.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+    if body:
+        lines.append(f'Content-Length: {len(body)}')
+    started = time.perf_counter()
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+    try:
+        status, response_headers = await Chat_proxy.read_response_head(reader)
+        if 'chunked' in response_headers.get('transfer-encoding', ''):
+            data = [(time.perf_counter() - started, chunk) async for chunk in Chat_proxy.iter_body(reader, response_headers)]
+        else:
+            data = await reader.read()
+    finally:
+        writer.close()
+    return status, response_headers, data
+
+
+def _events(chunks):
+    """(seconds, event name, data) for each server-sent event; unnamed events are 'message'."""
+    events = []
+    for at, chunk in chunks:
+        for text in chunk.decode('utf-8').split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in text.split('\n') if ': ' in line)
+            if 'data' in fields:
+                events.append((at, fields.get('event', 'message'), json.loads(fields['data'])))
+    return events
+
+
+async def _selftest_static(results, port, files):
+    page = files[INDEX_PAGE]
+    script = files[os.path.join('Js_scripts', 'Time.js')]
+    audio = files[os.path.join('assets', 'song.mp3')]
+
+    status, headers, body = await _fetch(port, 'GET', '/')
+    _check(results, "/ serves Start.html", status == 200 and body == page and headers.get('content-type', '').startswith('text/html'))
+    etag = headers.get('etag', '').strip('"')
+    last_modified = headers.get('last-modified')
+    _check(results, "a response carries an ETag and Last-Modified", bool(etag) and bool(last_modified))
+
+    for target, expected in (('/html_scripts/chat.html', files[os.path.join('Html_scripts', 'Chat.html')]),
+                             ('/Html_scripts/Chat.html', files[os.path.join('Html_scripts', 'Chat.html')]),
+                             ('/js_scripts/time.js', script)):
+        status, _, body = await _fetch(port, 'GET', target)
+        _check(results, f"{target} resolves whatever its case", status == 200 and body == expected)
+    status, _, _ = await _fetch(port, 'GET', '/html_scripts/missing.html')
+    _check(results, "an unknown path is a 404", status == 404)
+    status, headers, _ = await _fetch(port, 'POST', '/start.html', body=b'x')
+    _check(results, "POST to a page is a 405 naming GET and HEAD", status == 405 and headers.get('allow') == 'GET, HEAD')
+    status, headers, body = await _fetch(port, 'HEAD', '/start.html')
+    _check(results, "HEAD has the length but no body", status == 200 and body == b'' and headers.get('content-length') == str(len(page)))
+
+    status, headers, body = await _fetch(port, 'GET', '/start.html', {'Accept-Encoding': 'gzip'})
+    _check(results, "gzip is sent when accepted and decompresses to the page",
+           status == 200 and headers.get('content-encoding') == 'gzip' and len(body) < len(page)
+           and gzip.decompress(body) == page and headers.get('vary') == 'Accept-Encoding')
+    gzip_etag = headers.get('etag')
+    status, headers, body = await _fetch(port, 'GET', '/start.html', {'Accept-Encoding': 'gzip;q=0'})
+    _check(results, "gzip;q=0 gets the identity body", status == 200 and 'content-encoding' not in headers and body == page)
+    status, headers, _ = await _fetch(port, 'GET', '/assets/song.mp3', {'Accept-Encoding': 'gzip'})
+    _check(results, "an mp3 is never compressed", status == 200 and 'content-encoding' not in headers)
+
+    status, headers, body = await _fetch(port, 'GET', '/start.html', {'If-None-Match': f'"{etag}"'})
+    _check(results, "a matching If-None-Match is a bodiless 304", status == 304 and body == b'')
+    status, _, body = await _fetch(port, 'GET', '/start.html', {'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag})
+    _check(results, "the gzip variant's ETag revalidates too", status == 304 and body == b'')
+    status, _, body = await _fetch(port, 'GET', '/start.html', {'If-Modified-Since': last_modified})
+    _check(results, "If-Modified-Since at Last-Modified is a 304", status == 304 and body == b'')
+    status, _, body = await _fetch(port, 'GET', '/start.html', {'If-None-Match': '"0000000000000000"'})
+    _check(results, "a stale If-None-Match gets the page", status == 200 and body == page)
+
+    status, headers, body = await _fetch(port, 'GET', '/assets/song.mp3', {'Range': 'bytes=100-199'})
+    _check(results, "bytes=100-199 is a 206 with those bytes",
+           status == 206 and body == audio[100:200] and headers.get('content-range') == f'bytes 100-199/{len(audio)}')
+    status, headers, body = await _fetch(port, 'GET', '/assets/song.mp3', {'Range': 'bytes=-10'})
+    _check(results, "bytes=-10 is the last ten bytes", status == 206 and body == audio[-10:])
+    status, headers, _ = await _fetch(port, 'GET', '/assets/song.mp3', {'Range': f'bytes={len(audio)}-'})
+    _check(results, "a range past the end is a 416 with the length",
+           status == 416 and headers.get('content-range') == f'bytes */{len(audio)}')
+    status, _, body = await _fetch(port, 'GET', '/assets/song.mp3', {'Range': 'bytes=0-9', 'If-Range': '"0000000000000000"'})
+    _check(results, "a stale If-Range gets the whole file", status == 200 and body == audio)
+
+
+async def _selftest_api(results, port, site):
+    queries = []
+    query = site._query
+
+    def counted(route, args):
+        queries.append(route)
+        return query(route, args)
+
+    site._query = counted
+    first = await _fetch(port, 'GET', '/api/stats')
+    second = await _fetch(port, 'GET', '/api/stats')
+    _check(results, "/api/stats answers JSON", first[0] == 200 and 'kills' in json.loads(first[2]))
+    _check(results, "a repeat within API_TTL_S is served from the cache without a query",
+           second[0] == 200 and second[2] == first[2] and second[1].get('etag') == first[1].get('etag') and len(queries) == 1)
+    status, _, _ = await _fetch(port, 'GET', '/api/nothing')
+    _check(results, "an unknown API route is a 404", status == 404)
+    status, _, _ = await _fetch(port, 'GET', '/api/history?cube=blue')
+    _check(results, "a bad API argument is a 400", status == 400)
+
+
+async def _chat(port, prompt):
+    return await _fetch(port, 'POST', CHAT_ROUTE, {'Content-Type': 'application/json'},
+                        json.dumps({'prompt': prompt, 'model': 'stub'}).encode('utf-8'))
+
+
+async def _selftest_chat(results, port, site):
+    chat = site.chat
+    words = Chat_proxy.stub_words('hello')
+
+    status, headers, chunks = await _chat(port, 'hello')
+    events = _events(chunks)
+    kinds = [kind for _, kind, _ in events]
+    tokens = [data['token'] for _, kind, data in events if kind == 'message']
+    _check(results, "a chat reply is an event stream",
+           status == 200 and headers.get('content-type', '').startswith('text/event-stream'))
+    _check(results, "tokens arrive in the backend's order, one event each, then done",
+           tokens == words and kinds == ['message'] * len(words) + ['done'] and events[-1][2].get('cached') is False)
+    first_token, done = events[0][0], events[-1][0]
+    _check(results, "the first token is sent before the reply is finished",
+           done - first_token >= (len(words) - 2) * SELFTEST_STUB_DELAY_S)
+
+    opened = chat.pool.opened
+    status, _, chunks = await _chat(port, 'hello')
+    events = _events(chunks)
+    _check(results, "a repeated prompt is answered from the cache in one token",
+           status == 200 and [kind for _, kind, _ in events] == ['message', 'done']
+           and events[0][2].get('token') == ''.join(words) and events[1][2].get('cached') is True)
+    _check(results, "the cache hit is counted and never reaches the backend",
+           chat.stats()['cache_hits'] == 1 and chat.pool.opened == opened)
+
+    status, _, body = await _fetch(port, 'POST', CHAT_ROUTE, {'Content-Type': 'application/json'}, b'{"prompt": ""}')
+    _check(results, "an empty prompt is a 400", status == 400)
+    status, headers, _ = await _fetch(port, 'OPTIONS', CHAT_ROUTE)
+    _check(results, "OPTIONS is a CORS 204", status == 204 and headers.get('access-control-allow-origin') == '*')
+
+    # one reply streaming and one queued behind it fill the queue, so a third is turned away
+    running = asyncio.create_task(_chat(port, 'first in line'))
+    queued = asyncio.create_task(_chat(port, 'second in line'))
+    while chat.waiting < chat.max_queued:
+        await asyncio.sleep(0.005)
+    status, headers, body = await _chat(port, 'third in line')
+    _check(results, "a full queue is a 503 with Retry-After", status == 503 and headers.get('retry-after') == '5')
+    running, queued = await running, await queued
+    events = _events(queued[2])
+    _check(results, "the queued request is told its position, then streams",
+           running[0] == 200 and queued[0] == 200 and events[0][1] == 'queued' and events[0][2] == {'position': 1}
+           and events[-1][1] == 'done')
+
+    status, _, body = await _fetch(port, 'GET', CHAT_STATS_ROUTE)
+    stats = json.loads(body) if status == 200 else {}
+    _check(results, "/api/chat/stats counts every streamed request",
+           stats.get('requests') == 4 and stats.get('cache_hits') == 1 and stats.get('backend_errors') == 0)
+
+
+async def _selftest(root, db_path):
+    results = []
+    files = _write_site(root)
+    stub = await Chat_proxy.start_stub('127.0.0.1', 0, SELFTEST_STUB_DELAY_S)
+    backend = 'http://127.0.0.1:%d' % stub.sockets[0].getsockname()[1]
+    site = SiteServer(root, db_path, chat_backend=backend)
+    # one slot and one place in line, so the queue limit is reached with three requests
+    site.chat = Chat_proxy.ChatProxy(backend, max_concurrent=1, max_queued=1)
+    server = await site.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        await asyncio.wait_for(_selftest_static(results, port, files), SELFTEST_TIMEOUT_S)
+        await asyncio.wait_for(_selftest_api(results, port, site), SELFTEST_TIMEOUT_S)
+        await asyncio.wait_for(_selftest_chat(results, port, site), SELFTEST_TIMEOUT_S)
+    finally:
+        site.close()
+        stub.close()
+        await asyncio.sleep(0.1)     # lets the stub see the pooled connections close before the loop ends
+    return results
+
+
+def selftest():
+    """Routing, gzip, ranges, validators, the API cache and the chat proxy against a generated site."""
+    with tempfile.TemporaryDirectory(prefix='site-selftest-') as root:
+        results = asyncio.run(_selftest(root, os.path.join(root, 'profile.db')))
+    print("SELFTEST", "PASS" if all(results) else "FAIL")
+    return 0 if all(results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Fbt_7 site and the game's stats API")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--root', default=SITE_ROOT)
+    parser.add_argument('--db', default=SAVE_DB_PATH)
+    parser.add_argument('--log', action='store_true', help="print one line per request")
+    parser.add_argument('--chat-backend', default=Chat_proxy.DEFAULT_BACKEND,
+                        help="LLM backend for /api/chat ('' turns the chat proxy off)")
+    parser.add_argument('--selftest', action='store_true', help="check the server and chat proxy on free local ports")
+    args = parser.parse_args()
+    if args.selftest:
+        return selftest()
+    try:
+        asyncio.run(serve(args.host, args.port, args.root, args.db, args.log, args.chat_backend))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
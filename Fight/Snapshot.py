@@ -0,0 +1,208 @@
+"""
+Save/restore of the full Cube Combat simulation state.
+
+A snapshot is the game_state dict plus the module globals the simulation
+reads (selected_mode, is_debug_mode, cube_stats, whether the red cube's
+mode has been logged yet), packed with one
+struct.pack_into call into a fixed-size slice of a preallocated bytearray.
+Strings become small codes and purple_hitbox_rect becomes four ints, so a
+snapshot is a couple of hundred bytes and restoring it does not build any
+new dicts.
+
+    ring = SnapshotRing(60)
+    ring.save(frame)
+    ...
+    ring.load(frame)
+
+Pass include_rng=True to also capture Greg.rng, which AI matches need for
+exact resimulation. Run this file to benchmark it.
+"""
+
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import struct
+import time
+from array import array
+from operator import itemgetter
+
+import pygame
+
+import Combat_log
+import Greg
+
+BOOL_FIELDS = ('blue_active', 'red_active', 'game_over', 'purple_hitbox_active', 'ai_cyan_beam_active', 'parry_active',
+               'parry_buffered')
+INT_FIELDS = ('blue_health', 'red_health', 'attack_damage', 'move_speed', 'flash_count')
+FLOAT_FIELDS = (
+    'blue_x', 'blue_y', 'red_x', 'red_y',
+    'flash_timer', 'charge_dx', 'charge_dy', 'endlag_timer',
+    'hitbox_timer', 'special_attack_cooldown_timer',
+    'ai_beam_angle', 'ai_hitbox_timer', 'ai_special_attack_cooldown_timer',
+    'parry_timer', 'parry_buffer_until', 'match_time',
+)
+PLAIN_FIELDS = BOOL_FIELDS + INT_FIELDS + FLOAT_FIELDS
+
+# field -> every value it can hold; stored as the index into this tuple
+CODED_FIELDS = {
+    'charge_state': Greg.CHARGE_STATES,
+    'ai_attack_state': Greg.AI_ATTACK_STATES,
+    'red_cube_mode': Greg.RED_CUBE_MODES,
+    'last_direction': Greg.DIRECTIONS,
+    'ai_last_direction': Greg.DIRECTIONS,
+}
+SELECTED_MODES = (None, 'ai', 'pvp')
+
+RECT_FIELDS = ('purple_hitbox_rect',)
+
+STATE_STRUCT = struct.Struct(
+    '<'
+    + '?' * len(BOOL_FIELDS)
+    + 'q' * len(INT_FIELDS)
+    + 'd' * len(FLOAT_FIELDS)
+    + 'B' * len(CODED_FIELDS)
+    + '?iiii'   # purple_hitbox_rect: present, x, y, w, h
+    + 'B?qq?'   # selected_mode, is_debug_mode, red_kills, blue_kills, red_cube_mode logged
+)
+STATE_SIZE = STATE_STRUCT.size
+
+RNG_STRUCT = struct.Struct('<625I')
+RNG_SIZE = RNG_STRUCT.size
+
+
+def _check_layout():
+    """Fails loudly if game_state grows a key this module doesn't know how to store."""
+    covered = set(PLAIN_FIELDS) | set(CODED_FIELDS) | set(RECT_FIELDS)
+    missing = set(Greg.initial_game_state) - covered
+    if missing:
+        raise RuntimeError(f"Snapshot layout is missing game_state keys: {sorted(missing)}")
+
+_check_layout()
+
+_get_plain = itemgetter(*PLAIN_FIELDS)
+_CODED_KEYS = tuple(CODED_FIELDS)
+_ENCODE = tuple({value: i for i, value in enumerate(values)} for values in CODED_FIELDS.values())
+_DECODE = tuple(CODED_FIELDS.values())
+_MODE_CODES = {mode: i for i, mode in enumerate(SELECTED_MODES)}
+
+_CODED_START = len(PLAIN_FIELDS)
+_RECT_START = _CODED_START + len(CODED_FIELDS)
+_GLOBALS_START = _RECT_START + 5
+
+_NO_RECT = (False, 0, 0, 0, 0)
+
+
+def capture(buffer, offset=0, include_rng=False):
+    """Packs the current simulation state into buffer[offset:offset + snapshot_size(include_rng)]."""
+    s = Greg.game_state
+    rect = s['purple_hitbox_rect']
+    stats = Greg.cube_stats
+    encode = _ENCODE
+    STATE_STRUCT.pack_into(
+        buffer, offset,
+        *_get_plain(s),
+        encode[0][s['charge_state']],
+        encode[1][s['ai_attack_state']],
+        encode[2][s['red_cube_mode']],
+        encode[3][s['last_direction']],
+        encode[4][s['ai_last_direction']],
+        *(_NO_RECT if rect is None else (True, rect.x, rect.y, rect.w, rect.h)),
+        _MODE_CODES[Greg.selected_mode], Greg.is_debug_mode, stats['red_kills'], stats['blue_kills'],
+        Greg.logged_red_cube_mode == s['red_cube_mode'],
+    )
+    if include_rng:
+        RNG_STRUCT.pack_into(buffer, offset + STATE_SIZE, *Greg.rng.getstate()[1])
+
+
+def restore(buffer, offset=0, include_rng=False):
+    """Writes a snapshot taken by capture() back into Greg's game_state and globals."""
+    values = STATE_STRUCT.unpack_from(buffer, offset)
+    s = Greg.game_state
+    s.update(zip(PLAIN_FIELDS, values))
+
+    decode = _DECODE
+    for i, key in enumerate(_CODED_KEYS):
+        s[key] = decode[i][values[_CODED_START + i]]
+
+    present, x, y, w, h = values[_RECT_START:_GLOBALS_START]
+    if not present:
+        s['purple_hitbox_rect'] = None
+    elif s['purple_hitbox_rect'] is None:
+        s['purple_hitbox_rect'] = pygame.Rect(x, y, w, h)
+    else:
+        # every game state owns its own hitbox rect, so it can be updated in place
+        s['purple_hitbox_rect'].update(x, y, w, h)
+
+    mode, debug, red_kills, blue_kills, mode_logged = values[_GLOBALS_START:]
+    Greg.selected_mode = SELECTED_MODES[mode]
+    Greg.is_debug_mode = debug
+    Greg.cube_stats['red_kills'] = red_kills
+    Greg.cube_stats['blue_kills'] = blue_kills
+    # so events re-emitted after a rollback carry the restored frame's time and mode changes
+    Greg.logged_red_cube_mode = s['red_cube_mode'] if mode_logged else None
+    Combat_log.match_time = s['match_time']
+
+    if include_rng:
+        Greg.rng.setstate((3, RNG_STRUCT.unpack_from(buffer, offset + STATE_SIZE), None))
+
+
+def snapshot_size(include_rng=False):
+    return STATE_SIZE + (RNG_SIZE if include_rng else 0)
+
+
+class SnapshotRing:
+    """Keeps the last `capacity` frames of snapshots in one preallocated bytearray."""
+
+    def __init__(self, capacity, include_rng=False):
+        self.capacity = capacity
+        self.include_rng = include_rng
+        self.slot_size = snapshot_size(include_rng)
+        self.buffer = bytearray(capacity * self.slot_size)
+        self.frames = array('q', [-1] * capacity)
+
+    def save(self, frame):
+        slot = frame % self.capacity
+        capture(self.buffer, slot * self.slot_size, self.include_rng)
+        self.frames[slot] = frame
+
+    def load(self, frame):
+        slot = frame % self.capacity
+        if self.frames[slot] != frame:
+            raise KeyError(f"No snapshot for frame {frame} (slot holds {self.frames[slot]})")
+        restore(self.buffer, slot * self.slot_size, self.include_rng)
+
+    def has(self, frame):
+        return self.frames[frame % self.capacity] == frame
+
+    def view(self, frame):
+        """Read-only bytes of a stored snapshot, e.g. for checksums or sending over the wire."""
+        start = (frame % self.capacity) * self.slot_size
+        return memoryview(self.buffer)[start:start + self.slot_size]
+
+    def clear(self):
+        for i in range(self.capacity):
+            self.frames[i] = -1
+
+
+def benchmark(cycles=100000):
+    Greg.selected_mode = 'ai'
+    Greg.reset_game_state(keep_stats=True)
+    Greg.do_special_attack_blue()  # so the hitbox rect path is exercised too
+
+    for include_rng in (False, True):
+        ring = SnapshotRing(64, include_rng=include_rng)
+        start = time.perf_counter()
+        for frame in range(cycles):
+            ring.save(frame)
+            ring.load(frame)
+        elapsed = time.perf_counter() - start
+        per_cycle = elapsed / cycles
+        label = "with rng" if include_rng else "state only"
+        print(f"{label}: {ring.slot_size} bytes, {per_cycle * 1e6:.2f} us per save+restore, "
+              f"{int((1 / 60) / per_cycle)} cycles per 60 Hz frame")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,333 @@
+"""
+Soak test for Cube Combat: runs the headless simulation for tens of
+millions of frames and watches for slow leaks and drift.
+
+Rounds are played back to back, alternating AI and PvP, with scripted
+inputs (Inputs.scripted_input) for every human side. Every --draw-every
+frames the arena is also drawn onto the dummy display, so the render path
+(get_ai_beam_rect, the HUD, draw_text) is exercised too.
+
+While it runs it keeps:
+    frame latency percentiles, from a fixed log-scale histogram (no per-frame samples kept)
+    RSS and Python's allocated block count at every sample point
+    live object counts by type, including untracked objects such as Rects
+        and Surfaces that are only reachable from containers
+    the most negative value seen for each game_state timer
+
+At the end, any type whose count grows steadily across the run, any RSS
+growth, and any timer that ran more than a frame below zero is flagged.
+Growth is measured only after a warm-up (WARMUP_FRAMES, or the first
+quarter of the run if that is longer), while caches and baked arena chunks
+are still filling. RSS moves in allocator-sized steps, so its slope only
+fails a run that has RSS_GATE_MIN_FRAMES left after the warm-up; shorter
+runs report it without judging it. A run too short to sample any growth
+after the warm-up is INCONCLUSIVE (exit status 2) unless something else
+already failed it.
+
+    python Soak.py --frames 20000000 --sample-every 250000
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import gc
+import json
+import math
+import random
+import resource
+import time
+from array import array
+from collections import Counter
+
+import Inputs
+import Replay
+
+FRAME_MS = 1000 / 60
+MAX_ROUND_FRAMES = 60 * 60 * 3
+DEFAULT_FRAMES = 10_000_000
+DEFAULT_SAMPLE_EVERY = 250_000
+DEFAULT_DRAW_EVERY = 10
+
+TIMER_KEYS = ('flash_timer', 'endlag_timer', 'hitbox_timer', 'special_attack_cooldown_timer',
+              'ai_hitbox_timer', 'ai_special_attack_cooldown_timer', 'parry_timer')
+
+# latency histogram: bucket i covers [2 ** (i / BUCKETS_PER_OCTAVE), 2 ** ((i + 1) / BUCKETS_PER_OCTAVE)) ns
+BUCKETS_PER_OCTAVE = 8
+HISTOGRAM_BUCKETS = 40 * BUCKETS_PER_OCTAVE
+
+GROWTH_MIN_PER_MILLION = 20     # objects per million frames before a type counts as growing (a round is ~6000 frames)
+RSS_GROWTH_MIN_KB_PER_MILLION = 2048
+WARMUP_FRAMES = 500_000         # samples before this are left out of every slope
+RSS_GATE_MIN_FRAMES = 2_000_000     # a 2 MB allocator step over fewer frames than this already looks like a leak
+WATCHED_TYPES = ('Rect', 'Surface', 'Font', 'Event', 'dict', 'list', 'tuple', 'float', 'function')
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * HISTOGRAM_BUCKETS))
+        self.total = 0
+        self.max_ns = 0
+
+    def add(self, ns):
+        if ns > self.max_ns:
+            self.max_ns = ns
+        bucket = int(math.log2(ns) * BUCKETS_PER_OCTAVE) if ns > 1 else 0
+        self.counts[min(bucket, HISTOGRAM_BUCKETS - 1)] += 1
+        self.total += 1
+
+    def percentile(self, p):
+        """Upper edge of the bucket holding the p-th percentile, in microseconds."""
+        if not self.total:
+            return 0.0
+        target = self.total * p / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return 2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE) / 1000
+        return self.max_ns / 1000
+
+
+def rss_kb():
+    """Current resident set size; falls back to the peak where /proc isn't available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _footprint(obj, ids):
+    """Ids of obj and everything nested in it (dicts and lists only)."""
+    ids.add(id(obj))
+    children = obj.values() if isinstance(obj, dict) else obj if isinstance(obj, list) else ()
+    for child in children:
+        _footprint(child, ids)
+    return ids
+
+
+def count_objects(ignore=()):
+    """
+    Live objects by type name, leaving out `ignore` and what it holds (the
+    soak's own samples). gc only tracks containers, so untracked objects
+    (Rects, Surfaces, floats...) are counted through the containers that hold them.
+    """
+    gc.collect()
+    counts = Counter()
+    seen = _footprint(ignore, set()) if ignore else set()
+    seen.add(id(seen))
+    seen.add(id(counts))
+    for obj in gc.get_objects():
+        if id(obj) in seen:
+            continue
+        counts[type(obj).__name__] += 1
+        for ref in gc.get_referents(obj):
+            if not gc.is_tracked(ref) and id(ref) not in seen:
+                seen.add(id(ref))
+                counts[type(ref).__name__] += 1
+    return counts
+
+
+def slope(xs, ys):
+    """Least-squares slope of ys over xs."""
+    n = len(xs)
+    if n < 2:
+        return 0.0
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if not var:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+
+def growth_report(samples, warmup_fraction=0.25, warmup_frames=WARMUP_FRAMES):
+    """
+    Types and RSS that keep growing after warm-up: ({name: per-million-frame
+    slope}, RSS slope, number of frames the slopes were fitted over).
+    """
+    if not samples:
+        return {}, 0.0, 0
+    warmup = max(samples[-1]['frame'] * warmup_fraction, warmup_frames)
+    steady = [sample for sample in samples if sample['frame'] >= warmup]
+    if len(steady) < 3:
+        return {}, 0.0, 0
+    frames = [sample['frame'] / 1e6 for sample in steady]
+
+    growing = {}
+    names = set()
+    for sample in steady:
+        names.update(sample['objects'])
+    for name in names:
+        counts = [sample['objects'].get(name, 0) for sample in steady]
+        per_million = slope(frames, counts)
+        # a leak keeps climbing: require growth over the run, not just one spike
+        if per_million >= GROWTH_MIN_PER_MILLION and counts[-1] > counts[0] and counts[-1] >= max(counts[:-1]):
+            growing[name] = round(per_million, 1)
+
+    rss_slope = slope(frames, [sample['rss_kb'] for sample in steady])
+    return growing, round(rss_slope, 1), steady[-1]['frame'] - steady[0]['frame']
+
+
+class Soak:
+    def __init__(self, seed=0, draw_every=DEFAULT_DRAW_EVERY, sample_every=DEFAULT_SAMPLE_EVERY):
+        self.game = Replay._game()
+        self.rng = random.Random(seed)
+        self.draw_every = draw_every
+        self.sample_every = sample_every
+
+        self.latency = LatencyHistogram()
+        self.samples = []
+        self.timer_min = dict.fromkeys(TIMER_KEYS, 0.0)
+        self.rounds = 0
+        self.frame = 0
+
+        self.keys = Inputs.new_key_state()
+        self.round_frame = 0
+        self.script = ({}, {})
+
+    def _start_round(self):
+        game = self.game
+        game.selected_mode = 'pvp' if self.rounds % 2 else 'ai'
+        game.start_match(self.rng.getrandbits(63))
+        self.round_frame = 0
+        self.script = ({}, {})
+        self.rounds += 1
+
+    def sample(self):
+        objects = count_objects(self.samples)
+        sample = {
+            'frame': self.frame,
+            'rss_kb': rss_kb(),
+            'blocks': sys.getallocatedblocks(),
+            'objects': dict(objects),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def run(self, frames, progress=True):
+        game = self.game
+        rng = self.rng
+        keys = self.keys
+        timer_min = self.timer_min
+        perf_ns = time.perf_counter_ns
+        draw_every = self.draw_every
+        sample_every = self.sample_every
+
+        self._start_round()
+        self.sample()
+        started = time.perf_counter()
+
+        for _ in range(frames):
+            state = game.game_state
+            if state['game_over'] or self.round_frame >= MAX_ROUND_FRAMES:
+                self._start_round()
+                state = game.game_state
+
+            t0 = perf_ns()
+            Inputs.apply_input(game, keys, 'blue', Inputs.scripted_input(rng, self.script[0]))
+            if game.selected_mode == 'pvp':
+                Inputs.apply_input(game, keys, 'red', Inputs.scripted_input(rng, self.script[1]))
+            game.update_game(FRAME_MS, keys)
+            if draw_every and self.frame % draw_every == 0:
+                game.draw_game()
+            self.latency.add(perf_ns() - t0)
+
+            for key in TIMER_KEYS:
+                value = state[key]
+                if value < timer_min[key]:
+                    timer_min[key] = value
+
+            self.frame += 1
+            self.round_frame += 1
+
+            if self.frame % sample_every == 0:
+                sample = self.sample()
+                if progress:
+                    elapsed = time.perf_counter() - started
+                    watched = " ".join(f"{name}={sample['objects'].get(name, 0)}" for name in ('Rect', 'Surface'))
+                    print(f"{self.frame:>11,} frames  {self.frame / elapsed:,.0f} fps  rss {sample['rss_kb'] / 1024:.1f} MB  "
+                          f"p99 {self.latency.percentile(99):.0f}us  {watched}", flush=True)
+
+        if self.frame % sample_every:
+            self.sample()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed):
+        growing, rss_slope, fitted_frames = growth_report(self.samples)
+        rss_judged = fitted_frames >= RSS_GATE_MIN_FRAMES
+        negative_timers = {key: round(value, 3) for key, value in self.timer_min.items() if value < -FRAME_MS}
+        return {
+            'frames': self.frame,
+            'rounds': self.rounds,
+            'seconds': round(elapsed, 1),
+            'frames_per_second': round(self.frame / elapsed) if elapsed else 0,
+            'latency_us': {f"p{p}": round(self.latency.percentile(p), 1) for p in (50, 90, 99, 99.9)}
+                          | {'max': round(self.latency.max_ns / 1000, 1)},
+            'rss_kb': {'start': self.samples[0]['rss_kb'], 'end': self.samples[-1]['rss_kb'],
+                       'growth_per_million_frames': rss_slope, 'fitted_frames': fitted_frames, 'judged': rss_judged},
+            'objects_end': {name: self.samples[-1]['objects'].get(name, 0) for name in WATCHED_TYPES},
+            'growing_types': growing,
+            'timer_min': {key: round(value, 3) for key, value in self.timer_min.items()},
+            'negative_timers': negative_timers,
+            'ok': not growing and not (rss_judged and rss_slope >= RSS_GROWTH_MIN_KB_PER_MILLION) and not negative_timers,
+            'conclusive': bool(fitted_frames),
+        }
+
+
+def verdict(report):
+    """FAIL if anything was flagged, else INCONCLUSIVE if growth couldn't be measured at all, else PASS."""
+    if not report['ok']:
+        return 'FAIL'
+    return 'PASS' if report['conclusive'] else 'INCONCLUSIVE'
+
+
+def print_report(report):
+    print(f"\n{report['frames']:,} frames, {report['rounds']:,} rounds in {report['seconds']}s "
+          f"({report['frames_per_second']:,} fps)")
+    latency = report['latency_us']
+    print("frame latency (us): " + "  ".join(f"{name} {value}" for name, value in latency.items()))
+    rss = report['rss_kb']
+    print(f"rss: {rss['start'] / 1024:.1f} MB -> {rss['end'] / 1024:.1f} MB "
+          f"({rss['growth_per_million_frames']} KB per million frames)")
+    print("objects at end: " + "  ".join(f"{name} {count}" for name, count in report['objects_end'].items()))
+    for name, per_million in sorted(report['growing_types'].items(), key=lambda item: -item[1]):
+        print(f"LEAK? {name} grows by {per_million} per million frames")
+    if not rss['fitted_frames']:
+        print(f"growth not judged: the run is too short to sample after the {WARMUP_FRAMES:,} frame warm-up")
+    elif not rss['judged']:
+        print(f"rss growth not judged: {rss['fitted_frames']:,} frames after warm-up, "
+              f"{RSS_GATE_MIN_FRAMES:,} needed (raise --frames)")
+    elif rss['growth_per_million_frames'] >= RSS_GROWTH_MIN_KB_PER_MILLION:
+        print(f"LEAK? rss grows by {rss['growth_per_million_frames']} KB per million frames")
+    for key, value in report['negative_timers'].items():
+        print(f"DRIFT {key} reached {value} ms (more than one frame below zero)")
+    print("SOAK", verdict(report))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long headless soak run of the Cube Combat simulation")
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES)
+    parser.add_argument('--sample-every', type=int, default=DEFAULT_SAMPLE_EVERY, help="frames between memory samples")
+    parser.add_argument('--draw-every', type=int, default=DEFAULT_DRAW_EVERY, help="draw one frame in N (0: never draw)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help="also write the report (with every sample) to this file")
+    args = parser.parse_args()
+
+    soak = Soak(args.seed, args.draw_every, args.sample_every)
+    report = soak.run(args.frames)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report | {'samples': soak.samples}, f, indent=1)
+    return {'PASS': 0, 'FAIL': 1, 'INCONCLUSIVE': 2}[verdict(report)]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Tile renderer for Cube Combat arenas.
+
+An arena's floor and walls never change during a fight, so they are drawn
+once, tile by tile, into baked surfaces, and a frame never touches a tile
+again. An arena that fits on screen is baked into a single converted
+surface. A bigger one is baked in CHUNK_SIZE squares, kept in an LRU cache
+of MAX_CHUNKS, and the camera scrolls over it, following a point Greg
+picks (P1, or the middle of the fight in PvP).
+
+On the software path each frame starts with begin_frame(). That restores
+the baked background only under the rects last frame's moving things
+covered. Greg then draws the cubes, attacks and HUD, and mark()s each rect
+it drew. end_frame() returns the rects to hand to pygame.display.update(),
+which are last frame's plus this frame's. The whole view is only redrawn
+when the camera moves, the target surface changes, or invalidate() is
+called, which Greg does whenever something else has drawn over the screen.
+Arena art therefore costs nothing per frame, however detailed the tiles
+are.
+
+    view = TileRenderer((WIDTH, HEIGHT))
+    view.set_arena(arena, {'.': floor_tile, '#': wall_tile})
+    ...
+    view.begin_frame(screen, focus_x, focus_y)
+    draw_cube(x - view.camera.x, y - view.camera.y); view.mark(cube_rect)
+    pygame.display.update(view.end_frame())
+
+With a GPU renderer the whole frame is redrawn anyway. There,
+begin_frame(None, ...) only moves the camera, and visible_chunks() gives
+the baked chunks to draw as textures.
+"""
+
+from collections import OrderedDict
+
+import pygame
+
+CHUNK_SIZE = 256
+MAX_CHUNKS = 96         # 256x256 at 4 bytes a pixel is 256 KB, so about 24 MB of baked chunks
+FULL_REDRAW_SHARE = 0.5 # past this share of the view, restoring rect by rect costs more than one full blit
+POOLED_RECTS = 32       # marks a frame can make before the pool has to grow
+FLOOR = '.'
+
+
+class Camera:
+    """The top-left of the view in arena pixels, kept inside the arena."""
+
+    def __init__(self, view_size, world_size):
+        self.w, self.h = view_size
+        self.world_w, self.world_h = world_size
+        self.x = 0
+        self.y = 0
+
+    def follow(self, x, y):
+        """Centres the view on (x, y) as far as the arena allows. Returns True if it moved."""
+        new_x = max(0, min(int(x - self.w / 2), self.world_w - self.w))
+        new_y = max(0, min(int(y - self.h / 2), self.world_h - self.h))
+        if new_x == self.x and new_y == self.y:
+            return False
+        self.x, self.y = new_x, new_y
+        return True
+
+
+class TileRenderer:
+    def __init__(self, view_size, chunk_size=CHUNK_SIZE, max_chunks=MAX_CHUNKS):
+        self.view_rect = pygame.Rect((0, 0), view_size)
+        self.default_chunk_size = chunk_size
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.arena = None
+        self.tiles = {}
+        self.camera = Camera(view_size, view_size)
+        self.chunks = OrderedDict()     # (col, row) -> baked Surface, least recently used first
+        self.chunk_cols = self.chunk_rows = 0
+
+        self.surface = None             # what the last frame was drawn on
+        self.full = True
+        # rects drawn last frame and this frame; reused so a frame doesn't build new Rects
+        self.previous = [pygame.Rect(0, 0, 0, 0) for _ in range(POOLED_RECTS)]
+        self.previous_count = 0
+        self.current = [pygame.Rect(0, 0, 0, 0) for _ in range(POOLED_RECTS)]
+        self.current_count = 0
+        self.updates = []
+        self.bakes = 0
+        self.full_redraws = 0
+
+    def set_arena(self, arena, tiles):
+        """
+        Bakes `arena` (an Arena.Arena) with `tiles`, a dict of layout
+        character to cell-sized Surface. A small arena becomes one surface.
+        Chunks of a big one are baked up front while they fit in the cache.
+        """
+        self.arena = arena
+        self.tiles = tiles
+        self.chunks.clear()
+        view_w, view_h = self.view_rect.size
+        if arena.width <= view_w and arena.height <= view_h:
+            self.chunk_size = max(arena.width, arena.height)
+        else:
+            self.chunk_size = self.default_chunk_size
+        self.chunk_cols = -(-arena.width // self.chunk_size)
+        self.chunk_rows = -(-arena.height // self.chunk_size)
+        self.camera = Camera(self.view_rect.size, (arena.width, arena.height))
+        self.invalidate()
+
+        for row in range(self.chunk_rows):
+            for col in range(self.chunk_cols):
+                if len(self.chunks) >= self.max_chunks:
+                    return
+                self._chunk(col, row)
+
+    def invalidate(self):
+        """The next frame redraws the whole view, e.g. after a menu drew over the screen."""
+        self.full = True
+
+    # baking
+
+    def _chunk(self, col, row):
+        chunk = self.chunks.get((col, row))
+        if chunk is None:
+            chunk = self.chunks[(col, row)] = self._bake(col, row)
+            if len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end((col, row))
+        return chunk
+
+    def _bake(self, col, row):
+        arena = self.arena
+        size = self.chunk_size
+        cell = arena.cell_size
+        x0, y0 = col * size, row * size
+        w = min(size, arena.width - x0)
+        h = min(size, arena.height - y0)
+        surface = pygame.Surface((w, h))
+
+        floor = self.tiles[FLOOR]
+        for r in range(y0 // cell, (y0 + h - 1) // cell + 1):
+            line = arena.layout[r]
+            for c in range(x0 // cell, (x0 + w - 1) // cell + 1):
+                pos = (c * cell - x0, r * cell - y0)
+                surface.blit(floor, pos)
+                if line[c] != FLOOR:
+                    surface.blit(self.tiles[line[c]], pos)
+
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        self.bakes += 1
+        return surface
+
+    # drawing
+
+    def visible_chunks(self):
+        """(baked Surface, screen position) for every chunk the view overlaps."""
+        size = self.chunk_size
+        camera = self.camera
+        for row in range(camera.y // size, min((camera.y + camera.h - 1) // size + 1, self.chunk_rows)):
+            for col in range(camera.x // size, min((camera.x + camera.w - 1) // size + 1, self.chunk_cols)):
+                yield self._chunk(col, row), (col * size - camera.x, row * size - camera.y)
+
+    def _restore(self, surface, rect):
+        """Copies the baked background back under `rect` (screen coordinates)."""
+        size = self.chunk_size
+        left = rect.x + self.camera.x
+        top = rect.y + self.camera.y
+        right = min(left + rect.w, self.arena.width)
+        bottom = min(top + rect.h, self.arena.height)
+        left, top = max(left, 0), max(top, 0)
+        for row in range(top // size, (bottom - 1) // size + 1):
+            for col in range(left // size, (right - 1) // size + 1):
+                x0, y0 = col * size, row * size
+                ax, ay = max(left, x0), max(top, y0)
+                aw = min(right, x0 + size) - ax
+                ah = min(bottom, y0 + size) - ay
+                surface.blit(self._chunk(col, row), (ax - self.camera.x, ay - self.camera.y),
+                             (ax - x0, ay - y0, aw, ah))
+
+    def begin_frame(self, surface, focus_x, focus_y):
+        """
+        Moves the camera to `focus` and puts the background back on
+        `surface`, either everywhere or only where last frame drew.
+        With surface=None (a GPU frame) only the camera moves.
+        """
+        moved = self.camera.follow(focus_x, focus_y)
+        self.current_count = 0
+        if surface is None:
+            return
+        if moved or surface is not self.surface:
+            self.full = True
+        self.surface = surface
+
+        if not self.full:
+            view = self.view_rect
+            area = 0
+            for i in range(self.previous_count):
+                rect = self.previous[i]
+                area += rect.w * rect.h
+            # a beam's bounding box alone can cover most of the screen
+            self.full = area > view.w * view.h * FULL_REDRAW_SHARE
+
+        if self.full:
+            for chunk, pos in self.visible_chunks():
+                surface.blit(chunk, pos)
+            self.full_redraws += 1
+        else:
+            view = self.view_rect
+            for i in range(self.previous_count):
+                rect = self.previous[i]
+                if rect.colliderect(view):
+                    self._restore(surface, rect.clip(view))
+
+    def mark(self, rect):
+        """Records a rect (screen coordinates) drawn this frame, to restore and update."""
+        if self.current_count < len(self.current):
+            self.current[self.current_count].update(rect)
+        else:
+            self.current.append(pygame.Rect(rect))
+        self.current_count += 1
+
+    def end_frame(self):
+        """The screen rects that changed this frame, for pygame.display.update()."""
+        updates = self.updates
+        updates.clear()
+        if self.full:
+            updates.append(self.view_rect)
+            self.full = False
+        else:
+            for i in range(self.previous_count):
+                updates.append(self.previous[i])
+            for i in range(self.current_count):
+                updates.append(self.current[i])
+
+        self.previous, self.current = self.current, self.previous
+        self.previous_count, self.current_count = self.current_count, 0
+        return updates
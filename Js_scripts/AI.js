@@ -2,6 +2,9 @@ const chatBox = document.getElementById('chat-box');
         const messageInput = document.getElementById('message-input');
         const sendButton = document.getElementById('send-button');
 
+        // served by Fight/Site_server.py, which streams from the ollama server; opened from disk, talk to it on its default port
+        const CHAT_URL = location.protocol === 'file:' ? 'http://localhost:8000/api/chat' : '/api/chat';
+
         async function sendMessage() {
             const message = messageInput.value.trim();
 
@@ -13,26 +16,61 @@ const chatBox = document.getElementById('chat-box');
             appendMessage('user', message);
             messageInput.value = '';
 
+            const reply = appendMessage('assistant', '…');
+            let text = '';
+
             try {
-                const response = await fetch('http://localhost:11434/api/generate', {
+                const response = await fetch(CHAT_URL, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
                         model: 'mistral',
-                        prompt: message,
-                        stream: false
+                        prompt: message
                     }),
                 });
 
-                const data = await response.json();
-                if (!response.ok) throw new Error('API request failed');
+                if (!response.ok) throw new Error(`API request failed (${response.status})`);
+
+                // server-sent events: "data: {token}" per token, plus queued / done / error events
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
 
-                appendMessage('assistant', data.response);
+                    let end;
+                    while ((end = buffer.indexOf('\n\n')) !== -1) {
+                        const event = parseEvent(buffer.slice(0, end));
+                        buffer = buffer.slice(end + 2);
+
+                        if (event.type === 'queued') {
+                            reply.textContent = `… (waiting, ${event.data.position} ahead of you)`;
+                        } else if (event.type === 'error') {
+                            throw new Error(event.data.error);
+                        } else if (event.type === 'message') {
+                            text += event.data.token;
+                            reply.textContent = text;
+                            chatBox.scrollTop = chatBox.scrollHeight;
+                        }
+                    }
+                }
             } catch (error) {
-                appendMessage('assistant', `⚠️ Error: ${error.message}`);
+                reply.textContent = text ? `${text}\n⚠️ Error: ${error.message}` : `⚠️ Error: ${error.message}`;
+            }
+        }
+
+        function parseEvent(block) {
+            const event = { type: 'message', data: {} };
+            for (const line of block.split('\n')) {
+                if (line.startsWith('event: ')) event.type = line.slice(7);
+                else if (line.startsWith('data: ')) event.data = JSON.parse(line.slice(6));
             }
+            return event;
         }
 
         function appendMessage(role, text) {
@@ -41,9 +79,10 @@ const chatBox = document.getElementById('chat-box');
             msg.textContent = text;
             chatBox.appendChild(msg);
             chatBox.scrollTop = chatBox.scrollHeight;
+            return msg;
         }
 
         sendButton.addEventListener('click', sendMessage);
         messageInput.addEventListener('keypress', (e) => {
             if (e.key === 'Enter') sendMessage();
-        });
\ No newline at end of file
+        });